@@ -0,0 +1,275 @@
+from typing import Iterable, NamedTuple
+
+try:
+    import numpy as np
+except ImportError as error:
+    raise ImportError("batch_movegen needs NumPy, install it with 'pip install numpy'") from error
+
+from chess_board import KING_DIRECTIONS, KNIGHT_DIRECTIONS
+from chess_bitboard import (CASTLE_BLACK_KING, CASTLE_BLACK_QUEEN, CASTLE_WHITE_KING, CASTLE_WHITE_QUEEN,
+                            CASTLING_SYMBOLS, PIECE_SYMBOLS)
+
+# Piece codes in the N x 64 arrays: 0 for an empty square, then 'PNBRQKpnbrqk' as 1..12
+EMPTY = 0
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PAD = 64  # Extra square index used to pad rays shorter than seven squares
+
+ORTHOGONAL = [index for index, (dx, dy) in enumerate(KING_DIRECTIONS) if dx == 0 or dy == 0]
+
+
+class PositionBatch(NamedTuple):
+    """N positions as packed arrays, with squares numbered row * 8 + col like ChessBoard."""
+    pieces: np.ndarray  # N x 64 uint8 piece codes
+    side: np.ndarray  # N uint8, 0 when white is to move
+    castling: np.ndarray  # N uint8 castling rights bits, as in chess_bitboard
+    en_passant: np.ndarray  # N int8 en passant target square, -1 for none
+
+
+def _build_tables():
+    ray_targets = np.full((8, 64, 7), PAD, dtype=np.intp)
+    for direction, (dx, dy) in enumerate(KING_DIRECTIONS):
+        for square in range(64):
+            row, col = divmod(square, 8)
+            for step in range(7):
+                row, col = row + dx, col + dy
+                if not (0 <= row < 8 and 0 <= col < 8):
+                    break
+                ray_targets[direction, square, step] = row * 8 + col
+    knight = np.zeros((64, 64), dtype=bool)
+    king = np.zeros((64, 64), dtype=bool)
+    pawn_captures = np.zeros((2, 64, 64), dtype=bool)
+    pawn_pushes = np.zeros((2, 64, 64), dtype=bool)
+    pawn_doubles = np.zeros((2, 64, 64), dtype=bool)
+    pawn_middle = np.full((2, 64), PAD, dtype=np.intp)  # Square a double push passes over
+    for square in range(64):
+        row, col = divmod(square, 8)
+        for table, deltas in ((knight, KNIGHT_DIRECTIONS), (king, KING_DIRECTIONS)):
+            for dx, dy in deltas:
+                if 0 <= row + dx < 8 and 0 <= col + dy < 8:
+                    table[square, (row + dx) * 8 + col + dy] = True
+        for side, forward, start_row in ((0, -1, 6), (1, 1, 1)):
+            if not 0 <= row + forward < 8:
+                continue
+            pawn_pushes[side, square, (row + forward) * 8 + col] = True
+            for dy in (-1, 1):
+                if 0 <= col + dy < 8:
+                    pawn_captures[side, square, (row + forward) * 8 + col + dy] = True
+            if row == start_row:
+                pawn_doubles[side, square, (row + 2 * forward) * 8 + col] = True
+                pawn_middle[side, square] = (row + forward) * 8 + col
+    between = np.zeros((64, 64, 64), dtype=bool)
+    for direction in range(8):
+        for square in range(64):
+            targets = [target for target in ray_targets[direction, square] if target != PAD]
+            for index, target in enumerate(targets):
+                between[square, target, targets[:index]] = True
+    return ray_targets, knight, king, pawn_captures, pawn_pushes, pawn_doubles, pawn_middle, between
+
+
+RAY_TARGETS, KNIGHT_MOVES, KING_MOVES, PAWN_CAPTURES, PAWN_PUSHES, PAWN_DOUBLES, PAWN_MIDDLE, BETWEEN = _build_tables()
+RAY_VALID = RAY_TARGETS != PAD
+RAY_SOURCES = np.broadcast_to(np.arange(64)[:, None], (64, 7))
+
+# (right, king square, king target, rook square, squares that must be empty, squares that must not be attacked)
+CASTLING_MOVES = [
+    (CASTLE_WHITE_KING, 60, 62, 63, [61, 62], [61, 62]),
+    (CASTLE_WHITE_QUEEN, 60, 58, 56, [57, 58, 59], [58, 59]),
+    (CASTLE_BLACK_KING, 4, 6, 7, [5, 6], [5, 6]),
+    (CASTLE_BLACK_QUEEN, 4, 2, 0, [1, 2, 3], [2, 3]),
+]
+
+
+def positions_from_fens(fens: Iterable[str]) -> PositionBatch:
+    """Pack FEN strings into a PositionBatch."""
+    fens = list(fens)
+    pieces = np.zeros((len(fens), 64), dtype=np.uint8)
+    side = np.zeros(len(fens), dtype=np.uint8)
+    castling = np.zeros(len(fens), dtype=np.uint8)
+    en_passant = np.full(len(fens), -1, dtype=np.int8)
+    for index, fen in enumerate(fens):
+        fen_parts = fen.split(' ')
+        for row, fen_row in enumerate(fen_parts[0].split('/')):
+            col = 0
+            for char in fen_row:
+                if char.isdigit():
+                    col += int(char)
+                else:
+                    code = PIECE_SYMBOLS.find(char)
+                    if code < 0:
+                        raise ValueError(f"Invalid FEN string: {fen}")
+                    pieces[index, row * 8 + col] = code + 1
+                    col += 1
+        side[index] = 0 if fen_parts[1] == 'w' else 1
+        for bit, symbol in CASTLING_SYMBOLS:
+            if symbol in fen_parts[2]:
+                castling[index] |= bit
+        if fen_parts[3] != '-':
+            en_passant[index] = (8 - int(fen_parts[3][1])) * 8 + ord(fen_parts[3][0]) - ord('a')
+    return PositionBatch(pieces, side, castling, en_passant)
+
+
+def _slider_reach(occupied: np.ndarray):
+    """Squares each square reaches along rook lines and along bishop lines, stopping at the first piece."""
+    count = len(occupied)
+    occupied = np.concatenate([occupied, np.zeros((count, 1), dtype=bool)], axis=1)
+    orthogonal = np.zeros((count, 64, PAD + 1), dtype=bool)
+    diagonal = np.zeros((count, 64, PAD + 1), dtype=bool)
+    for direction in range(8):
+        along = occupied[:, RAY_TARGETS[direction]]  # N x 64 x 7
+        blocked_before = np.zeros_like(along)
+        for step in range(1, 7):  # Seven short steps beat logical_or.accumulate on bool arrays
+            np.logical_or(blocked_before[..., step - 1], along[..., step - 1], out=blocked_before[..., step])
+        reach = RAY_VALID[direction] & ~blocked_before
+        target = orthogonal if direction in ORTHOGONAL else diagonal
+        target[:, RAY_SOURCES, RAY_TARGETS[direction]] |= reach
+    return orthogonal[..., :64], diagonal[..., :64]
+
+
+def _attacks_from(pieces: np.ndarray, color: np.ndarray, orthogonal: np.ndarray, diagonal: np.ndarray) -> np.ndarray:
+    """N x 64 x 64 mask of the squares each piece of the given color (per position) attacks."""
+    offset = (6 * color.astype(np.uint8) + 1)[:, None]
+
+    def is_type(piece_type):
+        return (pieces == offset + piece_type)[:, :, None]
+
+    return ((is_type(KNIGHT) & KNIGHT_MOVES)
+            | (is_type(KING) & KING_MOVES)
+            | (is_type(PAWN) & PAWN_CAPTURES[color])
+            | ((is_type(ROOK) | is_type(QUEEN)) & orthogonal)
+            | ((is_type(BISHOP) | is_type(QUEEN)) & diagonal))
+
+
+def attack_maps(batch: PositionBatch) -> np.ndarray:
+    """N x 2 x 64 mask of the squares attacked by white ([:, 0]) and by black ([:, 1])."""
+    orthogonal, diagonal = _slider_reach(batch.pieces > EMPTY)
+    count = len(batch.pieces)
+    return np.stack([_attacks_from(batch.pieces, np.full(count, color), orthogonal, diagonal).any(axis=1)
+                     for color in (0, 1)], axis=1)
+
+
+def legal_move_masks(batch: PositionBatch, chunk_size: int = 256) -> np.ndarray:
+    """N x 64 x 64 from-to mask of the legal moves of the side to move in every position.
+
+    Follows the same rules as ChessBoard, including castling and en passant; the four
+    promotions of a pawn share one from-to entry, like ChessBoard's available moves.
+    Positions without a king of the side to move get their pseudo-legal moves.
+    """
+    masks = np.zeros((len(batch.pieces), 64, 64), dtype=bool)
+    for start in range(0, len(batch.pieces), chunk_size):
+        chunk = PositionBatch(*(array[start:start + chunk_size] for array in batch))
+        masks[start:start + chunk_size] = _legal_move_masks(chunk)
+    return masks
+
+
+def _legal_move_masks(batch: PositionBatch) -> np.ndarray:
+    pieces, side, castling, en_passant = batch
+    count = len(pieces)
+    rows = np.arange(count)
+    side = side.astype(np.intp)
+    occupied = pieces > EMPTY
+    black_piece = pieces > 6
+    own = occupied & (black_piece == side.astype(bool)[:, None])
+    enemy = occupied & ~own
+    own_offset = (6 * side + 1)[:, None]
+    own_king = pieces == own_offset + KING
+    has_king = own_king.any(axis=1)
+    king = own_king.argmax(axis=1)
+
+    # Enemy attacks with our king lifted off the board, so the king cannot retreat along a checking ray
+    without_king = occupied.copy()
+    without_king[rows[has_king], king[has_king]] = False
+    enemy_attacks_from = _attacks_from(pieces, 1 - side, *_slider_reach(without_king))
+    attacked = enemy_attacks_from.any(axis=1)
+    checkers = enemy_attacks_from[rows, :, king] & has_king[:, None]
+    checker_count = checkers.sum(axis=1)
+    in_check = checker_count > 0
+
+    # Pseudo-legal moves of everything but the king
+    own_attacks_from = _attacks_from(pieces, side, *_slider_reach(occupied))
+    own_pawns = pieces == own_offset + PAWN
+    non_pawns = own & ~own_pawns & ~own_king
+    moves = own_attacks_from & non_pawns[:, :, None] & ~own[:, None, :]
+    en_passant_targets = np.zeros((count, 64), dtype=bool)
+    has_en_passant = en_passant >= 0
+    en_passant_targets[rows[has_en_passant], en_passant[has_en_passant]] = True
+    captures = PAWN_CAPTURES[side] & (enemy | en_passant_targets)[:, None, :]
+    empty = ~occupied
+    pushes = PAWN_PUSHES[side] & empty[:, None, :]
+    middle_empty = np.concatenate([empty, np.zeros((count, 1), dtype=bool)], axis=1)[rows[:, None], PAWN_MIDDLE[side]]
+    doubles = PAWN_DOUBLES[side] & empty[:, None, :] & middle_empty[:, :, None]
+    moves |= (captures | pushes | doubles) & own_pawns[:, :, None]
+
+    # Check evasions: block or capture a single checker, nothing but the king against a double check
+    checker = checkers.argmax(axis=1)
+    evasion = np.where(in_check[:, None], BETWEEN[king, checker], True)
+    evasion[rows[in_check], checker[in_check]] = True
+    evasion &= (checker_count < 2)[:, None]
+    en_passant_moves = moves & en_passant_targets[:, None, :] & own_pawns[:, :, None]
+    captured_square = np.where(side == 0, en_passant.astype(np.intp) + 8, en_passant.astype(np.intp) - 8)
+    captured_square = np.clip(captured_square, 0, 63)
+    # En passant also answers a check from the pawn it removes
+    en_passant_evasion = evasion[rows, captured_square] & has_en_passant
+    allowed = evasion[:, None, :] | (en_passant_moves & en_passant_evasion[:, None, None])
+
+    # Pinned pieces may only move along the line between their king and the pinning slider
+    pieces_padded = np.concatenate([pieces, np.zeros((count, 1), dtype=pieces.dtype)], axis=1)
+    for direction in range(8):
+        ray = RAY_TARGETS[direction][king]  # N x 7
+        codes = pieces_padded[rows[:, None], ray]
+        on_ray = codes > EMPTY
+        seen = np.cumsum(on_ray, axis=1)
+        first = on_ray.argmax(axis=1)
+        second_on_ray = on_ray & (seen == 2)
+        second = second_on_ray.argmax(axis=1)
+        first_code = codes[rows, first].astype(np.intp)
+        second_code = codes[rows, second].astype(np.intp)
+        enemy_offset = 6 * (1 - side) + 1
+        slider = ROOK if direction in ORTHOGONAL else BISHOP
+        pinned = (on_ray.any(axis=1) & has_king & second_on_ray.any(axis=1)
+                  & (first_code >= own_offset[:, 0]) & (first_code < own_offset[:, 0] + 6)
+                  & ((second_code == enemy_offset + slider) | (second_code == enemy_offset + QUEEN)))
+        if not pinned.any():
+            continue
+        pin_ray = np.zeros((count, PAD + 1), dtype=bool)
+        pin_ray[rows[:, None], ray] = np.arange(7)[None, :] <= second[:, None]
+        pinned_rows = rows[pinned]
+        allowed[pinned_rows, ray[pinned_rows, first[pinned_rows]]] &= pin_ray[pinned_rows, :64]
+
+    legal = moves & allowed & has_king[:, None, None] | moves & ~has_king[:, None, None]
+
+    # En passant can uncover a rook or queen along the rank of both pawns; rare enough to check one by one
+    for row_index, from_square in zip(*np.nonzero(en_passant_moves.any(axis=2) & has_king[:, None])):
+        target = en_passant[row_index]
+        if legal[row_index, from_square, target] and not _en_passant_keeps_king_safe(
+                pieces[row_index], side[row_index], king[row_index], from_square, target, captured_square[row_index]):
+            legal[row_index, from_square, target] = False
+
+    # King steps and castling
+    king_moves = KING_MOVES[king] & ~own & ~attacked & has_king[:, None]
+    legal[rows, king] |= king_moves
+    for right, king_square, king_target, rook_square, empty_squares, safe_squares in CASTLING_MOVES:
+        color = 0 if king_square == 60 else 1
+        rook_code = 6 * color + 1 + ROOK
+        castle = ((castling & right) > 0) & (side == color) & ~in_check & has_king & (king == king_square)
+        castle &= pieces[:, rook_square] == rook_code
+        castle &= empty[:, empty_squares].all(axis=1) & ~attacked[:, safe_squares].any(axis=1)
+        legal[rows[castle], king_square, king_target] = True
+    return legal
+
+
+def _en_passant_keeps_king_safe(pieces: np.ndarray, side: int, king: int, from_square: int, target: int,
+                                captured: int) -> bool:
+    occupied = pieces > EMPTY
+    occupied[[from_square, captured]] = False
+    occupied[target] = True
+    enemy_offset = 6 * (1 - side) + 1
+    for direction, (dx, dy) in enumerate(KING_DIRECTIONS):
+        slider = ROOK if direction in ORTHOGONAL else BISHOP
+        for square in RAY_TARGETS[direction, king]:
+            if square == PAD:
+                break
+            if occupied[square]:
+                if pieces[square] in (enemy_offset + slider, enemy_offset + QUEEN) and square != captured:
+                    return False
+                break
+    return True
@@ -0,0 +1,690 @@
+from array import array
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from chess_board import (WHITE, BLACK, KING_DIRECTIONS, KNIGHT_DIRECTIONS, ChessPiece,
+                         King, Queen, Rook, Bishop, Knight, Pawn, CHECKMATE, STALEMATE, FIFTY_MOVE_RULE,
+                         THREEFOLD_REPETITION, INSUFFICIENT_MATERIAL, ONGOING, encode_move, insufficient_material)
+from evaluation import PHASE_WEIGHTS, PIECE_SQUARE, evaluation_terms, hash_pawns
+from zobrist import ZOBRIST_BLACK_TO_MOVE, ZOBRIST_EN_PASSANT_FILE, ZOBRIST_PIECES, castling_key, hash_position
+
+# Squares are numbered row * 8 + col with row 0 at the top (black's back rank), like ChessBoard.board
+PAWN, KNIGHT, BISHOP, ROOK, QUEEN, KING = range(6)
+PIECE_SYMBOLS = 'PNBRQKpnbrqk'  # Piece code = piece type + 6 for black
+PIECE_CLASSES = [Pawn, Knight, Bishop, Rook, Queen, King]
+PROMOTION_TYPES = {'q': QUEEN, 'r': ROOK, 'b': BISHOP, 'n': KNIGHT}
+PROMOTION_SYMBOLS = {QUEEN: 'q', ROOK: 'r', BISHOP: 'b', KNIGHT: 'n'}
+
+# Castling rights as bits, and the rights that survive a move touching each square
+CASTLE_WHITE_KING, CASTLE_WHITE_QUEEN, CASTLE_BLACK_KING, CASTLE_BLACK_QUEEN = 1, 2, 4, 8
+CASTLING_SYMBOLS = [(CASTLE_WHITE_KING, 'K'), (CASTLE_WHITE_QUEEN, 'Q'), (CASTLE_BLACK_KING, 'k'), (CASTLE_BLACK_QUEEN, 'q')]
+CASTLING_KEEP = [15] * 64
+CASTLING_KEEP[63] = 15 ^ CASTLE_WHITE_KING
+CASTLING_KEEP[56] = 15 ^ CASTLE_WHITE_QUEEN
+CASTLING_KEEP[60] = 15 ^ (CASTLE_WHITE_KING | CASTLE_WHITE_QUEEN)
+CASTLING_KEEP[7] = 15 ^ CASTLE_BLACK_KING
+CASTLING_KEEP[0] = 15 ^ CASTLE_BLACK_QUEEN
+CASTLING_KEEP[4] = 15 ^ (CASTLE_BLACK_KING | CASTLE_BLACK_QUEEN)
+
+# Zobrist keys indexed by piece code and by castling rights mask, matching ChessBoard's keys
+PIECE_KEYS = [ZOBRIST_PIECES[symbol] for symbol in PIECE_SYMBOLS]
+# Packed evaluation scores and phase weights by piece code
+PIECE_SQUARE_SCORES = [PIECE_SQUARE[symbol] for symbol in PIECE_SYMBOLS]
+PIECE_PHASES = [PHASE_WEIGHTS[symbol] for symbol in PIECE_SYMBOLS]
+CASTLING_KEYS = [castling_key(''.join(symbol for bit, symbol in CASTLING_SYMBOLS if rights & bit)) for rights in range(16)]
+
+
+def _build_leaper_table(deltas: List[Tuple[int, int]]) -> List[int]:
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        bits = 0
+        for dx, dy in deltas:
+            new_row, new_col = row + dx, col + dy
+            if 0 <= new_row < 8 and 0 <= new_col < 8:
+                bits |= 1 << (new_row * 8 + new_col)
+        table.append(bits)
+    return table
+
+
+def _build_ray_table(dx: int, dy: int) -> List[int]:
+    table = []
+    for square in range(64):
+        row, col = divmod(square, 8)
+        bits = 0
+        new_row, new_col = row + dx, col + dy
+        while 0 <= new_row < 8 and 0 <= new_col < 8:
+            bits |= 1 << (new_row * 8 + new_col)
+            new_row += dx
+            new_col += dy
+        table.append(bits)
+    return table
+
+
+KNIGHT_ATTACKS = _build_leaper_table(KNIGHT_DIRECTIONS)
+KING_ATTACKS = _build_leaper_table(KING_DIRECTIONS)
+# PAWN_ATTACKS[side][square]: squares a pawn of that side attacks (white moves towards row 0)
+PAWN_ATTACKS = [_build_leaper_table([(-1, -1), (-1, 1)]), _build_leaper_table([(1, -1), (1, 1)])]
+
+# Rays are split by whether the square number grows along them, which decides if the
+# first blocker is the lowest or the highest set bit
+POSITIVE_ROOK_RAYS = [_build_ray_table(0, 1), _build_ray_table(1, 0)]
+NEGATIVE_ROOK_RAYS = [_build_ray_table(0, -1), _build_ray_table(-1, 0)]
+POSITIVE_BISHOP_RAYS = [_build_ray_table(1, 1), _build_ray_table(1, -1)]
+NEGATIVE_BISHOP_RAYS = [_build_ray_table(-1, -1), _build_ray_table(-1, 1)]
+ROOK_RAYS = [POSITIVE_ROOK_RAYS[0][square] | POSITIVE_ROOK_RAYS[1][square] | NEGATIVE_ROOK_RAYS[0][square] | NEGATIVE_ROOK_RAYS[1][square]
+             for square in range(64)]
+BISHOP_RAYS = [POSITIVE_BISHOP_RAYS[0][square] | POSITIVE_BISHOP_RAYS[1][square] | NEGATIVE_BISHOP_RAYS[0][square] | NEGATIVE_BISHOP_RAYS[1][square]
+               for square in range(64)]
+
+
+def _sliding_attacks(square: int, occupied: int, positive_rays: List[List[int]], negative_rays: List[List[int]]) -> int:
+    attacks = 0
+    for rays in positive_rays:
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[(blockers & -blockers).bit_length() - 1]
+        attacks |= ray
+    for rays in negative_rays:
+        ray = rays[square]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= rays[blockers.bit_length() - 1]
+        attacks |= ray
+    return attacks
+
+
+def rook_attacks(square: int, occupied: int) -> int:
+    return _sliding_attacks(square, occupied, POSITIVE_ROOK_RAYS, NEGATIVE_ROOK_RAYS)
+
+
+def bishop_attacks(square: int, occupied: int) -> int:
+    return _sliding_attacks(square, occupied, POSITIVE_BISHOP_RAYS, NEGATIVE_BISHOP_RAYS)
+
+
+def _build_between_table() -> List[List[int]]:
+    table = [[0] * 64 for _ in range(64)]
+    for square in range(64):
+        for dx, dy in KING_DIRECTIONS:
+            ray = _build_ray_table(dx, dy)
+            target_bits = ray[square]
+            while target_bits:
+                target = (target_bits & -target_bits).bit_length() - 1
+                target_bits &= target_bits - 1
+                table[square][target] = ray[square] & ~ray[target] & ~(1 << target)
+    return table
+
+
+# BETWEEN[a][b]: squares strictly between two squares on a common line, 0 when they are not aligned
+BETWEEN = _build_between_table()
+
+
+class BitboardChessBoard:
+    """Drop-in alternative to ChessBoard that keeps the position in 64-bit integer bitboards."""
+
+    def __init__(self):
+        self.bitboards = [0] * 12  # One bitboard per piece code
+        self.occupancy = [0, 0]  # White pieces, black pieces
+        self.squares: List[Optional[int]] = [None] * 64  # Piece code per square for O(1) lookups
+        self.side = 0  # 0 for white, 1 for black
+        self.castling_rights = 0
+        self.en_passant_square: Optional[int] = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 0
+        self.zobrist_key = 0
+        # Evaluation terms kept up to date by push, see evaluation.evaluate
+        self.piece_square_score = 0
+        self.phase = 0
+        self.pawn_key = 0
+        self._undo_stack = []
+        self._legal_moves: Optional[List[int]] = None
+        self._piece_views: Optional[List[Optional[ChessPiece]]] = None
+
+    @property
+    def active_color(self) -> str:
+        return WHITE if self.side == 0 else BLACK
+
+    @property
+    def castling(self) -> str:
+        castling = ''.join(symbol for bit, symbol in CASTLING_SYMBOLS if self.castling_rights & bit)
+        return castling if castling else '-'
+
+    @property
+    def en_passant(self) -> Optional[Tuple[int, int]]:
+        if self.en_passant_square is None:
+            return None
+        return divmod(self.en_passant_square, 8)
+
+    def _get_active_color(self) -> str:
+        return self.active_color
+
+    def _get_en_passant(self) -> Optional[Tuple[int, int]]:
+        return self.en_passant
+
+    def get_piece(self, row, col) -> Optional[ChessPiece]:
+        """Return a ChessPiece view of the square, with available moves filled in for the side to move."""
+        if self._piece_views is None:
+            self._build_piece_views()
+        return self._piece_views[row * 8 + col]
+
+    def _build_piece_views(self):
+        views = [None] * 64
+        for square, code in enumerate(self.squares):
+            if code is not None:
+                row, col = divmod(square, 8)
+                views[square] = PIECE_CLASSES[code % 6](WHITE if code < 6 else BLACK, row, col)
+        for move in self.generate_legal_moves():
+            piece = views[move & 63]
+            target = divmod((move >> 6) & 63, 8)
+            if target not in piece.available_moves:  # The four promotions share a target square
+                piece.available_moves.append(target)
+        self._piece_views = views
+
+    def _clear(self):
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.squares = [None] * 64
+
+    def _put(self, code: int, square: int):
+        bit = 1 << square
+        self.bitboards[code] |= bit
+        self.occupancy[code >= 6] |= bit
+        self.squares[square] = code
+
+    def process_fen_string(self, fen: str):
+        fen_parts = fen.split(' ')
+        self._clear()
+        for row, fen_row in enumerate(fen_parts[0].split('/')):
+            col = 0
+            for char in fen_row:
+                if char.isdigit():
+                    col += int(char)
+                else:
+                    code = PIECE_SYMBOLS.find(char)
+                    if code < 0:
+                        raise ValueError(f"Invalid FEN string: {fen}")
+                    self._put(code, row * 8 + col)
+                    col += 1
+        self.side = 0 if fen_parts[1] == WHITE else 1
+        self.castling_rights = 0
+        for bit, symbol in CASTLING_SYMBOLS:
+            if symbol in fen_parts[2]:
+                self.castling_rights |= bit
+        if fen_parts[3] == '-':
+            self.en_passant_square = None
+        else:
+            self.en_passant_square = (8 - int(fen_parts[3][1])) * 8 + ord(fen_parts[3][0]) - ord('a')
+        self.halfmove_clock = int(fen_parts[4])
+        self.fullmove_number = int(fen_parts[5])
+        self._undo_stack = []
+        self.zobrist_key = hash_position(self.get_piece_squares(), self.active_color, self.castling, self.en_passant)
+        self.piece_square_score, self.phase = evaluation_terms(self.get_piece_squares())
+        self.pawn_key = hash_pawns(self.get_piece_squares())
+        self._legal_moves = None
+        self._piece_views = None
+
+    def get_piece_squares(self) -> List[Tuple[str, int]]:
+        """List every piece as its FEN symbol and its square number (row * 8 + col)."""
+        return [(PIECE_SYMBOLS[code], square) for square, code in enumerate(self.squares) if code is not None]
+
+    def get_fen_string(self) -> str:
+        rows = []
+        for row in range(8):
+            fen_row = ''
+            empty_count = 0
+            for code in self.squares[row * 8:row * 8 + 8]:
+                if code is None:
+                    empty_count += 1
+                    continue
+                if empty_count > 0:
+                    fen_row += str(empty_count)
+                    empty_count = 0
+                fen_row += PIECE_SYMBOLS[code]
+            if empty_count > 0:
+                fen_row += str(empty_count)
+            rows.append(fen_row)
+        if self.en_passant_square is None:
+            en_passant = '-'
+        else:
+            row, col = divmod(self.en_passant_square, 8)
+            en_passant = f"{chr(col + ord('a'))}{8 - row}"
+        return f"{'/'.join(rows)} {self.active_color} {self.castling} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
+
+    def _attackers_to(self, square: int, by_side: int, occupied: int) -> int:
+        bitboards = self.bitboards
+        offset = 6 * by_side
+        queens = bitboards[offset + QUEEN]
+        return ((PAWN_ATTACKS[1 - by_side][square] & bitboards[offset + PAWN])
+                | (KNIGHT_ATTACKS[square] & bitboards[offset + KNIGHT])
+                | (KING_ATTACKS[square] & bitboards[offset + KING])
+                | (rook_attacks(square, occupied) & (bitboards[offset + ROOK] | queens))
+                | (bishop_attacks(square, occupied) & (bitboards[offset + BISHOP] | queens)))
+
+    def is_square_attacked(self, row: int, col: int, by_color: str) -> bool:
+        by_side = 0 if by_color == WHITE else 1
+        return self._attackers_to(row * 8 + col, by_side, self.occupancy[0] | self.occupancy[1]) != 0
+
+    def is_in_check(self) -> bool:
+        """Check if the king of the side to move is attacked."""
+        king = self.bitboards[6 * self.side + KING]
+        if not king:
+            return False
+        return self._attackers_to(king.bit_length() - 1, 1 - self.side, self.occupancy[0] | self.occupancy[1]) != 0
+
+    def repetition_count(self) -> int:
+        """How many times the current position has occurred, comparing keys back to the last irreversible move."""
+        stack = self._undo_stack
+        count = 1
+        for index in range(len(stack) - 2, len(stack) - min(self.halfmove_clock, len(stack)) - 1, -2):
+            if stack[index][7] == self.zobrist_key:  # The key saved by push
+                count += 1
+        return count
+
+    def game_status(self) -> str:
+        """ONGOING, or why the game is over: CHECKMATE, STALEMATE or one of the draw rules."""
+        if not self.has_legal_move():
+            return CHECKMATE if self.is_in_check() else STALEMATE
+        if self.halfmove_clock >= 100:
+            return FIFTY_MOVE_RULE
+        if self.repetition_count() >= 3:
+            return THREEFOLD_REPETITION
+        if self.insufficient_material():
+            return INSUFFICIENT_MATERIAL
+        return ONGOING
+
+    def insufficient_material(self) -> bool:
+        """True when neither side can ever mate, cheap enough for the search to ask at every node."""
+        # Pawns and major pieces can always mate, and so can a knight with any other minor; bishops alone cannot
+        # when they all stand on one square color, however many there are
+        bitboards = self.bitboards
+        if self.pawn_key or bitboards[ROOK] | bitboards[QUEEN] | bitboards[6 + ROOK] | bitboards[6 + QUEEN]:
+            return False
+        knights = bitboards[KNIGHT] | bitboards[6 + KNIGHT]
+        if knights and (knights & (knights - 1) or bitboards[BISHOP] | bitboards[6 + BISHOP]):
+            return False
+        return insufficient_material(self.get_piece_squares())
+
+    def _attacked_squares(self, by_side: int, occupied: int) -> int:
+        bitboards = self.bitboards
+        offset = 6 * by_side
+        pawns = bitboards[offset + PAWN]
+        if by_side == 0:
+            attacked = ((pawns & 0xfefefefefefefefe) >> 9) | ((pawns & 0x7f7f7f7f7f7f7f7f) >> 7)
+        else:
+            attacked = ((pawns & 0x7f7f7f7f7f7f7f7f) << 9) | ((pawns & 0xfefefefefefefefe) << 7)
+        for code, table in ((offset + KNIGHT, KNIGHT_ATTACKS), (offset + KING, KING_ATTACKS)):
+            pieces = bitboards[code]
+            while pieces:
+                bit = pieces & -pieces
+                attacked |= table[bit.bit_length() - 1]
+                pieces ^= bit
+        queens = bitboards[offset + QUEEN]
+        for pieces, attacks in ((bitboards[offset + ROOK] | queens, rook_attacks), (bitboards[offset + BISHOP] | queens, bishop_attacks)):
+            while pieces:
+                bit = pieces & -pieces
+                attacked |= attacks(bit.bit_length() - 1, occupied)
+                pieces ^= bit
+        return attacked & 0xffffffffffffffff
+
+    def generate_legal_moves(self) -> List[int]:
+        """Generate the encoded legal moves of the side to move, using check and pin masks."""
+        if self._legal_moves is not None:
+            return self._legal_moves
+        moves = []
+        side = self.side
+        offset = 6 * side
+        bitboards = self.bitboards
+        ours = self.occupancy[side]
+        theirs = self.occupancy[1 - side]
+        occupied = ours | theirs
+        king_bit = bitboards[offset + KING]
+        if not king_bit:
+            self._legal_moves = moves
+            return moves
+        king = king_bit.bit_length() - 1
+
+        # King moves, checked against the opponent's attacks with the king lifted off the board
+        attacked = self._attacked_squares(1 - side, occupied ^ king_bit)
+        targets = KING_ATTACKS[king] & ~ours & ~attacked
+        while targets:
+            bit = targets & -targets
+            moves.append(king | ((bit.bit_length() - 1) << 6))
+            targets ^= bit
+
+        checkers = self._attackers_to(king, 1 - side, occupied)
+        if checkers & (checkers - 1):  # Double check, only the king can move
+            self._legal_moves = moves
+            return moves
+        if checkers:
+            checker = checkers.bit_length() - 1
+            evasion_mask = BETWEEN[king][checker] | checkers
+        else:
+            evasion_mask = 0xffffffffffffffff
+            self._add_castling_moves(moves, king, occupied, attacked)
+
+        # A piece is pinned when it is the only piece between the king and an enemy slider on the same line
+        pin_rays = {}
+        their_queens = bitboards[6 - offset + QUEEN]
+        snipers = ((ROOK_RAYS[king] & (bitboards[6 - offset + ROOK] | their_queens))
+                   | (BISHOP_RAYS[king] & (bitboards[6 - offset + BISHOP] | their_queens)))
+        while snipers:
+            bit = snipers & -snipers
+            sniper = bit.bit_length() - 1
+            snipers ^= bit
+            between = BETWEEN[king][sniper] & occupied
+            if between and not between & (between - 1) and between & ours:
+                pin_rays[between.bit_length() - 1] = BETWEEN[king][sniper] | bit
+
+        targets_mask = ~ours & evasion_mask
+        for piece_type, attacks in ((KNIGHT, None), (BISHOP, bishop_attacks), (ROOK, rook_attacks), (QUEEN, None)):
+            pieces = bitboards[offset + piece_type]
+            while pieces:
+                bit = pieces & -pieces
+                square = bit.bit_length() - 1
+                pieces ^= bit
+                if piece_type == KNIGHT:
+                    if square in pin_rays:  # A pinned knight can never move
+                        continue
+                    targets = KNIGHT_ATTACKS[square] & targets_mask
+                elif piece_type == QUEEN:
+                    targets = (rook_attacks(square, occupied) | bishop_attacks(square, occupied)) & targets_mask
+                else:
+                    targets = attacks(square, occupied) & targets_mask
+                if square in pin_rays:
+                    targets &= pin_rays[square]
+                while targets:
+                    target_bit = targets & -targets
+                    moves.append(square | ((target_bit.bit_length() - 1) << 6))
+                    targets ^= target_bit
+
+        self._add_pawn_moves(moves, king, occupied, theirs, evasion_mask, pin_rays)
+        self._legal_moves = moves
+        return moves
+
+    def _add_castling_moves(self, moves: List[int], king: int, occupied: int, attacked: int):
+        rights = self.castling_rights
+        if self.side == 0:
+            if rights & CASTLE_WHITE_KING and king == 60 and self.squares[63] == ROOK \
+                    and not occupied & 0x6000000000000000 and not attacked & 0x6000000000000000:
+                moves.append(encode_move(60, 62))
+            if rights & CASTLE_WHITE_QUEEN and king == 60 and self.squares[56] == ROOK \
+                    and not occupied & 0x0e00000000000000 and not attacked & 0x0c00000000000000:
+                moves.append(encode_move(60, 58))
+        else:
+            if rights & CASTLE_BLACK_KING and king == 4 and self.squares[7] == 6 + ROOK \
+                    and not occupied & 0x60 and not attacked & 0x60:
+                moves.append(encode_move(4, 6))
+            if rights & CASTLE_BLACK_QUEEN and king == 4 and self.squares[0] == 6 + ROOK \
+                    and not occupied & 0x0e and not attacked & 0x0c:
+                moves.append(encode_move(4, 2))
+
+    def _add_pawn_moves(self, moves: List[int], king: int, occupied: int, theirs: int, evasion_mask: int, pin_rays: Dict[int, int]):
+        side = self.side
+        pawns = self.bitboards[6 * side + PAWN]
+        forward = -8 if side == 0 else 8
+        start_row, last_row = (6, 0) if side == 0 else (1, 7)
+        en_passant = self.en_passant_square
+        while pawns:
+            bit = pawns & -pawns
+            square = bit.bit_length() - 1
+            pawns ^= bit
+            targets = 0
+            one_step = square + forward
+            if not occupied & (1 << one_step):
+                targets |= 1 << one_step
+                two_step = one_step + forward
+                if square >> 3 == start_row and not occupied & (1 << two_step):
+                    targets |= 1 << two_step
+            targets |= PAWN_ATTACKS[side][square] & theirs
+            targets &= evasion_mask
+            if en_passant is not None and PAWN_ATTACKS[side][square] & (1 << en_passant):
+                if self._is_en_passant_legal(square, en_passant, king, occupied, evasion_mask):
+                    targets |= 1 << en_passant
+            if square in pin_rays:
+                targets &= pin_rays[square]
+            while targets:
+                target_bit = targets & -targets
+                target = target_bit.bit_length() - 1
+                targets ^= target_bit
+                if target >> 3 == last_row:
+                    for promotion in (QUEEN, ROOK, BISHOP, KNIGHT):
+                        moves.append(square | (target << 6) | (promotion << 12))
+                else:
+                    moves.append(square | (target << 6))
+
+    def _is_en_passant_legal(self, square: int, en_passant: int, king: int, occupied: int, evasion_mask: int) -> bool:
+        captured = en_passant + 8 if self.side == 0 else en_passant - 8
+        if not evasion_mask & ((1 << en_passant) | (1 << captured)):
+            return False
+        # Both pawns leave the capturing rank at once, so look for a slider behind them directly
+        occupied = occupied ^ (1 << square) ^ (1 << captured) | (1 << en_passant)
+        offset = 6 - 6 * self.side
+        queens = self.bitboards[offset + QUEEN]
+        return not ((rook_attacks(king, occupied) & (self.bitboards[offset + ROOK] | queens))
+                    or (bishop_attacks(king, occupied) & (self.bitboards[offset + BISHOP] | queens)))
+
+    def iter_legal_moves(self, captures_first: bool = True) -> Iterator[Tuple[int, int, int, int, Optional[str]]]:
+        """Yield the legal moves like ChessBoard.iter_legal_moves, captures and promotions first by default.
+
+        Bitboard generation of the whole list is cheap, so only the ordering and the tuple building are lazy.
+        """
+        squares = self.squares
+        quiet_moves = []
+        for move in self.generate_legal_moves():
+            start = move & 63
+            end = (move >> 6) & 63
+            if captures_first and squares[end] is None and not move >> 12 and \
+                    not (squares[start] % 6 == PAWN and (start ^ end) & 7):
+                quiet_moves.append(move)
+                continue
+            yield start >> 3, start & 7, end >> 3, end & 7, PROMOTION_SYMBOLS.get(move >> 12)
+        for move in quiet_moves:
+            start = move & 63
+            end = (move >> 6) & 63
+            yield start >> 3, start & 7, end >> 3, end & 7, None
+
+    def has_legal_move(self) -> bool:
+        return bool(self.generate_legal_moves())
+
+    def generate_moves(self, buffer: array) -> int:
+        """Copy the encoded legal moves into a move buffer and return their number, like ChessBoard.generate_moves."""
+        moves = self.generate_legal_moves()
+        count = len(moves)
+        buffer[:count] = array('H', moves)
+        return count
+
+    def get_legal_moves(self) -> List[Tuple[int, int, int, int, Optional[str]]]:
+        """Return the legal moves as (start_row, start_col, end_row, end_col, promotion) tuples."""
+        legal_moves = []
+        for move in self.generate_legal_moves():
+            start_row, start_col = divmod(move & 63, 8)
+            end_row, end_col = divmod((move >> 6) & 63, 8)
+            legal_moves.append((start_row, start_col, end_row, end_col, PROMOTION_SYMBOLS.get(move >> 12)))
+        return legal_moves
+
+    def push(self, move: int):
+        """Play an encoded move without validation, saving what is needed to take it back."""
+        start = move & 63
+        end = (move >> 6) & 63
+        promotion = move >> 12
+        squares = self.squares
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        side = self.side
+        code = squares[start]
+        captured = squares[end]
+        captured_square = end
+        piece_type = code - 6 * side
+
+        if piece_type == PAWN and captured is None and (start ^ end) & 7:  # En passant
+            captured_square = end + 8 if side == 0 else end - 8
+            captured = squares[captured_square]
+        self._undo_stack.append((move, captured, captured_square, self.castling_rights, self.en_passant_square,
+                                 self.halfmove_clock, self.fullmove_number, self.zobrist_key,
+                                 self._legal_moves, self._piece_views, self.piece_square_score, self.phase,
+                                 self.pawn_key))
+        key = self.zobrist_key ^ PIECE_KEYS[code][start] ^ CASTLING_KEYS[self.castling_rights] ^ ZOBRIST_BLACK_TO_MOVE
+        score = self.piece_square_score - PIECE_SQUARE_SCORES[code][start]
+        if self.en_passant_square is not None:
+            key ^= ZOBRIST_EN_PASSANT_FILE[self.en_passant_square & 7]
+        if piece_type == PAWN:
+            self.pawn_key ^= PIECE_KEYS[code][start]
+
+        if captured is not None:
+            key ^= PIECE_KEYS[captured][captured_square]
+            score -= PIECE_SQUARE_SCORES[captured][captured_square]
+            self.phase -= PIECE_PHASES[captured]
+            if captured % 6 == PAWN:
+                self.pawn_key ^= PIECE_KEYS[captured][captured_square]
+            captured_bit = 1 << captured_square
+            bitboards[captured] ^= captured_bit
+            occupancy[1 - side] ^= captured_bit
+            squares[captured_square] = None
+        move_bits = (1 << start) | (1 << end)
+        bitboards[code] ^= move_bits
+        occupancy[side] ^= move_bits
+        squares[start] = None
+        squares[end] = code
+
+        if promotion:
+            bitboards[code] ^= 1 << end
+            bitboards[6 * side + promotion] |= 1 << end
+            squares[end] = 6 * side + promotion
+            key ^= PIECE_KEYS[6 * side + promotion][end]
+            score += PIECE_SQUARE_SCORES[6 * side + promotion][end]
+            self.phase += PIECE_PHASES[6 * side + promotion]
+        elif piece_type == KING and abs(end - start) == 2:  # Castling, move the rook next to the king
+            rook_start, rook_end = (start + 3, start + 1) if end > start else (start - 4, start - 1)
+            rook_bits = (1 << rook_start) | (1 << rook_end)
+            bitboards[6 * side + ROOK] ^= rook_bits
+            occupancy[side] ^= rook_bits
+            squares[rook_end] = squares[rook_start]
+            squares[rook_start] = None
+            key ^= PIECE_KEYS[6 * side + ROOK][rook_start] ^ PIECE_KEYS[6 * side + ROOK][rook_end]
+            score += PIECE_SQUARE_SCORES[6 * side + ROOK][rook_end] - PIECE_SQUARE_SCORES[6 * side + ROOK][rook_start]
+        if not promotion:
+            key ^= PIECE_KEYS[code][end]
+            score += PIECE_SQUARE_SCORES[code][end]
+            if piece_type == PAWN:
+                self.pawn_key ^= PIECE_KEYS[code][end]
+        self.piece_square_score = score
+
+        self.castling_rights &= CASTLING_KEEP[start] & CASTLING_KEEP[end]
+        key ^= CASTLING_KEYS[self.castling_rights]
+        if piece_type == PAWN and abs(end - start) == 16:
+            self.en_passant_square = (start + end) // 2
+            key ^= ZOBRIST_EN_PASSANT_FILE[end & 7]
+        else:
+            self.en_passant_square = None
+        if piece_type == PAWN or captured is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if side == 1:
+            self.fullmove_number += 1
+        self.side = 1 - side
+        self.zobrist_key = key
+        self._legal_moves = None
+        self._piece_views = None
+
+    def pop(self) -> int:
+        """Take back the last move played with push and return it."""
+        (move, captured, captured_square, self.castling_rights, self.en_passant_square,
+         self.halfmove_clock, self.fullmove_number, self.zobrist_key,
+         self._legal_moves, self._piece_views, self.piece_square_score, self.phase,
+         self.pawn_key) = self._undo_stack.pop()
+        start = move & 63
+        end = (move >> 6) & 63
+        promotion = move >> 12
+        squares = self.squares
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        self.side = side = 1 - self.side
+        code = squares[end]
+
+        if promotion:
+            bitboards[code] ^= 1 << end
+            code = 6 * side + PAWN
+            bitboards[code] |= 1 << end
+        elif code - 6 * side == KING and abs(end - start) == 2:
+            rook_start, rook_end = (start + 3, start + 1) if end > start else (start - 4, start - 1)
+            rook_bits = (1 << rook_start) | (1 << rook_end)
+            bitboards[6 * side + ROOK] ^= rook_bits
+            occupancy[side] ^= rook_bits
+            squares[rook_start] = squares[rook_end]
+            squares[rook_end] = None
+        move_bits = (1 << start) | (1 << end)
+        bitboards[code] ^= move_bits
+        occupancy[side] ^= move_bits
+        squares[end] = None
+        squares[start] = code
+        if captured is not None:
+            captured_bit = 1 << captured_square
+            bitboards[captured] |= captured_bit
+            occupancy[1 - side] |= captured_bit
+            squares[captured_square] = captured
+        return move
+
+    def encode(self, start_row: int, start_col: int, end_row: int, end_col: int, promotion: Optional[str] = None) -> int:
+        """Encode a move given in ChessBoard coordinates, promoting pawns to a queen by default."""
+        start = start_row * 8 + start_col
+        end = end_row * 8 + end_col
+        promotion_type = 0
+        if self.squares[start] is not None and self.squares[start] % 6 == PAWN and end_row in (0, 7):
+            promotion_type = PROMOTION_TYPES[(promotion or 'q').lower()]
+        return encode_move(start, end, promotion_type)
+
+    def make_move(self, start_row: int, start_col: int, end_row: int, end_col: int, promotion: Optional[str] = None):
+        """Play a move given in ChessBoard coordinates without any validation."""
+        self.push(self.encode(start_row, start_col, end_row, end_col, promotion))
+
+    def unmake_move(self):
+        self.pop()
+
+    def handle_moves(self, start_row: int, start_col: int, end_row: int, end_col: int, promotion: Optional[str] = None):
+        piece1 = self.get_piece(start_row, start_col)
+        if piece1 is not None and piece1.get_color() != self.active_color:
+            print("Invalid move: Cannot move opponent's piece")
+            return
+        piece2 = self.get_piece(end_row, end_col)
+        if piece2 is not None and piece2.get_color() == self.active_color:
+            print("Invalid move: Cannot capture own piece")
+            return
+        if piece1 is None or (end_row, end_col) not in piece1.get_available_moves():
+            print("Invalid move: Piece cannot move to that position")
+            return
+        self.make_move(start_row, start_col, end_row, end_col, promotion)
+
+    def play(self, move: Tuple) -> int:
+        """Play a legal (start_row, start_col, end_row, end_col[, promotion]) move and return it encoded."""
+        encoded = self.encode(*move)
+        if encoded not in self.generate_legal_moves():
+            raise ValueError(f"Illegal move: {move}")
+        self.push(encoded)
+        return encoded
+
+    def _moves_for_color(self, color: str) -> List[Tuple[int, int]]:
+        available_moves = []
+        for square in range(64):
+            piece = self.get_piece(square >> 3, square & 7)
+            if piece is not None and piece.get_color() == color:
+                available_moves.extend(piece.get_available_moves())
+        return available_moves
+
+    def get_available_moves_for_black(self) -> List[Tuple[int, int]]:
+        return self._moves_for_color(BLACK)
+
+    def get_available_moves_for_white(self) -> List[Tuple[int, int]]:
+        return self._moves_for_color(WHITE)
+
+    def black_pieces_with_available_moves(self) -> List[ChessPiece]:
+        return [piece for piece in (self.get_piece(square >> 3, square & 7) for square in range(64))
+                if piece is not None and piece.get_color() == BLACK and piece.get_available_moves()]
+
+    def white_pieces_with_available_moves(self) -> Dict[Tuple[int, int], List[Tuple[int, int]]]:
+        pieces = {}
+        for square in range(64):
+            piece = self.get_piece(square >> 3, square & 7)
+            if piece is not None and piece.get_color() == WHITE and piece.get_available_moves():
+                pieces[(piece.row, piece.col)] = piece.get_available_moves()
+        return pieces
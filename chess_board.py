@@ -1,10 +1,24 @@
-import copy
-from typing import Dict, List, Tuple, Optional
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Set, Tuple
+
+import move_cache
+from evaluation import PHASE_WEIGHTS, PIECE_SQUARE, evaluation_terms, hash_pawns
+from move_cache import LegalMoveCache
+from zobrist import ZOBRIST_BLACK_TO_MOVE, ZOBRIST_PIECES, castling_key, en_passant_key, hash_position
 
 WHITE = 'w'
 BLACK = 'b'
 
+KING_DIRECTIONS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+ROOK_DIRECTIONS = [(0, -1), (0, 1), (-1, 0), (1, 0)]
+BISHOP_DIRECTIONS = [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+KNIGHT_DIRECTIONS = [(-2, -1), (-2, 1), (-1, -2), (-1, 2), (1, -2), (1, 2), (2, -1), (2, 1)]
+
 class ChessPiece:
+    # No per-instance __dict__; subclasses declare empty __slots__ to keep it that way
+    __slots__ = ('color', 'row', 'col', 'available_moves')
+    symbol = ''  # Lowercase FEN letter, set by each subclass
+
     def __init__(self, color: str, row: int, col: int):
         self.color = color
         self.row = row
@@ -16,6 +30,9 @@ class ChessPiece:
     
     def get_position(self) -> Tuple[int, int]:
         return self.row, self.col
+
+    def get_symbol(self) -> str:
+        return self.symbol.upper() if self.color == WHITE else self.symbol
     
     def update_position(self, new_row: int, new_col: int) -> None:
         self.row = new_row
@@ -30,6 +47,9 @@ class ChessPiece:
         raise NotImplementedError("This method must be implemented in a subclass.")
     
 class King(ChessPiece):
+    __slots__ = ()
+    symbol = 'k'
+
     def calculate_available_moves(self, chessboard: 'ChessBoard'):
         """Calculate the available moves for a King."""
         moves = []
@@ -59,6 +79,9 @@ class King(ChessPiece):
         self.available_moves = moves
 
 class Queen(ChessPiece):
+    __slots__ = ()
+    symbol = 'q'
+
     def calculate_available_moves(self, chessboard: 'ChessBoard'):
         """Calculate the available moves for a Queen."""
         moves = []
@@ -79,6 +102,9 @@ class Queen(ChessPiece):
         self.available_moves = moves
 
 class Rook(ChessPiece):
+    __slots__ = ()
+    symbol = 'r'
+
     def calculate_available_moves(self, chessboard: 'ChessBoard'):
         """Calculate the available moves for a Rook."""
         moves = []
@@ -100,6 +126,9 @@ class Rook(ChessPiece):
         self.available_moves = moves        
 
 class Bishop(ChessPiece):
+    __slots__ = ()
+    symbol = 'b'
+
     def calculate_available_moves(self, chessboard: 'ChessBoard'):
         """Calculate the available moves for a Bishop."""
         moves = []
@@ -120,6 +149,9 @@ class Bishop(ChessPiece):
         self.available_moves = moves
 
 class Knight(ChessPiece):
+    __slots__ = ()
+    symbol = 'n'
+
     def calculate_available_moves(self, chessboard: 'ChessBoard'):
         """Calculate the available moves for a Knight."""
         moves = []
@@ -131,6 +163,9 @@ class Knight(ChessPiece):
         self.available_moves = moves
 
 class Pawn(ChessPiece):
+    __slots__ = ()
+    symbol = 'p'
+
     def calculate_available_moves(self, chessboard: 'ChessBoard'):
         """Calculate the available moves for a Pawn."""
         moves = []
@@ -162,26 +197,97 @@ class Pawn(ChessPiece):
                     moves.append((new_row, new_col))
         self.available_moves = moves        
 
+SLIDER_DIRECTIONS = {Queen: KING_DIRECTIONS, Rook: ROOK_DIRECTIONS, Bishop: BISHOP_DIRECTIONS}
+
+PROMOTION_PIECES = {'q': Queen, 'r': Rook, 'b': Bishop, 'n': Knight}
+# Promotion field of a packed move, the piece type numbers of the bitboard backend
+PROMOTION_CODES = {'n': 1, 'b': 2, 'r': 3, 'q': 4}
+PROMOTION_LETTERS = {code: letter for letter, code in PROMOTION_CODES.items()}
+
+# Castling right lost when the rook leaves or is captured on each corner square
+CASTLING_CORNERS = {(7, 7): 'K', (7, 0): 'Q', (0, 7): 'k', (0, 0): 'q'}
+SQUARES = [(row, col) for row in range(8) for col in range(8)]  # Square number to (row, col)
+SQUARE_NUMBERS = {square: number for number, square in enumerate(SQUARES)}
+# Move cache entries are packed into bytes; this is the memory an entry costs on top of its length
+MOVE_CACHE_ENTRY_BYTES = 200
+SAME_MOVES = 255  # Marks a piece whose legal moves are its pseudo-legal moves
+MAX_MOVES = 256  # Room in a move buffer; no position has more than 218 legal moves
+
+# game_status results, also used as termination reasons in PGN files and match results
+ONGOING = 'ongoing'
+CHECKMATE = 'checkmate'
+STALEMATE = 'stalemate'
+FIFTY_MOVE_RULE = 'fifty-move rule'
+THREEFOLD_REPETITION = 'threefold repetition'
+INSUFFICIENT_MATERIAL = 'insufficient material'
+
+class MoveRecord(NamedTuple):
+    """Everything make_move changes, so unmake_move can restore the board in place."""
+    piece: ChessPiece
+    start: Tuple[int, int]
+    end: Tuple[int, int]
+    captured: Optional[ChessPiece]
+    captured_square: Tuple[int, int]
+    rook_move: Optional[Tuple[Tuple[int, int], Tuple[int, int]]]
+    promoted: Optional[ChessPiece]
+    castling: Optional[str]
+    en_passant: Optional[Tuple[int, int]]
+    halfmove_clock: int
+    fullmove_number: int
+    active_color: str
+    zobrist_key: int
+    piece_square_score: int
+    phase: int
+    pawn_key: int
+
+def encode_move(start: int, end: int, promotion: int = 0) -> int:
+    """Pack a move as from square, to square and promotion piece type (0 for none), 16 bits in all."""
+    return start | (end << 6) | (promotion << 12)
+
+def move_buffers(plies: int) -> List[array]:
+    """Preallocate one array('H') of MAX_MOVES packed moves per ply for generate_moves to fill."""
+    return [array('H', bytes(2 * MAX_MOVES)) for _ in range(plies)]
+
+def insufficient_material(piece_squares: List[Tuple[str, int]]) -> bool:
+    """True when neither side can ever mate: bare kings, a single minor piece, or only bishops all on one square color."""
+    minors = [(symbol.lower(), square) for symbol, square in piece_squares if symbol not in 'Kk']
+    if len(minors) <= 1:
+        return all(symbol in 'bn' for symbol, _square in minors)
+    return all(symbol == 'b' for symbol, _square in minors) and \
+        len({(square // 8 + square % 8) % 2 for _symbol, square in minors}) == 1
+
 class ChessBoard:
     def __init__(self):
-        self.board = [[None] * 8 for _ in range(8)]
+        self.board: List[Optional[ChessPiece]] = [None] * 64  # Indexed by square number, row * 8 + col
+        self._kings: Dict[str, ChessPiece] = {}  # By color; the King objects follow their own square
         self.active_color = None
         self.en_passant = None
         self.castling = None
         self.halfmove_clock = 0
         self.fullmove_number = 0
+        self.zobrist_key = 0
+        # Evaluation terms kept up to date by make_move, see evaluation.evaluate
+        self.piece_square_score = 0
+        self.phase = 0
+        self.pawn_key = 0
+        self._undo_stack: List[MoveRecord] = []
+        # Pseudo-legal moves per piece, kept apart from the legal lists remove_check_moves builds
+        self._pseudo_moves: Dict[ChessPiece, List[Tuple[int, int]]] = {}
+        self._moves_current = False  # Whether the pieces' available moves belong to the current position
+        self.debug_incremental = False  # Check every incremental update against a full recompute
+        self.move_cache: Optional[LegalMoveCache] = move_cache.shared_cache  # None to always generate
 
     def _place_piece(self, piece: ChessPiece, row: int, col: int):
-        self.board[row][col] = piece
+        self.board[row * 8 + col] = piece
         piece.update_position(row, col)
 
     def _remove_piece(self, piece: ChessPiece):
         row, col = piece.get_position()
-        self.board[row][col] = None
+        self.board[row * 8 + col] = None
         piece.update_position(-1, -1)
 
     def get_piece(self, row, col) -> Optional[ChessPiece]:
-        return self.board[row][col]
+        return self.board[row * 8 + col]
 
     def _get_active_color(self) -> str:
         return self.active_color
@@ -194,16 +300,88 @@ class ChessBoard:
         self._remove_piece(piece)
         self._place_piece(piece, end_row, end_col)
 
-    def _find_king_location(self) -> Optional[Tuple[int, int]]: # TODO: Optimize using FEN string
-        active_color = self._get_active_color()
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece(row, col)
-                if isinstance(piece, King) and piece.get_color() == active_color:
-                    return row, col
-        return None
+    def _find_king_location(self, color: Optional[str] = None) -> Optional[Tuple[int, int]]:
+        king = self._kings.get(self._get_active_color() if color is None else color)
+        if king is None or king.row < 0:  # No king of that color, or taken off the board
+            return None
+        return king.row, king.col
+
+    def is_square_attacked(self, row: int, col: int, by_color: str) -> bool:
+        """Check if a square is attacked by any piece of the given color, without touching cached moves."""
+        # Pawns attack diagonally towards the opponent, so look one row back from the square
+        pawn_row = row + 1 if by_color == WHITE else row - 1
+        if 0 <= pawn_row < 8:
+            for pawn_col in (col - 1, col + 1):
+                if 0 <= pawn_col < 8:
+                    piece = self.get_piece(pawn_row, pawn_col)
+                    if isinstance(piece, Pawn) and piece.get_color() == by_color:
+                        return True
+        for dx, dy in KNIGHT_DIRECTIONS:
+            new_row, new_col = row + dx, col + dy
+            if 0 <= new_row < 8 and 0 <= new_col < 8:
+                piece = self.get_piece(new_row, new_col)
+                if isinstance(piece, Knight) and piece.get_color() == by_color:
+                    return True
+        for dx, dy in KING_DIRECTIONS:
+            new_row, new_col = row + dx, col + dy
+            if 0 <= new_row < 8 and 0 <= new_col < 8:
+                piece = self.get_piece(new_row, new_col)
+                if isinstance(piece, King) and piece.get_color() == by_color:
+                    return True
+        # Walk each ray until the first piece and check if it slides along that ray
+        for dx, dy in KING_DIRECTIONS:
+            slider = Rook if dx == 0 or dy == 0 else Bishop
+            new_row, new_col = row + dx, col + dy
+            while 0 <= new_row < 8 and 0 <= new_col < 8:
+                piece = self.get_piece(new_row, new_col)
+                if piece is not None:
+                    if piece.get_color() == by_color and isinstance(piece, (slider, Queen)):
+                        return True
+                    break
+                new_row += dx
+                new_col += dy
+        return False
+
+    def is_in_check(self) -> bool:
+        """Check if the king of the side to move is attacked."""
+        king_location = self._find_king_location()
+        if king_location is None:
+            return False
+        return self.is_square_attacked(king_location[0], king_location[1], BLACK if self.active_color == WHITE else WHITE)
+
+    def repetition_count(self) -> int:
+        """How many times the current position has occurred since the last process_fen_string call.
 
-    def handle_moves(self, start_row: int, start_col: int, end_row: int, end_col: int):
+        Only positions with the same side to move since the last capture or pawn move can be equal, so at most
+        halfmove_clock / 2 keys of the undo stack are compared.
+        """
+        stack = self._undo_stack
+        count = 1
+        for index in range(len(stack) - 2, len(stack) - min(self.halfmove_clock, len(stack)) - 1, -2):
+            if stack[index].zobrist_key == self.zobrist_key:
+                count += 1
+        return count
+
+    def game_status(self) -> str:
+        """ONGOING, or why the game is over: CHECKMATE, STALEMATE or one of the draw rules."""
+        if not self.has_legal_move():
+            return CHECKMATE if self.is_in_check() else STALEMATE
+        if self.halfmove_clock >= 100:
+            return FIFTY_MOVE_RULE
+        if self.repetition_count() >= 3:
+            return THREEFOLD_REPETITION
+        if self.insufficient_material():
+            return INSUFFICIENT_MATERIAL
+        return ONGOING
+
+    def insufficient_material(self) -> bool:
+        """True when neither side can ever mate, cheap enough for the search to ask at every node."""
+        # A pawn can always promote; any number of minors can be bishops on one color, so the rest is counted
+        if self.pawn_key:
+            return False
+        return insufficient_material(self.get_piece_squares())
+
+    def handle_moves(self, start_row: int, start_col: int, end_row: int, end_col: int, promotion: Optional[str] = None):
         piece1 = self.get_piece(start_row, start_col)
         if piece1 is not None and piece1.get_color() != self.active_color:
             print("Invalid move: Cannot move opponent's piece")
@@ -215,105 +393,155 @@ class ChessBoard:
             return
             # raise ValueError("Invalid move: Cannot capture own piece")
 
-        # Handle castling
-        distance = end_col - start_col
-        if isinstance(piece1, King) and abs(distance) == 2 and (end_row, end_col) in piece1.get_available_moves():
-            if self.active_color == WHITE:
-                if distance > 0:  # Kingside castle
-                    self._move_piece(start_row, start_col, start_row, start_col + 2)
-                    self._move_piece(start_row, start_col + 3, start_row, start_col + 1)
-                else:  # Queenside castle
-                    self._move_piece(start_row, start_col, start_row, start_col - 2)
-                    self._move_piece(start_row, start_col - 4, start_row, start_col - 1)
-                if "K" in self.castling:
-                    self.castling = self.castling.replace("K", "")
-                if "Q" in self.castling:
-                    self.castling = self.castling.replace("Q", "")
-            else:  # BLACK
-                if distance > 0:  # Kingside castle
-                    self._move_piece(start_row, start_col, start_row, start_col + 2)
-                    self._move_piece(start_row, start_col + 3, start_row, start_col + 1)
-                else:  # Queenside castle
-                    self._move_piece(start_row, start_col, start_row, start_col - 2)
-                    self._move_piece(start_row, start_col - 4, start_row, start_col - 1)
-                if "k" in self.castling:
-                    self.castling = self.castling.replace("k", "")
-                if "q" in self.castling:
-                    self.castling = self.castling.replace("q", "")
-            self.en_passant = None
-            self._update_half_full_moves()
-            self._update_active_color()
-            return
-
-        # Check if the move is an en passant
-        if isinstance(piece1, Pawn) and self.en_passant == (end_row, end_col) and self.en_passant in piece1.get_available_moves():
-            # print("ENTERED: en passant move")
-            self._move_piece(start_row, start_col, end_row, end_col)
-            pawn = None
-            if self.active_color == WHITE:
-                pawn = self.get_piece(start_row, end_col)
-                self._remove_piece(pawn)
-            elif self.active_color == BLACK:
-                pawn = self.get_piece(start_row, end_col)
-                self._remove_piece(pawn)
-            self.en_passant = None
-            self._update_half_full_moves()
-            self._update_active_color()
-            return
-
-        # Check if the move is a regular move
+        # Check if the move is a regular move (castling and en passant are part of the available moves)
         if (end_row, end_col) not in piece1.get_available_moves():
             print("Invalid move: Piece cannot move to that position")
             return
 
-        # Move the piece
+        self.play((start_row, start_col, end_row, end_col, promotion))
+
+    def play(self, move: Tuple) -> MoveRecord:
+        """Play a legal (start_row, start_col, end_row, end_col[, promotion]) move and refresh the legal moves in place.
+
+        The FEN string is not rebuilt; call get_fen_string only when it is needed.
+        """
+        if not self._moves_current:
+            # make_move/unmake_move since the last refresh left the pieces holding another position's moves
+            self._regenerate_moves()
+        start_row, start_col, end_row, end_col = move[:4]
+        promotion = move[4] if len(move) > 4 else None
+        piece = self.get_piece(start_row, start_col)
+        if piece is None or piece.get_color() != self.active_color or (end_row, end_col) not in piece.get_available_moves():
+            raise ValueError(f"Illegal move: {move}")
+        record = self.make_move(start_row, start_col, end_row, end_col, promotion)
+        self._update_available_moves(record)
+        return record
+
+    def make_move(self, start_row: int, start_col: int, end_row: int, end_col: int, promotion: Optional[str] = None) -> MoveRecord:
+        """Play a move without any validation and push what is needed to take it back onto the undo stack.
+
+        Pawns reaching the last row promote to the given piece letter, a queen by default.
+        """
+        piece = self.get_piece(start_row, start_col)
+        color = piece.get_color()
+        captured = self.get_piece(end_row, end_col)
+        captured_square = (end_row, end_col)
+        rook_move = None
+        promoted = None
+
+        # Check if the move is an en passant (a pawn moving diagonally onto the empty en passant square)
+        if isinstance(piece, Pawn) and captured is None and start_col != end_col and self.en_passant == (end_row, end_col):
+            captured_square = (start_row, end_col)
+            captured = self.get_piece(start_row, end_col)
+
+        previous_state = (self.castling, self.en_passant, self.halfmove_clock, self.fullmove_number, self.active_color,
+                          self.zobrist_key, self.piece_square_score, self.phase, self.pawn_key)
+        symbol = piece.get_symbol()
+        key = self.zobrist_key ^ ZOBRIST_PIECES[symbol][start_row * 8 + start_col]
+        score = self.piece_square_score - PIECE_SQUARE[symbol][start_row * 8 + start_col]
+        if isinstance(piece, Pawn):
+            self.pawn_key ^= ZOBRIST_PIECES[symbol][start_row * 8 + start_col]
+
+        if captured is not None:
+            captured_symbol = captured.get_symbol()
+            captured_number = captured_square[0] * 8 + captured_square[1]
+            key ^= ZOBRIST_PIECES[captured_symbol][captured_number]
+            score -= PIECE_SQUARE[captured_symbol][captured_number]
+            self.phase -= PHASE_WEIGHTS[captured_symbol]
+            if isinstance(captured, Pawn):
+                self.pawn_key ^= ZOBRIST_PIECES[captured_symbol][captured_number]
+            self._remove_piece(captured)
         self._move_piece(start_row, start_col, end_row, end_col)
 
-        # Check if the move was a king move to remove castling options
-        if isinstance(piece1, King):
-            if self.active_color == WHITE:
-                if "K" in self.castling:
-                    self.castling = self.castling.replace("K", "")
-                if "Q" in self.castling:
-                    self.castling = self.castling.replace("Q", "")
-            else:
-                if "k" in self.castling:
-                    self.castling = self.castling.replace("k", "")
-                if "q" in self.castling:
-                    self.castling = self.castling.replace("q", "")
-
-        # Check if the move was a rook move to remove castling options
-        if isinstance(piece1, Rook):
-            if self.active_color == WHITE:
-                if start_row == 7 and start_col == 0 and "Q" in self.castling:
-                    self.castling = self.castling.replace("Q", "")
-                if start_row == 7 and start_col == 7 and "K" in self.castling:
-                    self.castling = self.castling.replace("K", "")
-            else:
-                if start_row == 0 and start_col == 0 and "q" in self.castling:
-                    self.castling = self.castling.replace("q", "")
-                if start_row == 0 and start_col == 7 and "k" in self.castling:
-                    self.castling = self.castling.replace("k", "")
-        
+        # Handle castling by moving the rook next to the king
+        if isinstance(piece, King) and abs(end_col - start_col) == 2:
+            if end_col > start_col:  # Kingside castle
+                rook_move = ((start_row, 7), (start_row, 5))
+            else:  # Queenside castle
+                rook_move = ((start_row, 0), (start_row, 3))
+            self._move_piece(rook_move[0][0], rook_move[0][1], rook_move[1][0], rook_move[1][1])
+            rook_symbol = 'R' if color == WHITE else 'r'
+            rook_start, rook_end = rook_move[0][0] * 8 + rook_move[0][1], rook_move[1][0] * 8 + rook_move[1][1]
+            key ^= ZOBRIST_PIECES[rook_symbol][rook_start] ^ ZOBRIST_PIECES[rook_symbol][rook_end]
+            score += PIECE_SQUARE[rook_symbol][rook_end] - PIECE_SQUARE[rook_symbol][rook_start]
+
         # Check if the move is a pawn promotion
-        if isinstance(piece1, Pawn) and (end_row == 0 or end_row == 7):
-            self._remove_piece(piece1)
-            self._place_piece(Queen(self.active_color, end_row, end_col), end_row, end_col)
+        if isinstance(piece, Pawn) and (end_row == 0 or end_row == 7):
+            self._remove_piece(piece)
+            promoted = PROMOTION_PIECES[(promotion or 'q').lower()](color, end_row, end_col)
+            self._place_piece(promoted, end_row, end_col)
+            symbol = promoted.get_symbol()
+            self.phase += PHASE_WEIGHTS[symbol]
+        elif isinstance(piece, Pawn):
+            self.pawn_key ^= ZOBRIST_PIECES[symbol][end_row * 8 + end_col]
+        key ^= ZOBRIST_PIECES[symbol][end_row * 8 + end_col]
+        self.piece_square_score = score + PIECE_SQUARE[symbol][end_row * 8 + end_col]
+
+        # Remove castling options when a king or rook leaves, or a rook is captured on its corner
+        if self.castling and self.castling != '-':
+            castling = self.castling
+            if isinstance(piece, King):
+                for right in ('KQ' if color == WHITE else 'kq'):
+                    castling = castling.replace(right, '')
+            for square in ((start_row, start_col), captured_square):
+                right = CASTLING_CORNERS.get(square)
+                if right is not None:
+                    castling = castling.replace(right, '')
+            castling = castling if castling else '-'
+            if castling != self.castling:
+                key ^= castling_key(self.castling) ^ castling_key(castling)
+            self.castling = castling
 
         # Check if move is a pawn double move
-        if isinstance(piece1, Pawn) and abs(start_row - end_row) == 2:
-            if self.active_color == WHITE:
-                self.en_passant = (end_row + 1, end_col)
-                # print("white en passant set")
-            else:
-                self.en_passant = (end_row - 1, end_col)
-                # print("black en passant set")
-            # self.en_passant = (end_row, end_col)
+        key ^= en_passant_key(self.en_passant)
+        if isinstance(piece, Pawn) and abs(start_row - end_row) == 2:
+            self.en_passant = ((start_row + end_row) // 2, end_col)
+            key ^= en_passant_key(self.en_passant)
         else:
             self.en_passant = None
-        # print("en passant after move at: " + str(self.en_passant))
-        self._update_half_full_moves()
+
+        if isinstance(piece, Pawn) or captured is not None:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if color == BLACK:
+            self.fullmove_number += 1
         self._update_active_color()
+        self.zobrist_key = key ^ ZOBRIST_BLACK_TO_MOVE
+
+        record = MoveRecord(piece, (start_row, start_col), (end_row, end_col), captured, captured_square,
+                            rook_move, promoted, *previous_state)
+        self._undo_stack.append(record)
+        self._moves_current = False
+        return record
+
+    def unmake_move(self) -> MoveRecord:
+        """Take back the last move played with make_move, restoring the exact previous state."""
+        record = self._undo_stack.pop()
+        self._moves_current = False
+        piece = record.piece
+        (start_row, start_col), (end_row, end_col) = record.start, record.end
+
+        if record.promoted is not None:
+            self._remove_piece(record.promoted)
+            self._place_piece(piece, end_row, end_col)
+        if record.rook_move is not None:
+            (rook_row, rook_col), (castled_row, castled_col) = record.rook_move
+            self._move_piece(castled_row, castled_col, rook_row, rook_col)
+        self._move_piece(end_row, end_col, start_row, start_col)
+        if record.captured is not None:
+            self._place_piece(record.captured, record.captured_square[0], record.captured_square[1])
+
+        self.castling = record.castling
+        self.en_passant = record.en_passant
+        self.halfmove_clock = record.halfmove_clock
+        self.fullmove_number = record.fullmove_number
+        self.active_color = record.active_color
+        self.zobrist_key = record.zobrist_key
+        self.piece_square_score = record.piece_square_score
+        self.phase = record.phase
+        self.pawn_key = record.pawn_key
+        return record
 
     def _update_active_color(self):
         if self.active_color == WHITE:
@@ -321,12 +549,9 @@ class ChessBoard:
         else:
             self.active_color = WHITE
 
-    def _update_half_full_moves(self):
-        self.halfmove_clock += 1
-        if self.active_color == BLACK:
-            self.fullmove_number += 1
-
     def _place_pieces_from_fen(self, fen: str):
+        self.board = [None] * 64
+        self._kings = {}
         rows = fen.split('/')
         for row, fen_row in enumerate(rows):
             col = 0
@@ -348,6 +573,7 @@ class ChessBoard:
                         piece = Queen(color, row, col)
                     elif char.lower() == 'k':
                         piece = King(color, row, col)
+                        self._kings[color] = piece
                     elif char.lower() == 'p':
                         piece = Pawn(color, row, col)
                     else:
@@ -366,35 +592,400 @@ class ChessBoard:
         self.castling = fen_parts[2]
         self.halfmove_clock = int(fen_parts[4])
         self.fullmove_number = int(fen_parts[5])
+        self._undo_stack = []
+        self.zobrist_key = self._compute_zobrist_key()
+        self.piece_square_score, self.phase = evaluation_terms(self.get_piece_squares())
+        self.pawn_key = hash_pawns(self.get_piece_squares())
+        self._regenerate_moves()
+
+    def get_piece_squares(self) -> List[Tuple[str, int]]:
+        """List every piece as its FEN symbol and its square number (row * 8 + col)."""
+        return [(piece.get_symbol(), square) for square, piece in enumerate(self.board) if piece is not None]
+
+    def _compute_zobrist_key(self) -> int:
+        return hash_position(self.get_piece_squares(), self.active_color, self.castling, self.en_passant)
+
+    def _calculate_all_available_moves(self):
+        self._pseudo_moves = {}
+        for piece in self.board:
+            if piece is not None:
+                piece.calculate_available_moves(self)
+                self._pseudo_moves[piece] = piece.available_moves
+
+    def _regenerate_moves(self, store: bool = True):
+        """Fill in every piece's moves for the position, from the move cache when it has seen the position.
+
+        Positions searched through make_move are looked up but not stored: they rarely come back
+        outside the search, whose transposition table already covers them, and storing costs time.
+        """
+        if self.move_cache is not None and self._restore_cached_moves():
+            self._moves_current = True
+            return
         self._calculate_all_available_moves()
         self.remove_check_moves()
+        # Only now: the en passant check in the filter plays moves, which mark the moves stale
+        self._moves_current = True
+        if store:
+            self._cache_moves()
 
-    def _calculate_all_available_moves(self):
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece(row, col)
-                if piece is not None:
-                    piece.calculate_available_moves(self)
+    def _restore_cached_moves(self) -> bool:
+        cached = self.move_cache.get(self.zobrist_key)
+        if cached is None:
+            return False
+        self._pseudo_moves = {}
+        index = 0
+        while index < len(cached):
+            square, count = cached[index], cached[index + 1]
+            index += 2
+            piece = self.board[square]
+            pseudo_moves = [SQUARES[target] for target in cached[index:index + count]]
+            index += count
+            count = cached[index]
+            index += 1
+            if count == SAME_MOVES:
+                piece.available_moves = pseudo_moves
+            else:
+                piece.available_moves = [SQUARES[target] for target in cached[index:index + count]]
+                index += count
+            self._pseudo_moves[piece] = pseudo_moves
+        return True
+
+    def _cache_moves(self):
+        if self.move_cache is None:
+            return
+        # Per piece: its square, its pseudo-legal targets, then its legal targets unless they are the same list
+        entry = []
+        for piece, pseudo_moves in self._pseudo_moves.items():
+            available_moves = piece.available_moves
+            entry.append(piece.row * 8 + piece.col)
+            entry.append(len(pseudo_moves))
+            entry.extend(map(SQUARE_NUMBERS.__getitem__, pseudo_moves))
+            if available_moves is pseudo_moves:
+                entry.append(SAME_MOVES)
+            else:
+                entry.append(len(available_moves))
+                entry.extend(map(SQUARE_NUMBERS.__getitem__, available_moves))
+        self.move_cache.put(self.zobrist_key, bytes(entry), MOVE_CACHE_ENTRY_BYTES + len(entry))
+
+    def _update_available_moves(self, record: MoveRecord):
+        """Refresh only the pieces a move can have affected, then filter the new side's legal moves."""
+        if self.move_cache is not None and self._restore_cached_moves():
+            self._moves_current = True
+            return
+        for piece in self._affected_pieces(record):
+            piece.calculate_available_moves(self)
+            self._pseudo_moves[piece] = piece.available_moves
+        if record.captured is not None:
+            self._pseudo_moves.pop(record.captured, None)
+        if record.promoted is not None:
+            self._pseudo_moves.pop(record.piece, None)
+        for piece, moves in self._pseudo_moves.items():
+            piece.available_moves = moves
+        self.remove_check_moves()
+        self._moves_current = True  # After the filter, whose en passant check plays moves
+        if self.debug_incremental:
+            self._check_incremental_moves()
+        self._cache_moves()
+
+    def _affected_pieces(self, record: MoveRecord) -> Set[ChessPiece]:
+        """Find the pieces whose moves can change when the squares touched by a move change."""
+        changed = {record.start, record.end, record.captured_square}
+        if record.rook_move is not None:
+            changed.update(record.rook_move)
+        # Pawns next to the old and new en passant squares gain or lose the capture
+        for en_passant in (record.en_passant, self.en_passant):
+            if en_passant is not None:
+                changed.add(en_passant)
+        affected = set()
+        for piece in self._pseudo_moves:
+            if piece.row < 0:  # Captured by this move
+                continue
+            if isinstance(piece, King):  # Kings depend on castling rights and squares two files away
+                affected.add(piece)
+                continue
+            for row, col in changed:
+                dx, dy = abs(row - piece.row), abs(col - piece.col)
+                if isinstance(piece, Pawn):
+                    touched = dx <= 2 and dy <= 1  # Pushes onto the square, captures and en passant
+                elif isinstance(piece, Knight):
+                    touched = (dx, dy) in ((1, 2), (2, 1))
+                elif isinstance(piece, Rook):
+                    touched = dx == 0 or dy == 0
+                elif isinstance(piece, Bishop):
+                    touched = dx == dy
+                else:
+                    touched = dx == 0 or dy == 0 or dx == dy
+                # Sliders on the same line are refreshed even when something blocks the ray in between
+                if touched:
+                    affected.add(piece)
+                    break
+        for row, col in changed:
+            piece = self.get_piece(row, col)
+            if piece is not None:
+                affected.add(piece)
+        return affected
+
+    def _check_incremental_moves(self):
+        incremental = {piece: sorted(piece.available_moves) for piece in self._pseudo_moves}
+        self._calculate_all_available_moves()
+        self.remove_check_moves()
+        full = {piece: sorted(piece.available_moves) for piece in self._pseudo_moves}
+        if incremental != full:
+            mismatches = [(piece.get_symbol(), piece.get_position(), incremental.get(piece), moves)
+                          for piece, moves in full.items() if incremental.get(piece) != moves]
+            raise AssertionError(f"Incremental move update differs from a full recompute: {mismatches}")
 
     def remove_check_moves(self):
-        for row in range(8):
-            for col in range(8):
-                piece = self.get_piece(row, col)
-                if piece is not None and piece.get_color() == self.active_color:
-                    moves = piece.get_available_moves()
-                    for move in moves[:]:  # The [:] creates a copy of the list
-                        # Check if a castling move results in a check in transition
-                        distance = move[1] - piece.get_position()[1]
-                        if isinstance(piece, King) and abs(distance) == 2: # Castling move
-                            if distance < 0: # Queenside castling
-                                if self.simulate_future_move_check(piece, (row, col - 1)):
-                                    piece.available_moves.remove(move)
-                            elif distance > 0: # Kingside castling
-                                if self.simulate_future_move_check(piece, (row, col + 1)):
-                                    piece.available_moves.remove(move)
-                        # For all other moves
-                        if self.simulate_future_move_check(piece, move):
-                            piece.available_moves.remove(move)
+        """Filter the active color's available moves down to legal moves in a single pass."""
+        color = self.active_color
+        king_location = self._find_king_location(color)
+        if king_location is None:
+            return
+        opponent = BLACK if color == WHITE else WHITE
+        # Squares the opponent attacks with our king lifted off the board, so it cannot hide behind itself
+        attacked = self._attacked_squares(opponent, king_location)
+        checkers, evasion_squares, pins = self._find_checks_and_pins(color, king_location)
+        for piece in self.board:
+            if piece is not None and piece.color == color:
+                piece.available_moves = self._legal_targets(piece, piece.available_moves, checkers, evasion_squares,
+                                                            pins, attacked)
+
+    def _legal_targets(self, piece: ChessPiece, moves: List[Tuple[int, int]], checkers: List[Tuple[int, int]],
+                       evasion_squares: Optional[Set[Tuple[int, int]]], pins: Dict[Tuple[int, int], Set[Tuple[int, int]]],
+                       attacked: Optional[Set[Tuple[int, int]]]) -> List[Tuple[int, int]]:
+        """Keep the pseudo-legal moves of a piece of the side to move that do not leave its king in check.
+
+        attacked, the squares the opponent attacks with the king lifted off the board, is only read for the king.
+        """
+        row, col = piece.row, piece.col
+        if isinstance(piece, King):
+            legal_moves = []
+            for move in moves:
+                if move in attacked:
+                    continue
+                distance = move[1] - col
+                # Castling is not allowed out of check or through an attacked square
+                if abs(distance) == 2 and (checkers or (row, col + distance // 2) in attacked):
+                    continue
+                legal_moves.append(move)
+            return legal_moves
+        if len(checkers) > 1:  # Only the king can answer a double check
+            return []
+        pin_ray = pins.get((row, col))
+        legal_moves = []
+        for move in moves:
+            if pin_ray is not None and move not in pin_ray:
+                continue
+            is_en_passant = isinstance(piece, Pawn) and move == self.en_passant and move[1] != col
+            if evasion_squares is not None and move not in evasion_squares:
+                # An en passant capture also answers a check given by the pawn it removes
+                if not (is_en_passant and (row, move[1]) in evasion_squares):
+                    continue
+            # En passant removes two pieces from one rank, which no pin ray covers
+            if is_en_passant and self.simulate_future_move_check(piece, move):
+                continue
+            legal_moves.append(move)
+        return legal_moves
+
+    def _attacked_squares(self, by_color: str, ignore: Optional[Tuple[int, int]] = None) -> Set[Tuple[int, int]]:
+        """Collect every square attacked by the given color, letting sliders see through the ignored square."""
+        attacked = set()
+        for piece in self.board:
+            if piece is None or piece.color != by_color:
+                continue
+            row, col = piece.row, piece.col
+            if isinstance(piece, Pawn):
+                pawn_row = row - 1 if by_color == WHITE else row + 1
+                if 0 <= pawn_row < 8:
+                    if col > 0:
+                        attacked.add((pawn_row, col - 1))
+                    if col < 7:
+                        attacked.add((pawn_row, col + 1))
+                continue
+            if isinstance(piece, (Knight, King)):
+                for dx, dy in (KNIGHT_DIRECTIONS if isinstance(piece, Knight) else KING_DIRECTIONS):
+                    new_row, new_col = row + dx, col + dy
+                    if 0 <= new_row < 8 and 0 <= new_col < 8:
+                        attacked.add((new_row, new_col))
+                continue
+            for dx, dy in SLIDER_DIRECTIONS[type(piece)]:
+                new_row, new_col = row + dx, col + dy
+                while 0 <= new_row < 8 and 0 <= new_col < 8:
+                    attacked.add((new_row, new_col))
+                    if self.get_piece(new_row, new_col) is not None and (new_row, new_col) != ignore:
+                        break
+                    new_row += dx
+                    new_col += dy
+        return attacked
+
+    def _find_checks_and_pins(self, color: str, king_location: Tuple[int, int]):
+        """Find the pieces checking the king, the squares that stop a single check and the pin ray of every pinned piece."""
+        king_row, king_col = king_location
+        checkers = []
+        evasion_squares = None
+        pins = {}
+        pawn_row = king_row - 1 if color == WHITE else king_row + 1
+        if 0 <= pawn_row < 8:
+            for pawn_col in (king_col - 1, king_col + 1):
+                if 0 <= pawn_col < 8:
+                    piece = self.get_piece(pawn_row, pawn_col)
+                    if isinstance(piece, Pawn) and piece.get_color() != color:
+                        checkers.append((pawn_row, pawn_col))
+                        evasion_squares = {(pawn_row, pawn_col)}
+        for dx, dy in KNIGHT_DIRECTIONS:
+            new_row, new_col = king_row + dx, king_col + dy
+            if 0 <= new_row < 8 and 0 <= new_col < 8:
+                piece = self.get_piece(new_row, new_col)
+                if isinstance(piece, Knight) and piece.get_color() != color:
+                    checkers.append((new_row, new_col))
+                    evasion_squares = {(new_row, new_col)}
+        for dx, dy in KING_DIRECTIONS:
+            slider = Rook if dx == 0 or dy == 0 else Bishop
+            ray = []
+            blocker = None
+            new_row, new_col = king_row + dx, king_col + dy
+            while 0 <= new_row < 8 and 0 <= new_col < 8:
+                ray.append((new_row, new_col))
+                piece = self.get_piece(new_row, new_col)
+                if piece is not None:
+                    if piece.get_color() == color:
+                        if blocker is not None:  # Two of our pieces on the ray, nothing is pinned
+                            break
+                        blocker = (new_row, new_col)
+                    else:
+                        if isinstance(piece, (slider, Queen)):
+                            if blocker is None:
+                                checkers.append((new_row, new_col))
+                                evasion_squares = set(ray)
+                            else:
+                                pins[blocker] = set(ray)
+                        break
+                new_row += dx
+                new_col += dy
+        return checkers, evasion_squares, pins
+
+    def get_legal_moves(self) -> List[Tuple[int, int, int, int, Optional[str]]]:
+        """Regenerate the available moves and return the legal moves of the side to move.
+
+        Each move is (start_row, start_col, end_row, end_col, promotion), with one entry per
+        promotion piece, and can be replayed with make_move(*move).
+        """
+        self._regenerate_moves(store=not self._undo_stack)
+        legal_moves = []
+        color = self.active_color
+        for piece in self.board:
+            if piece is None or piece.color != color:
+                continue
+            row, col = piece.row, piece.col
+            for end_row, end_col in piece.get_available_moves():
+                if isinstance(piece, Pawn) and (end_row == 0 or end_row == 7):
+                    for promotion in PROMOTION_PIECES:
+                        legal_moves.append((row, col, end_row, end_col, promotion))
+                else:
+                    legal_moves.append((row, col, end_row, end_col, None))
+        return legal_moves
+
+    def iter_legal_moves(self, captures_first: bool = True) -> Iterator[Tuple[int, int, int, int, Optional[str]]]:
+        """Yield the legal moves of the side to move one at a time, in the same form as get_legal_moves.
+
+        Each piece's moves are generated and checked only when the iteration reaches it, and the king, whose
+        legality test needs every attacked square, comes last. With captures_first, captures and promotions
+        are yielded before the quiet moves. The board may be changed between moves as long as it is back in
+        this position for the next one, so a search can make and unmake each move and stop at a cutoff.
+        """
+        color = self.active_color
+        if self._moves_current:
+            # Snapshot the lists now; searching a move replaces them with the moves of later positions
+            targets = [(piece, piece.available_moves) for piece in self.board if piece is not None and piece.color == color]
+        else:
+            targets = self._iter_legal_targets(color)
+        quiet_moves = []
+        for piece, moves in targets:
+            row, col = piece.row, piece.col
+            is_pawn = isinstance(piece, Pawn)
+            for end_row, end_col in moves:
+                if is_pawn and (end_row == 0 or end_row == 7):
+                    for promotion in PROMOTION_PIECES:
+                        yield row, col, end_row, end_col, promotion
+                elif not captures_first or self.board[end_row * 8 + end_col] is not None or (is_pawn and end_col != col):
+                    yield row, col, end_row, end_col, None
+                else:
+                    quiet_moves.append((row, col, end_row, end_col, None))
+        yield from quiet_moves
+
+    def _iter_legal_targets(self, color: str) -> Iterator[Tuple[ChessPiece, List[Tuple[int, int]]]]:
+        # Generate piece by piece without touching the moves the pieces hold for the incremental update
+        king_location = self._find_king_location(color)
+        if king_location is None:
+            checkers, evasion_squares, pins = [], None, {}
+        else:
+            checkers, evasion_squares, pins = self._find_checks_and_pins(color, king_location)
+        king = None
+        for piece in [piece for piece in self.board if piece is not None and piece.color == color]:
+            if isinstance(piece, King):
+                king = piece
+                continue
+            if len(checkers) > 1:
+                continue
+            saved_moves = piece.available_moves
+            piece.calculate_available_moves(self)
+            moves, piece.available_moves = piece.available_moves, saved_moves
+            yield piece, self._legal_targets(piece, moves, checkers, evasion_squares, pins, None)
+        if king is not None:
+            saved_moves = king.available_moves
+            king.calculate_available_moves(self)
+            moves, king.available_moves = king.available_moves, saved_moves
+            attacked = self._attacked_squares(BLACK if color == WHITE else WHITE, king_location)
+            yield king, self._legal_targets(king, moves, checkers, evasion_squares, pins, attacked)
+
+    def has_legal_move(self) -> bool:
+        """Whether the side to move has a legal move, stopping at the first one found."""
+        for _move in self.iter_legal_moves(captures_first=False):
+            return True
+        return False
+
+    def generate_moves(self, buffer: array) -> int:
+        """Write the legal moves of the side to move into a move buffer as packed ints and return their number.
+
+        Same moves and order as get_legal_moves, without building a tuple per move; see move_buffers.
+        """
+        self._regenerate_moves(store=not self._undo_stack)
+        count = 0
+        color = self.active_color
+        for square, piece in enumerate(self.board):
+            if piece is None or piece.color != color:
+                continue
+            promotes = isinstance(piece, Pawn) and (square < 16 if color == WHITE else square >= 48)
+            for end_row, end_col in piece.available_moves:
+                move = square | (end_row * 8 + end_col) << 6
+                if promotes:
+                    for promotion in PROMOTION_PIECES:
+                        buffer[count] = move | PROMOTION_CODES[promotion] << 12
+                        count += 1
+                else:
+                    buffer[count] = move
+                    count += 1
+        return count
+
+    def encode(self, start_row: int, start_col: int, end_row: int, end_col: int, promotion: Optional[str] = None) -> int:
+        """Pack a move given in (row, col) coordinates, promoting pawns to a queen by default."""
+        promotion_code = 0
+        if isinstance(self.board[start_row * 8 + start_col], Pawn) and end_row in (0, 7):
+            promotion_code = PROMOTION_CODES[(promotion or 'q').lower()]
+        return encode_move(start_row * 8 + start_col, end_row * 8 + end_col, promotion_code)
+
+    def push(self, move: int) -> MoveRecord:
+        """Play a packed move without validation, like make_move."""
+        start = move & 63
+        end = (move >> 6) & 63
+        return self.make_move(start >> 3, start & 7, end >> 3, end & 7, PROMOTION_LETTERS.get(move >> 12))
+
+    def pop(self) -> int:
+        """Take back the last move and return it packed."""
+        record = self.unmake_move()
+        (start_row, start_col), (end_row, end_col) = record.start, record.end
+        promotion = PROMOTION_CODES[record.promoted.symbol] if record.promoted is not None else 0
+        return encode_move(start_row * 8 + start_col, end_row * 8 + end_col, promotion)
 
     def get_available_moves_for_black(self) -> List[Tuple[int, int]]:
         available_moves = []
@@ -450,7 +1041,6 @@ class ChessBoard:
         if self.en_passant is None:
             fen += " -"
         else:
-            print(f"en passant when updating fen: {self.en_passant}")
             row = 8 - self.en_passant[0]
             col = chr(self.en_passant[1] + ord('a'))
             fen += f" {col}{row}"
@@ -491,9 +1081,6 @@ class ChessBoard:
 
     def simulate_future_move_check(self, piece: ChessPiece, new_move: Tuple[int, int]) -> bool:
         """Simulate a future move to check if it results in a check."""
-        # Create a copy of the current board
-        board_copy = copy.deepcopy(self)
-        
         # Get the current position of the piece
         current_row, current_col = piece.get_position()
         
@@ -511,17 +1098,13 @@ class ChessBoard:
         # Note: we already check if the move is in the available moves in the main function
         
         # Check if the new position is occupied by a piece of the same color
-        if board_copy.get_piece(new_row, new_col) is not None and board_copy.get_piece(new_row, new_col).get_color() == piece.get_color():
+        if self.get_piece(new_row, new_col) is not None and self.get_piece(new_row, new_col).get_color() == piece.get_color():
             return False
         
-        # Move the piece from the current position to the new position
-        board_copy._move_piece(current_row, current_col, new_row, new_col)
-        board_copy._calculate_all_available_moves()
-        # Check if the move results in a check
-        king_location = board_copy._find_king_location()
-        if board_copy.active_color == WHITE and king_location is not None and king_location in board_copy.get_available_moves_for_black():
-            return True
-        if board_copy.active_color == BLACK and king_location is not None and king_location in board_copy.get_available_moves_for_white():
-            return True
-        return False
-        
\ No newline at end of file
+        # Play the move on this board, look for an attack on the king and take the move back
+        color = piece.get_color()
+        self.make_move(current_row, current_col, new_row, new_col)
+        king_location = self._find_king_location(color)
+        in_check = king_location is not None and self.is_square_attacked(king_location[0], king_location[1], BLACK if color == WHITE else WHITE)
+        self.unmake_move()
+        return in_check
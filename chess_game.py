@@ -1,7 +1,14 @@
+import os
 import pygame
+import queue
 import sys
+from concurrent.futures import ThreadPoolExecutor
 import chess_board
-import random
+import chess_bitboard
+import engine
+import opening_book
+import pgn
+import tablebase
 
 # Initialize Pygame
 pygame.init()
@@ -26,83 +33,172 @@ for row in range(8):
             pygame.draw.rect(board, gray_color, (col * square_size, row * square_size, square_size, square_size))
 
 
-def draw_pieces(fen_string: str):
-    # Mapping of FEN characters to image paths
-    piece_images = {
-        'r': 'pngs/black-rook.png',
-        'n': 'pngs/black-knight.png',
-        'b': 'pngs/black-bishop.png',
-        'q': 'pngs/black-queen.png',
-        'k': 'pngs/black-king.png',
-        'p': 'pngs/black-pawn.png',
-        'R': 'pngs/white-rook.png',
-        'N': 'pngs/white-knight.png',
-        'B': 'pngs/white-bishop.png',
-        'Q': 'pngs/white-queen.png',
-        'K': 'pngs/white-king.png',
-        'P': 'pngs/white-pawn.png'
-    }
-    
-    # Clear the board
-    screen.blit(board, (0, 0))
-    
-    # Split the FEN string into its components
-    # print(f"FEN String: {fen_string}")
-    fen_parts = fen_string.split(' ')
-    board_state = fen_parts[0]
-    # active_color = fen_parts[1]
-    
-    # Calculate the size of each square
-    square_size = board_size // 8
-    
-    # Loop through each character in the board state
-    row = 0
-    col = 0
-    for char in board_state:
-        if char == '/':
-            # Move to the next row
-            row += 1
-            col = 0
-        elif char.isdigit():
-            # Skip empty squares
-            col += int(char)
-        else:
-            # Get the image path for the piece
-            image_path = piece_images[char]
-            # Load and scale the image
-            piece_image = pygame.image.load(image_path)
-            piece_image = pygame.transform.scale(piece_image, (square_size, square_size))
-            # Draw the piece on the board
-            screen.blit(piece_image, (col * square_size, row * square_size))
-            col += 1
-    # Update the display
+# Mapping of FEN characters to image paths
+piece_images = {
+    'r': 'pngs/black-rook.png',
+    'n': 'pngs/black-knight.png',
+    'b': 'pngs/black-bishop.png',
+    'q': 'pngs/black-queen.png',
+    'k': 'pngs/black-king.png',
+    'p': 'pngs/black-pawn.png',
+    'R': 'pngs/white-rook.png',
+    'N': 'pngs/white-knight.png',
+    'B': 'pngs/white-bishop.png',
+    'Q': 'pngs/white-queen.png',
+    'K': 'pngs/white-king.png',
+    'P': 'pngs/white-pawn.png'
+}
+
+def load_sprite_atlas():
+    # Load and scale every piece image once, side by side on a single surface
+    atlas = pygame.Surface((square_size * len(piece_images), square_size), pygame.SRCALPHA)
+    areas = {}
+    for index, (symbol, image_path) in enumerate(piece_images.items()):
+        piece_image = pygame.image.load(image_path)
+        piece_image = pygame.transform.scale(piece_image, (square_size, square_size))
+        atlas.blit(piece_image, (index * square_size, 0))
+        areas[symbol] = pygame.Rect(index * square_size, 0, square_size, square_size)
+    return atlas.convert_alpha(), areas
+
+sprite_atlas, sprite_areas = load_sprite_atlas()
+green_squares = [] # Squares currently highlighted on the board surface
+
+def square_rect(row, col):
+    return pygame.Rect(col * square_size, row * square_size, square_size, square_size)
+
+def draw_square(row, col):
+    # Repaint the square from the board surface, then the piece from the atlas
+    rect = square_rect(row, col)
+    screen.blit(board, rect, rect)
+    piece = chessboard.get_piece(row, col)
+    if piece is not None:
+        screen.blit(sprite_atlas, rect, sprite_areas[piece.get_symbol()])
+    return rect
+
+def draw_pieces():
+    # Full redraw, only needed for the first frame
+    for row in range(8):
+        for col in range(8):
+            draw_square(row, col)
     pygame.display.flip()
 
+def redraw_squares(squares):
+    # Redraw the changed squares and push only their rectangles to the display
+    rects = [draw_square(row, col) for row, col in set(squares)]
+    if rects:
+        pygame.display.update(rects)
+
+def board_snapshot():
+    snapshot = []
+    for row in range(8):
+        for col in range(8):
+            piece = chessboard.get_piece(row, col)
+            snapshot.append(piece.get_symbol() if piece is not None else None)
+    return snapshot
+
+def changed_squares(before):
+    # Squares whose piece differs from the snapshot (covers castling, en passant and promotion)
+    after = board_snapshot()
+    return [divmod(square, 8) for square in range(64) if before[square] != after[square]]
+
 def place_green_squares(locations):
     for location in locations:
         row, col = location
         pygame.draw.rect(board, (0, 255, 0), (col * square_size, row * square_size, square_size, square_size))
+        green_squares.append(location)
+    return list(locations)
 
 def clear_green_squares():
-    for row in range(8):
-        for col in range(8):
-            if (row + col) % 2 == 0:
-                pygame.draw.rect(board, white_color, (col * square_size, row * square_size, square_size, square_size))
-            else:
-                pygame.draw.rect(board, gray_color, (col * square_size, row * square_size, square_size, square_size))
+    cleared = list(green_squares)
+    for row, col in cleared:
+        if (row + col) % 2 == 0:
+            pygame.draw.rect(board, white_color, (col * square_size, row * square_size, square_size, square_size))
+        else:
+            pygame.draw.rect(board, gray_color, (col * square_size, row * square_size, square_size, square_size))
+    green_squares.clear()
+    return cleared
+
+AI_TIME_LIMIT = 1.0 # Seconds the engine may think for each black move
+GAMES_PGN = 'games.pgn' # Every game played is appended here
+BOOK_PATH = 'book.bin' # Opening book the engine plays from when the file exists
+TABLEBASE_DIR = tablebase.TABLEBASE_DIR # Endgame tables the engine probes when the directory exists
+FRAME_RATE = 60 # Frames per second the main loop is capped at
+
+# The engine searches on a worker thread; finished searches come back through this queue
+ai_executor = ThreadPoolExecutor(max_workers=1)
+ai_results = queue.Queue()
+ai_pending = False
+game_id = 0 # Bumped on reset and quit so a cancelled search stops and its result is dropped
+
+def think(moves, game):
+    # Search a private copy so the UI keeps reading a stable board while the engine moves pieces around.
+    # The copy replays the game from the start so its undo stack holds the history repetitions are found in
+    search_board = type(chessboard)()
+    search_board.process_fen_string(fen_string)
+    for move in moves:
+        search_board.play(move)
+
+    def check_cancelled(info):
+        # Engine.search clears a stop sent before it started, so a cancelled search ends after its first iteration
+        if game != game_id:
+            ai.stop()
+
+    if game == game_id:
+        ai_results.put((game, ai.search(search_board, time_limit=AI_TIME_LIMIT, info_callback=check_cancelled)))
+
+def start_ai_move():
+    global ai_pending
+    ai_pending = True
+    ai_executor.submit(think, list(played_moves), game_id)
+
+def save_game():
+    # Append the moves played so far as a PGN game; nothing is written for an untouched board
+    if not played_moves:
+        return
+    headers = {'Event': 'Casual game', 'Site': 'chess_game.py', 'White': 'Human', 'Black': 'Engine'}
+    with open(GAMES_PGN, 'a') as games_file:
+        pgn.write_game(games_file, played_moves, headers, fen_string, pgn.game_result(chessboard))
+    played_moves.clear()
+
+def update_status():
+    # Called after every move; the board stops taking moves once the game is over
+    global status
+    status = chessboard.game_status()
+    if status != chess_board.ONGOING:
+        print(f"Game over: {status}, {pgn.game_result(chessboard)}. Press R for a new game.")
+
+def reset_game():
+    global ai_pending, game_id, selected_piece, status
+    game_id += 1
+    ai.stop() # Cut a running search short, its result is ignored
+    save_game()
+    ai_pending = False
+    selected_piece = None
+    clear_green_squares()
+    chessboard.process_fen_string(fen_string)
+    status = chess_board.ONGOING
+    draw_pieces()
 
 # Initial setup
 fen_string = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
-chessboard = chess_board.ChessBoard()
+if '--bitboard' in sys.argv: # Same interface, faster move generation
+    chessboard = chess_bitboard.BitboardChessBoard()
+else:
+    chessboard = chess_board.ChessBoard()
 chessboard.process_fen_string(fen_string)
-draw_pieces(fen_string)
+draw_pieces()
+ai = engine.Engine(book=opening_book.OpeningBook(BOOK_PATH) if os.path.exists(BOOK_PATH) else None,
+                   tablebase=tablebase.Tablebase(TABLEBASE_DIR) if os.path.isdir(TABLEBASE_DIR) else None)
+played_moves = [] # Moves of the current game, for the PGN export
+status = chess_board.ONGOING # game_status() of the position on the board
 selected_piece = None
+clock = pygame.time.Clock()
 running = True
 while running: # Main game loop
     for event in pygame.event.get():
         if event.type == pygame.QUIT:
             running = False
-        elif event.type == pygame.MOUSEBUTTONDOWN and chessboard.active_color == 'w':
+        elif event.type == pygame.MOUSEBUTTONDOWN and chessboard.active_color == 'w' and status == chess_board.ONGOING:
             mouse_x, mouse_y = event.pos
             clicked_row = mouse_y // square_size
             clicked_col = mouse_x // square_size
@@ -110,36 +206,49 @@ while running: # Main game loop
             if selected_piece is not None and null_piece is not None and (clicked_row, clicked_col) not in \
                 selected_piece.get_available_moves() and null_piece.color == chessboard.active_color: # Switch piece selection
                 selected_piece = null_piece
-                clear_green_squares()
-                place_green_squares(selected_piece.get_available_moves())
-                draw_pieces(fen_string)
+                cleared = clear_green_squares()
+                redraw_squares(cleared + place_green_squares(selected_piece.get_available_moves()))
+                continue
             elif selected_piece is not None and (clicked_row, clicked_col) not in selected_piece.get_available_moves(): # Second click on a non-valid square
                 selected_piece = None
-                clear_green_squares()
-                draw_pieces(fen_string)
+                redraw_squares(clear_green_squares())
             if selected_piece is None: # First click
                 if null_piece is not None and null_piece.color == chessboard.active_color:
                     selected_piece = null_piece
-                    place_green_squares(selected_piece.get_available_moves())
-                    draw_pieces(fen_string)
+                    redraw_squares(place_green_squares(selected_piece.get_available_moves()))
                 else:
                     continue
             else: # Second click (selected_piece is not None and in available_moves)
-                clear_green_squares()
+                cleared = clear_green_squares()
                 position = selected_piece.get_position()
-                chessboard.handle_moves(position[0], position[1], clicked_row, clicked_col)
-                fen_string = chessboard.get_fen_string()
-                chessboard.process_fen_string(fen_string)
-                draw_pieces(fen_string)
+                before = board_snapshot()
+                move = (position[0], position[1], clicked_row, clicked_col)
+                chessboard.play(move) # Updates the legal moves in place
+                played_moves.append(move)
+                redraw_squares(cleared + changed_squares(before))
                 selected_piece = None
-        elif chessboard.active_color == 'b': # AI move
-            movables = chessboard.black_pieces_with_available_moves()
-            if movables:
-                piece = random.choice(movables)
-                move = random.choice(piece.get_available_moves())
-                chessboard.handle_moves(piece.get_position()[0], piece.get_position()[1], move[0], move[1])
-                fen_string = chessboard.get_fen_string()
-                chessboard.process_fen_string(fen_string)
-                draw_pieces(fen_string)
+                update_status()
+        elif event.type == pygame.KEYDOWN and event.key == pygame.K_r: # Start a new game
+            reset_game()
+    if chessboard.active_color == 'b' and not ai_pending and status == chess_board.ONGOING: # AI move
+        start_ai_move()
+    try:
+        game, result = ai_results.get_nowait()
+    except queue.Empty:
+        pass
+    else:
+        if game == game_id:
+            ai_pending = False
+            if result.best_move is not None:
+                before = board_snapshot()
+                chessboard.play(result.best_move)
+                played_moves.append(result.best_move)
+                redraw_squares(changed_squares(before))
+                update_status()
+    clock.tick(FRAME_RATE)
+game_id += 1
+ai.stop()
+ai_executor.shutdown(wait=True, cancel_futures=True)
+save_game()
 pygame.quit()
 sys.exit()
\ No newline at end of file
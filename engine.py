@@ -0,0 +1,341 @@
+import argparse
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from evaluation import PawnHashTable, evaluate
+from move_ordering import MoveOrderer, is_tactical, piece_map, see
+from opening_book import OpeningBook
+from perft import BACKENDS, START_FEN, move_to_coordinates
+from tablebase import Tablebase, TablebaseResult
+from transposition_table import EXACT, LOWER_BOUND, UPPER_BOUND, TranspositionTable
+
+INFINITY = 1_000_000
+MATE_SCORE = 100_000
+MATE_THRESHOLD = MATE_SCORE - 1000  # Scores beyond this are mates, counted in plies from the root
+MAX_PLY = 128
+CHECK_EVERY = 1024  # Nodes between time and stop checks
+
+Move = Tuple[int, int, int, int, Optional[str]]
+
+
+class SearchInfo(NamedTuple):
+    """Progress report sent after every completed iteration."""
+    depth: int
+    score: int
+    nodes: int
+    time: float
+    nps: int
+    pv: List[Move]
+
+
+class SearchResult(NamedTuple):
+    best_move: Optional[Move]
+    score: int
+    depth: int
+    nodes: int
+    time: float
+    nps: int
+    pv: List[Move]
+
+
+class SearchAborted(Exception):
+    """Raised inside the search when the time or node budget runs out or stop() is called."""
+
+
+def _tablebase_score(result: TablebaseResult, ply: int) -> int:
+    # Distances to mate count from the probed node, engine mate scores from the root
+    if result.wdl > 0:
+        return MATE_SCORE - ply - result.dtm
+    if result.wdl < 0:
+        return -MATE_SCORE + ply + result.dtm
+    return 0
+
+
+def _score_to_tt(score: int, ply: int) -> int:
+    # Mate scores are stored relative to the node so they stay valid when reached at another ply
+    if score >= MATE_THRESHOLD:
+        return score + ply
+    if score <= -MATE_THRESHOLD:
+        return score - ply
+    return score
+
+
+def _score_from_tt(score: int, ply: int) -> int:
+    if score >= MATE_THRESHOLD:
+        return score - ply
+    if score <= -MATE_THRESHOLD:
+        return score + ply
+    return score
+
+
+class Engine:
+    """Iterative-deepening negamax alpha-beta search over any board with the ChessBoard move interface."""
+
+    def __init__(self, tt_size: int = 1 << 18, book: Optional[OpeningBook] = None,
+                 tablebase: Optional[Tablebase] = None, move_ordering: bool = True):
+        self.tt = TranspositionTable(tt_size)
+        self.pawn_table = PawnHashTable()
+        # Off searches moves in generation order, to measure what the ordering saves
+        self.move_ordering = move_ordering
+        self.orderer = MoveOrderer(MAX_PLY + 1)
+        self.book = book  # Consulted before every search; a book move is played without searching
+        self.tablebase = tablebase  # Probed instead of searching once few enough pieces are left
+        self.nodes = 0
+        self._stop = threading.Event()
+        self._start_time = 0.0
+        self._deadline: Optional[float] = None
+        self._node_limit: Optional[int] = None
+        self._pv: List[List[Move]] = [[] for _ in range(MAX_PLY + 1)]
+
+    def stop(self):
+        """Ask a running search to return its last completed iteration as soon as possible."""
+        self._stop.set()
+
+    def search(self, board, max_depth: int = MAX_PLY, time_limit: Optional[float] = None,
+               node_limit: Optional[int] = None,
+               info_callback: Optional[Callable[[SearchInfo], None]] = None) -> SearchResult:
+        """Search the board's position until max_depth, time_limit seconds or node_limit nodes run out.
+
+        The board is left in the position it was given; moves are (start_row, start_col,
+        end_row, end_col, promotion) tuples that can be played with make_move(*move).
+        """
+        self.nodes = 0
+        self._stop.clear()
+        self._start_time = time.perf_counter()
+        self._deadline = self._start_time + time_limit if time_limit else None
+        self._node_limit = node_limit
+        self.orderer.clear()
+        max_depth = min(max_depth, MAX_PLY)
+
+        root_moves = board.get_legal_moves()
+        result = SearchResult(root_moves[0] if root_moves else None, 0, 0, 0, 0.0, 0, [])
+        if not root_moves:
+            score = -MATE_SCORE if board.is_in_check() else 0
+            return result._replace(score=score)
+        book_move = self.book.choose_move(board) if self.book is not None else None
+        if book_move is not None:
+            elapsed = time.perf_counter() - self._start_time
+            return result._replace(best_move=book_move, time=elapsed, pv=[book_move])
+        if self.tablebase is not None and self.tablebase.probe(board) is not None:
+            best = self.tablebase.best_move(board)
+            if best is not None:
+                elapsed = time.perf_counter() - self._start_time
+                return result._replace(best_move=best[0], score=_tablebase_score(best[1], 0), time=elapsed,
+                                       pv=[best[0]])
+        try:
+            for depth in range(1, max_depth + 1):
+                score = self._negamax(board, depth, 0, -INFINITY, INFINITY)
+                elapsed = time.perf_counter() - self._start_time
+                pv = list(self._pv[0])
+                result = SearchResult(pv[0] if pv else result.best_move, score, depth, self.nodes, elapsed,
+                                      self._nps(elapsed), pv)
+                if info_callback is not None:
+                    info_callback(SearchInfo(depth, score, self.nodes, elapsed, result.nps, pv))
+                if abs(score) >= MATE_THRESHOLD:
+                    break
+                # The next iteration costs several times this one, so do not start what cannot finish
+                if self._deadline is not None and elapsed > (self._deadline - self._start_time) / 2:
+                    break
+        except SearchAborted:
+            pass
+        elapsed = time.perf_counter() - self._start_time
+        return result._replace(nodes=self.nodes, time=elapsed, nps=self._nps(elapsed))
+
+    def _nps(self, elapsed: float) -> int:
+        return int(self.nodes / elapsed) if elapsed > 0 else 0
+
+    def _check_limits(self):
+        if self._stop.is_set():
+            raise SearchAborted()
+        if self._node_limit is not None and self.nodes >= self._node_limit:
+            raise SearchAborted()
+        if self._deadline is not None and time.perf_counter() >= self._deadline:
+            raise SearchAborted()
+
+    def _negamax(self, board, depth: int, ply: int, alpha: int, beta: int) -> int:
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self._check_limits()
+        self._pv[ply] = []
+        if ply > 0 and (board.halfmove_clock >= 100 or board.repetition_count() >= 2 or board.insufficient_material()):
+            return 0  # Repetitions and dead positions inside the tree are draws, the side ahead avoids them
+        if depth == 0 or ply >= MAX_PLY:
+            self.nodes -= 1  # Counted again by the quiescence search
+            return self._quiescence(board, ply, alpha, beta)
+        if self.tablebase is not None and ply > 0 and board.halfmove_clock == 0:
+            # Material only changes on captures and pawn moves, the moves that reset the halfmove clock
+            result = self.tablebase.probe(board)
+            if result is not None:
+                return _tablebase_score(result, ply)
+
+        key = board.zobrist_key
+        entry = self.tt.probe(key)
+        tt_move = None
+        if entry is not None:
+            tt_move = entry.best_move
+            if ply > 0 and entry.depth >= depth:
+                score = _score_from_tt(entry.score, ply)
+                if entry.flag == EXACT:
+                    return score
+                if entry.flag == LOWER_BOUND and score >= beta:
+                    return score
+                if entry.flag == UPPER_BOUND and score <= alpha:
+                    return score
+
+        pieces = piece_map(board)
+        if self.move_ordering:
+            moves = self._ordered_moves(board, pieces, ply, tt_move)
+        else:
+            moves = board.iter_legal_moves(captures_first=False)
+
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in moves:
+            board.make_move(*move)
+            try:
+                score = -self._negamax(board, depth - 1, ply + 1, -beta, -alpha)
+            finally:
+                board.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+                if score > alpha:
+                    alpha = score
+                    self._pv[ply] = [move] + self._pv[ply + 1]
+                    if alpha >= beta:
+                        if self.move_ordering:
+                            self.orderer.record_cutoff(pieces, move, ply, depth)
+                        break
+        if best_move is None:
+            return -MATE_SCORE + ply if board.is_in_check() else 0
+
+        if best_score <= original_alpha:
+            flag = UPPER_BOUND
+        elif best_score >= beta:
+            flag = LOWER_BOUND
+        else:
+            flag = EXACT
+        self.tt.store(key, depth, _score_to_tt(best_score, ply), flag, best_move)
+        return best_score
+
+    def _ordered_moves(self, board, pieces: Dict[int, str], ply: int, tt_move: Optional[Move]) -> Iterator[Move]:
+        # The move stored for this exact key goes first, before anything is generated, since it often cuts off
+        if tt_move is not None:
+            yield tt_move
+        # Both boards need the full move list to put captures first, so generation is not staged; only the
+        # scoring is, and a cutoff by a winning capture leaves the quiet moves unscored
+        moves = board.iter_legal_moves()
+        captures = []
+        quiet_moves = []
+        for move in moves:
+            if not is_tactical(pieces, move):
+                quiet_moves.append(move)
+                break
+            captures.append(move)
+        captures = self.orderer.scored(pieces, captures, ply)
+        losing = len(captures)
+        for index, (score, move) in enumerate(captures):
+            if score < 0:
+                losing = index
+                break
+            if move != tt_move:
+                yield move
+        quiet_moves.extend(moves)
+        for move in self.orderer.order(pieces, quiet_moves, ply):
+            if move != tt_move:
+                yield move
+        for _score, move in captures[losing:]:
+            if move != tt_move:
+                yield move
+
+    def _quiescence(self, board, ply: int, alpha: int, beta: int) -> int:
+        """Search captures and promotions until the position is quiet, so leaves are not evaluated mid-exchange."""
+        self.nodes += 1
+        if self.nodes % CHECK_EVERY == 0:
+            self._check_limits()
+        self._pv[ply] = []
+        if ply >= MAX_PLY:
+            return evaluate(board, self.pawn_table)
+        pieces = piece_map(board)
+        if board.is_in_check():
+            # No standing pat in check: every evasion is searched, and none means mate
+            best_score = -MATE_SCORE + ply
+            moves = board.iter_legal_moves()
+            if self.move_ordering:
+                moves = self.orderer.order(pieces, moves, ply)
+        else:
+            best_score = evaluate(board, self.pawn_table)
+            if best_score >= beta:
+                return best_score
+            alpha = max(alpha, best_score)
+            moves = []
+            for move in board.iter_legal_moves():
+                if not is_tactical(pieces, move):
+                    break  # Captures and promotions come first, the rest are quiet
+                # SEE pruning: a capture that loses material in the exchange cannot raise the score
+                if see(pieces, move) < 0:
+                    continue
+                moves.append(move)
+            if self.move_ordering:
+                moves = self.orderer.order(pieces, moves, ply)
+        for move in moves:
+            board.make_move(*move)
+            try:
+                score = -self._quiescence(board, ply + 1, -beta, -alpha)
+            finally:
+                board.unmake_move()
+            if score > best_score:
+                best_score = score
+                if score > alpha:
+                    alpha = score
+                    if alpha >= beta:
+                        break
+        return best_score
+
+
+def format_score(score: int) -> str:
+    if abs(score) >= MATE_THRESHOLD:
+        plies = MATE_SCORE - abs(score)
+        moves = (plies + 1) // 2
+        return f"mate {moves if score > 0 else -moves}"
+    return f"cp {score}"
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Search a position and print the principal variation.')
+    parser.add_argument('--fen', default=START_FEN, help='position to search (default: start position)')
+    parser.add_argument('--depth', type=int, default=MAX_PLY, help='maximum search depth in plies')
+    parser.add_argument('--time', type=float, default=None, help='time limit in seconds')
+    parser.add_argument('--nodes', type=int, default=None, help='node limit')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard', help='board implementation to search')
+    parser.add_argument('--book', default=None, help='opening book to play from before searching')
+    parser.add_argument('--tablebase', default=None, help='directory of endgame tables to probe')
+    args = parser.parse_args(argv)
+    if args.depth == MAX_PLY and args.time is None and args.nodes is None:
+        args.time = 5.0
+
+    board = BACKENDS[args.backend]()
+    board.process_fen_string(args.fen)
+
+    def print_info(info: SearchInfo):
+        pv = ' '.join(move_to_coordinates(move) for move in info.pv)
+        print(f"depth {info.depth} score {format_score(info.score)} nodes {info.nodes} "
+              f"time {info.time:.2f}s nps {info.nps} pv {pv}")
+
+    book = OpeningBook(args.book) if args.book else None
+    tablebase = Tablebase(args.tablebase) if args.tablebase else None
+    result = Engine(book=book, tablebase=tablebase).search(board, args.depth, args.time, args.nodes, print_info)
+    if book is not None:
+        book.close()
+    if tablebase is not None:
+        tablebase.close()
+    best_move = move_to_coordinates(result.best_move) if result.best_move else '(none)'
+    print(f"bestmove {best_move} nodes {result.nodes} time {result.time:.2f}s nps {result.nps}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
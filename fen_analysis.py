@@ -0,0 +1,110 @@
+import argparse
+import itertools
+import json
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO
+
+from perft import BACKENDS, move_to_coordinates
+
+_worker_board = None  # One board per worker process, reused for every position it analyzes
+
+
+def read_fens(stream: TextIO) -> Iterator[str]:
+    """Yield one FEN per non-empty line, skipping '#' comments, without reading the whole input."""
+    for line in stream:
+        fen = line.strip()
+        if fen and not fen.startswith('#'):
+            yield fen
+
+
+def analyze_fen(board, fen: str) -> Dict:
+    """Load a FEN into an existing board and report its legal moves and game state."""
+    try:
+        board.process_fen_string(fen)
+        moves = board.get_legal_moves()
+        in_check = board.is_in_check()
+    except (ValueError, IndexError, KeyError, AttributeError) as error:
+        return {'fen': fen, 'error': str(error) or type(error).__name__}
+    return {
+        'fen': fen,
+        'side_to_move': board.active_color,
+        'legal_moves': [move_to_coordinates(move) for move in moves],
+        'move_count': len(moves),
+        'check': in_check,
+        'checkmate': in_check and not moves,
+        'stalemate': not in_check and not moves,
+    }
+
+
+def analyze_stream(fens: Iterable[str], backend: str = 'bitboard') -> Iterator[Dict]:
+    """Analyze FENs one at a time on a single reused board."""
+    board = BACKENDS[backend]()
+    for fen in fens:
+        yield analyze_fen(board, fen)
+
+
+def _init_worker(backend: str):
+    global _worker_board
+    _worker_board = BACKENDS[backend]()
+
+
+def _analyze_chunk(fens: List[str]) -> List[str]:
+    # Results go back already serialized, which is cheaper to pickle than nested dicts
+    return [json.dumps(analyze_fen(_worker_board, fen)) for fen in fens]
+
+
+def analyze_parallel(fens: Iterable[str], workers: Optional[int] = None, chunk_size: int = 1000,
+                     backend: str = 'bitboard') -> Iterator[str]:
+    """Analyze FENs across a process pool, yielding JSON lines in input order.
+
+    Input is read in chunks and at most two chunks per worker are in flight, so memory stays
+    bounded no matter how large the input is.
+    """
+    fens = iter(fens)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = 2 * workers
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(backend,)) as executor:
+        pending = deque()
+        while True:
+            while len(pending) < max_in_flight:
+                chunk = list(itertools.islice(fens, chunk_size))
+                if not chunk:
+                    break
+                pending.append(executor.submit(_analyze_chunk, chunk))
+            if not pending:
+                return
+            yield from pending.popleft().result()
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Analyze FEN positions and write one JSON object per line.')
+    parser.add_argument('input', nargs='?', default='-', help='file with one FEN per line (default: stdin)')
+    parser.add_argument('-o', '--output', default='-', help='output JSON lines file (default: stdout)')
+    parser.add_argument('--workers', type=int, default=1, help='worker processes, 0 for one per CPU core')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='positions sent to a worker at a time')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard', help='board implementation to use')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    target = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        fens = read_fens(source)
+        if args.workers == 1:
+            lines = (json.dumps(result) for result in analyze_stream(fens, args.backend))
+        else:
+            lines = analyze_parallel(fens, args.workers or None, args.chunk_size, args.backend)
+        for line in lines:
+            target.write(line + '\n')
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if target is not sys.stdout:
+            target.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
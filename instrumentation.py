@@ -0,0 +1,177 @@
+import argparse
+import cProfile
+import functools
+import json
+import pstats
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, TextIO
+
+from chess_board import Bishop, ChessBoard, King, Knight, Pawn, Queen, Rook
+from perft import REFERENCE_POSITIONS, perft
+
+# ChessBoard phases with a cumulative timer; times are inclusive, so nested phases are also counted in their caller
+TIMED_METHODS = ['process_fen_string', '_calculate_all_available_moves', '_update_available_moves',
+                 'remove_check_moves', 'simulate_future_move_check', 'get_legal_moves', 'make_move', 'unmake_move']
+PIECE_CLASSES = [King, Queen, Rook, Bishop, Knight, Pawn]
+
+
+class Stats:
+    """Counters and per-phase timers collected while instrumentation is enabled."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.counters = {
+            'positions_processed': 0,  # FEN strings loaded and moves made
+            'moves_generated': 0,  # Pseudo-legal moves produced by the pieces
+            'legality_simulations': 0,  # simulate_future_move_check calls
+            'boards_created': 0,  # ChessBoard instances, the only board copies left
+        }
+        self.calls = {name: 0 for name in TIMED_METHODS}
+        self.seconds = {name: 0.0 for name in TIMED_METHODS}
+
+    def to_dict(self) -> Dict:
+        return {
+            'counters': dict(self.counters),
+            'timers': {name: {'calls': self.calls[name], 'seconds': self.seconds[name]} for name in TIMED_METHODS},
+        }
+
+    def dump_json(self, stream: TextIO):
+        json.dump(self.to_dict(), stream, indent=2)
+        stream.write('\n')
+
+    def report(self) -> str:
+        lines = [f"{name:<32} {value}" for name, value in self.counters.items()]
+        for name in TIMED_METHODS:
+            if self.calls[name]:
+                per_call = self.seconds[name] / self.calls[name] * 1e6
+                lines.append(f"{name:<32} {self.calls[name]:>9} calls {self.seconds[name]:9.3f}s {per_call:9.1f}us/call")
+        return '\n'.join(lines)
+
+
+stats = Stats()
+_originals: Dict = {}
+
+
+def _timed(name: str, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            stats.seconds[name] += time.perf_counter() - start
+            stats.calls[name] += 1
+    return wrapper
+
+
+def _counted(counter: str, method):
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        stats.counters[counter] += 1
+        return method(*args, **kwargs)
+    return wrapper
+
+
+def _counting_moves(method):
+    @functools.wraps(method)
+    def wrapper(piece, *args, **kwargs):
+        result = method(piece, *args, **kwargs)
+        stats.counters['moves_generated'] += len(piece.available_moves)
+        return result
+    return wrapper
+
+
+def enable():
+    """Wrap the ChessBoard hot paths with counters and timers.
+
+    Nothing is wrapped while disabled, so the board runs at full speed when instrumentation is off.
+    """
+    if _originals:
+        return
+    for name in TIMED_METHODS:
+        _originals[ChessBoard, name] = ChessBoard.__dict__[name]
+        method = _timed(name, ChessBoard.__dict__[name])
+        if name in ('process_fen_string', 'make_move'):
+            method = _counted('positions_processed', method)
+        elif name == 'simulate_future_move_check':
+            method = _counted('legality_simulations', method)
+        setattr(ChessBoard, name, method)
+    _originals[ChessBoard, '__init__'] = ChessBoard.__init__
+    ChessBoard.__init__ = _counted('boards_created', ChessBoard.__init__)
+    for piece_class in PIECE_CLASSES:
+        _originals[piece_class, 'calculate_available_moves'] = piece_class.__dict__['calculate_available_moves']
+        piece_class.calculate_available_moves = _counting_moves(piece_class.calculate_available_moves)
+
+
+def disable():
+    """Put the original methods back; the collected stats are kept."""
+    for (owner, name), method in _originals.items():
+        setattr(owner, name, method)
+    _originals.clear()
+
+
+@contextmanager
+def instrumented(reset: bool = True) -> Iterator[Stats]:
+    """Collect stats for the duration of a with block."""
+    if reset:
+        stats.reset()
+    enable()
+    try:
+        yield stats
+    finally:
+        disable()
+
+
+def run_workload(depth: int = 2, plies: int = 40):
+    """The scripted positions: perft on every reference position, then a game walk played move by move.
+
+    The walk goes through play(), so the incremental move updates are exercised as well as full generation.
+    """
+    board = ChessBoard()
+    for position in REFERENCE_POSITIONS:
+        board.process_fen_string(position.fen)
+        perft(board, depth)
+        board.process_fen_string(position.fen)
+        for ply in range(plies):
+            moves = board.get_legal_moves()
+            if not moves:
+                break
+            board.play(moves[(ply * 7) % len(moves)])
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Measure where ChessBoard spends its time on a scripted workload.')
+    parser.add_argument('--depth', type=int, default=2, help='perft depth for every reference position')
+    parser.add_argument('--plies', type=int, default=40, help='moves played from every reference position')
+    parser.add_argument('--json', default=None, help="write the stats to this file as JSON ('-' for stdout)")
+    parser.add_argument('--profile', action='store_true', help='run the workload under cProfile instead')
+    parser.add_argument('--sort', default='cumulative', help='cProfile sort key (default: cumulative)')
+    parser.add_argument('--limit', type=int, default=25, help='cProfile rows to print')
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        profiler = cProfile.Profile()
+        profiler.runcall(run_workload, args.depth, args.plies)
+        pstats.Stats(profiler).strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+        return 0
+
+    with instrumented() as collected:
+        start = time.perf_counter()
+        run_workload(args.depth, args.plies)
+        elapsed = time.perf_counter() - start
+    print(collected.report())
+    print(f"{'total':<32} {elapsed:.3f}s")
+    if args.json == '-':
+        collected.dump_json(sys.stdout)
+    elif args.json:
+        with open(args.json, 'w') as json_file:
+            collected.dump_json(json_file)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,219 @@
+import argparse
+import sys
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from chess_board import KING_DIRECTIONS, KNIGHT_DIRECTIONS
+
+Move = Tuple[int, int, int, int, Optional[str]]
+
+# Exchange values in centipawns; the king is worth more than anything it could win
+SEE_VALUES = {'p': 100, 'n': 320, 'b': 330, 'r': 500, 'q': 900, 'k': 20000}
+
+# Score bands, highest searched first: TT move, captures that do not lose material (by MVV-LVA),
+# killers, quiet moves by history, then captures that lose material
+TT_MOVE_SCORE = 1 << 30
+GOOD_CAPTURE_SCORE = 1 << 28
+KILLER_SCORE = 1 << 27
+LOSING_CAPTURE_SCORE = -(1 << 28)
+HISTORY_LIMIT = 1 << 20  # History scores are halved once one reaches this, so they stay below the killers
+
+
+def piece_map(board) -> Dict[int, str]:
+    """The board's pieces as {square: FEN symbol}, which is all the ordering needs from either backend."""
+    return {square: symbol for symbol, square in board.get_piece_squares()}
+
+
+def captured_symbol(pieces: Dict[int, str], move: Move) -> Optional[str]:
+    """The symbol of the piece a move captures, including the pawn taken en passant, or None for a quiet move."""
+    start_row, start_col, end_row, end_col, _promotion = move
+    symbol = pieces.get(end_row * 8 + end_col)
+    if symbol is None and start_col != end_col and pieces[start_row * 8 + start_col] in 'Pp':
+        return 'p' if pieces[start_row * 8 + start_col] == 'P' else 'P'
+    return symbol
+
+
+def is_tactical(pieces: Dict[int, str], move: Move) -> bool:
+    """Captures and promotions, the moves quiescence search looks at."""
+    return move[4] is not None or captured_symbol(pieces, move) is not None
+
+
+def _least_valuable_attacker(pieces: Dict[int, str], square: int, white: bool) -> Optional[int]:
+    """The square of the cheapest piece of one color attacking a square, sliders looking through empty squares."""
+    row, col = divmod(square, 8)
+    best = None
+    best_value = None
+
+    def consider(from_square: int):
+        nonlocal best, best_value
+        value = SEE_VALUES[pieces[from_square].lower()]
+        if best_value is None or value < best_value:
+            best, best_value = from_square, value
+
+    pawn_row = row + 1 if white else row - 1
+    if 0 <= pawn_row < 8:
+        for pawn_col in (col - 1, col + 1):
+            if 0 <= pawn_col < 8 and pieces.get(pawn_row * 8 + pawn_col) == ('P' if white else 'p'):
+                return pawn_row * 8 + pawn_col  # Nothing is cheaper than a pawn
+    for directions, letter in ((KNIGHT_DIRECTIONS, 'n'), (KING_DIRECTIONS, 'k')):
+        wanted = letter.upper() if white else letter
+        for dx, dy in directions:
+            new_row, new_col = row + dx, col + dy
+            if 0 <= new_row < 8 and 0 <= new_col < 8 and pieces.get(new_row * 8 + new_col) == wanted:
+                consider(new_row * 8 + new_col)
+    for dx, dy in KING_DIRECTIONS:
+        sliders = 'rq' if dx == 0 or dy == 0 else 'bq'
+        new_row, new_col = row + dx, col + dy
+        while 0 <= new_row < 8 and 0 <= new_col < 8:
+            symbol = pieces.get(new_row * 8 + new_col)
+            if symbol is not None:
+                if symbol.isupper() == white and symbol.lower() in sliders:
+                    consider(new_row * 8 + new_col)
+                break
+            new_row += dx
+            new_col += dy
+    return best
+
+
+def see(pieces: Dict[int, str], move: Move) -> int:
+    """Static exchange evaluation: the material the side to move ends up with after the best sequence of
+    recaptures on the target square, each side free to stop capturing when it would lose more.
+
+    Pieces that join through the square vacated by a capturer (x-rays) are found as the exchange goes on.
+    """
+    start_row, start_col, end_row, end_col, promotion = move
+    start, target = start_row * 8 + start_col, end_row * 8 + end_col
+    captured = captured_symbol(pieces, move)
+    pieces = dict(pieces)
+    mover = pieces.pop(start)
+    white = mover.isupper()
+    if captured is not None and target not in pieces:  # En passant, the captured pawn leaves its own square
+        del pieces[start_row * 8 + end_col]
+    gains = [SEE_VALUES[captured.lower()] if captured is not None else 0]
+    on_square = promotion or mover.lower()
+    if promotion:
+        gains[0] += SEE_VALUES[promotion] - SEE_VALUES['p']
+    pieces[target] = on_square.upper() if white else on_square
+    white = not white
+    while True:
+        attacker = _least_valuable_attacker(pieces, target, white)
+        if attacker is None:
+            break
+        # What this capture wins, assuming the piece it lands as is taken back
+        gains.append(SEE_VALUES[on_square] - gains[-1])
+        on_square = pieces.pop(attacker).lower()
+        pieces[target] = on_square.upper() if white else on_square
+        white = not white
+        if on_square == 'k' and _least_valuable_attacker(pieces, target, white) is not None:
+            gains.pop()  # The king cannot capture into a defended square
+            break
+    # Each side only continues the exchange when that does better than stopping
+    for index in range(len(gains) - 1, 0, -1):
+        gains[index - 1] = -max(-gains[index - 1], gains[index])
+    return gains[0]
+
+
+class MoveOrderer:
+    """Scores moves for the search: TT move, MVV-LVA captures checked by SEE, two killers per ply and a history table."""
+
+    def __init__(self, max_ply: int = 129):
+        self.killers: List[List[Optional[Move]]] = [[None, None] for _ in range(max_ply)]
+        self.history = [0] * 4096  # By from square * 64 + to square
+
+    def clear(self):
+        for slots in self.killers:
+            slots[0] = slots[1] = None
+        self.history = [0] * 4096
+
+    def score(self, pieces: Dict[int, str], move: Move, ply: int, tt_move: Optional[Move] = None) -> int:
+        if move == tt_move:
+            return TT_MOVE_SCORE
+        start_row, start_col, end_row, end_col, promotion = move
+        captured = captured_symbol(pieces, move)
+        if captured is not None or promotion is not None:
+            exchange = see(pieces, move)
+            if exchange < 0:
+                return LOSING_CAPTURE_SCORE + exchange
+            # Most valuable victim first, then least valuable attacker
+            victim = SEE_VALUES[captured.lower()] if captured is not None else 0
+            if promotion is not None:
+                victim += SEE_VALUES[promotion]
+            return GOOD_CAPTURE_SCORE + victim * 64 - SEE_VALUES[pieces[start_row * 8 + start_col].lower()] // 16
+        killers = self.killers[ply]
+        if move == killers[0]:
+            return KILLER_SCORE + 1
+        if move == killers[1]:
+            return KILLER_SCORE
+        return self.history[(start_row * 8 + start_col) * 64 + end_row * 8 + end_col]
+
+    def order(self, pieces: Dict[int, str], moves: Iterable[Move], ply: int,
+              tt_move: Optional[Move] = None) -> List[Move]:
+        """Return the moves of the position given by its piece map sorted best first."""
+        return sorted(moves, key=lambda move: self.score(pieces, move, ply, tt_move), reverse=True)
+
+    def scored(self, pieces: Dict[int, str], moves: Iterable[Move], ply: int) -> List[Tuple[int, Move]]:
+        """Return (score, move) pairs sorted best first, for callers that split the moves by score band."""
+        return sorted(((self.score(pieces, move, ply), move) for move in moves), key=lambda pair: pair[0], reverse=True)
+
+    def record_cutoff(self, pieces: Dict[int, str], move: Move, ply: int, depth: int):
+        """Remember a quiet move that caused a beta cutoff as a killer for this ply and in the history table."""
+        if is_tactical(pieces, move):
+            return
+        killers = self.killers[ply]
+        if move != killers[0]:
+            killers[1] = killers[0]
+            killers[0] = move
+        index = (move[0] * 8 + move[1]) * 64 + move[2] * 8 + move[3]
+        self.history[index] += depth * depth
+        if self.history[index] >= HISTORY_LIMIT:
+            self.history = [value // 2 for value in self.history]
+
+
+def compare_ordering(depth: int, backend: str = 'bitboard', positions=None,
+                     node_limit: Optional[int] = None) -> List[Tuple[str, int, int, float, float]]:
+    """Search every position to a fixed depth with and without move ordering: (name, nodes, unordered nodes, times).
+
+    A search stopped by node_limit reports the nodes it had searched, a lower bound for the full depth.
+    """
+    from engine import Engine  # engine imports this module
+    from perft import BACKENDS, REFERENCE_POSITIONS
+
+    rows = []
+    board = BACKENDS[backend]()
+    for position in positions or REFERENCE_POSITIONS:
+        counts = []
+        for ordered in (True, False):
+            board.process_fen_string(position.fen)
+            start = time.perf_counter()
+            result = Engine(move_ordering=ordered).search(board, depth, node_limit=node_limit)
+            counts.append((result.nodes, time.perf_counter() - start))
+        rows.append((position.name, counts[0][0], counts[1][0], counts[0][1], counts[1][1]))
+    return rows
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Compare search nodes with and without move ordering.')
+    parser.add_argument('--depth', type=int, default=3, help='search depth for every reference position')
+    parser.add_argument('--backend', choices=['bitboard', 'board'], default='bitboard', help='board implementation')
+    parser.add_argument('--node-limit', type=int, default=200000,
+                        help='stop a search after this many nodes; capped counts are marked + (0 for no limit)')
+    args = parser.parse_args(argv)
+
+    def count(nodes: int) -> str:
+        capped = args.node_limit and nodes >= args.node_limit
+        return f"{nodes:>8}{'+' if capped else ' '}"
+
+    total_ordered = total_unordered = 0
+    rows = compare_ordering(args.depth, args.backend, node_limit=args.node_limit or None)
+    for name, ordered, unordered, ordered_time, unordered_time in rows:
+        total_ordered += ordered
+        total_unordered += unordered
+        print(f"{name:<22} ordered {count(ordered)} nodes {ordered_time:6.2f}s  "
+              f"unordered {count(unordered)} nodes {unordered_time:6.2f}s  {1 - ordered / unordered:6.1%} fewer")
+    print(f"{'total':<22} ordered {total_ordered:>8}  nodes  unordered {total_unordered:>8}  nodes  "
+          f"{1 - total_ordered / total_unordered:.1%} fewer")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
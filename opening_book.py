@@ -0,0 +1,183 @@
+import argparse
+import itertools
+import mmap
+import random
+import struct
+import sys
+from collections import defaultdict
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from perft import BACKENDS, START_FEN, move_to_coordinates
+from pgn import PgnGame, iter_moves, read_games
+
+# Polyglot record layout, big-endian: position key, move, weight, learn. Keys are our own Zobrist keys
+# and moves use our square numbers (row * 8 + col), so books are not interchangeable with Polyglot's
+RECORD = struct.Struct('>QHHI')
+PROMOTION_CODES = {None: 0, 'n': 1, 'b': 2, 'r': 3, 'q': 4}
+PROMOTION_LETTERS = {code: letter for letter, code in PROMOTION_CODES.items()}
+MAX_WEIGHT = 0xFFFF
+
+Move = Tuple[int, int, int, int, Optional[str]]
+
+
+class BookEntry(NamedTuple):
+    move: Move
+    weight: int
+    learn: int  # Number of games the move was played in when the book was built
+
+
+def encode_book_move(move: Move) -> int:
+    """Pack a move as end | start << 6 | promotion << 12, castling as the two-square king move."""
+    start_row, start_col, end_row, end_col, promotion = move
+    return (end_row * 8 + end_col) | (start_row * 8 + start_col) << 6 | PROMOTION_CODES[promotion] << 12
+
+
+def decode_book_move(value: int) -> Move:
+    start_row, start_col = divmod((value >> 6) & 63, 8)
+    end_row, end_col = divmod(value & 63, 8)
+    return start_row, start_col, end_row, end_col, PROMOTION_LETTERS.get(value >> 12)
+
+
+class OpeningBook:
+    """Read-only book file, memory-mapped and binary-searched so it is never loaded into memory."""
+
+    def __init__(self, path: str, seed: Optional[int] = None):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = self._file.seek(0, 2)
+        if size % RECORD.size:
+            self._file.close()
+            raise ValueError(f"Invalid opening book: {path} is not a whole number of {RECORD.size}-byte records")
+        # mmap cannot map an empty file; an empty book simply has no entries
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._count = size // RECORD.size
+        self._random = random.Random(seed)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+    def _key_at(self, index: int) -> int:
+        return struct.unpack_from('>Q', self._map, index * RECORD.size)[0]
+
+    def entries(self, key: int) -> List[BookEntry]:
+        """All records stored for a position key, highest weight first."""
+        low, high = 0, self._count
+        while low < high:  # Leftmost record with this key
+            middle = (low + high) // 2
+            if self._key_at(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        entries = []
+        for index in range(low, self._count):
+            record_key, move, weight, learn = RECORD.unpack_from(self._map, index * RECORD.size)
+            if record_key != key:
+                break
+            entries.append(BookEntry(decode_book_move(move), weight, learn))
+        return entries
+
+    def choose_move(self, board, best: bool = False) -> Optional[Move]:
+        """Pick a book move for the board's position, at random in proportion to weight unless best is set.
+
+        Moves that are not legal in the position (a key collision) are ignored.
+        """
+        entries = self.entries(board.zobrist_key)
+        if not entries:
+            return None
+        legal_moves = set(board.get_legal_moves())
+        entries = [entry for entry in entries if entry.move in legal_moves]
+        if not entries:
+            return None
+        if best:
+            return entries[0].move
+        return self._random.choices([entry.move for entry in entries], [entry.weight for entry in entries])[0]
+
+
+def _points(result: str, active_color: str) -> int:
+    # Polyglot weighting: two points for a win of the side that moved, one for a draw or an unfinished game
+    if result == '1-0':
+        return 2 if active_color == 'w' else 0
+    if result == '0-1':
+        return 2 if active_color == 'b' else 0
+    return 1
+
+
+def collect_book_moves(games: Iterable[PgnGame], max_ply: int = 20,
+                       backend: str = 'bitboard') -> Dict[Tuple[int, int], List[int]]:
+    """Count the first max_ply moves of every game as {(key, move): [points, games]}, skipping broken games."""
+    counts: Dict[Tuple[int, int], List[int]] = defaultdict(lambda: [0, 0])
+    board = BACKENDS[backend]()
+    for game in games:
+        result = game.headers.get('Result', '*')
+        seen = []
+        try:
+            board.process_fen_string(game.fen)
+            key, color = board.zobrist_key, board.active_color
+            for move in itertools.islice(iter_moves(game, board), max_ply):
+                seen.append((key, encode_book_move(move), color))
+                key, color = board.zobrist_key, board.active_color
+        except (ValueError, IndexError):
+            continue
+        for key, move, color in seen:
+            entry = counts[key, move]
+            entry[0] += _points(result, color)
+            entry[1] += 1
+    return counts
+
+
+def write_book(path: str, counts: Dict[Tuple[int, int], List[int]], min_games: int = 1) -> int:
+    """Write the records sorted by key and then by descending weight; returns the number written."""
+    records = [(key, move, min(points, MAX_WEIGHT), min(games, 0xFFFFFFFF))
+               for (key, move), (points, games) in counts.items() if points > 0 and games >= min_games]
+    records.sort(key=lambda record: (record[0], -record[2], record[1]))
+    with open(path, 'wb') as book_file:
+        for record in records:
+            book_file.write(RECORD.pack(*record))
+    return len(records)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Build or probe a binary opening book.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='build a book from PGN files')
+    build.add_argument('pgn', nargs='+', help='PGN files to read')
+    build.add_argument('-o', '--output', default='book.bin', help='book file to write (default: book.bin)')
+    build.add_argument('--max-ply', type=int, default=20, help='plies of every game to add to the book')
+    build.add_argument('--min-games', type=int, default=1, help='drop moves played in fewer games than this')
+    probe = commands.add_parser('probe', help='list the book moves of a position')
+    probe.add_argument('book', help='book file')
+    probe.add_argument('--fen', default=START_FEN, help='position to look up (default: start position)')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        counts = defaultdict(lambda: [0, 0])
+        for path in args.pgn:
+            with open(path) as pgn_file:
+                for position, (points, games) in collect_book_moves(read_games(pgn_file), args.max_ply).items():
+                    counts[position][0] += points
+                    counts[position][1] += games
+        written = write_book(args.output, counts, args.min_games)
+        print(f"wrote {written} records to {args.output}")
+        return 0
+
+    board = BACKENDS['bitboard']()
+    board.process_fen_string(args.fen)
+    with OpeningBook(args.book) as book:
+        for entry in book.entries(board.zobrist_key):
+            print(f"{move_to_coordinates(entry.move)} weight {entry.weight} games {entry.learn}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
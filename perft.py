@@ -0,0 +1,153 @@
+import argparse
+import sys
+import time
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from chess_board import ChessBoard, move_buffers
+from chess_bitboard import BitboardChessBoard
+
+START_FEN = 'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1'
+
+BACKENDS = {'board': ChessBoard, 'bitboard': BitboardChessBoard}
+
+
+class PerftPosition(NamedTuple):
+    name: str
+    fen: str
+    counts: List[int]  # counts[depth - 1] is the number of leaf nodes at that depth
+
+
+# Standard positions with known leaf counts, covering castling, en passant, promotions and pins
+REFERENCE_POSITIONS = [
+    PerftPosition('startpos', START_FEN, [20, 400, 8902, 197281, 4865609]),
+    PerftPosition('kiwipete', 'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+                  [48, 2039, 97862, 4085603]),
+    PerftPosition('position3', '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1', [14, 191, 2812, 43238, 674624]),
+    PerftPosition('position4', 'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+                  [6, 264, 9467, 422333]),
+    PerftPosition('position5', 'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8', [44, 1486, 62379, 2103487]),
+    PerftPosition('position6', 'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+                  [46, 2079, 89890, 3894594]),
+    PerftPosition('illegal-ep-move', '3k4/3p4/8/K1P4r/8/8/8/8 b - - 0 1', [18, 92, 1670, 10138, 185429]),
+    PerftPosition('illegal-ep-capture', '8/8/4k3/8/2p5/8/B2P2K1/8 w - - 0 1', [13, 102, 1266, 10276, 135655]),
+    PerftPosition('ep-gives-check', '8/8/1k6/2b5/2pP4/8/5K2/8 b - d3 0 1', [15, 126, 1928, 13931, 206379]),
+    PerftPosition('short-castle-check', '5k2/8/8/8/8/8/8/4K2R w K - 0 1', [15, 66, 1198, 6399, 120330]),
+    PerftPosition('long-castle-check', '3k4/8/8/8/8/8/8/R3K3 w Q - 0 1', [16, 71, 1286, 7418, 141077]),
+    PerftPosition('castle-rights', 'r3k2r/1b4bq/8/8/8/8/7B/R3K2R w KQkq - 0 1', [26, 1141, 27826]),
+    PerftPosition('castling-prevented', 'r3k2r/8/3Q4/8/8/5q2/8/R3K2R b KQkq - 0 1', [44, 1494, 50509]),
+    PerftPosition('promote-out-of-check', '2K2r2/4P3/8/8/8/8/8/3k4 w - - 0 1', [11, 133, 1442, 19174, 266199]),
+    PerftPosition('discovered-check', '8/8/1P2K3/8/2n5/1q6/8/5k2 b - - 0 1', [29, 165, 5160, 31961]),
+    PerftPosition('underpromote-check', '8/P1k5/K7/8/8/8/8/8 w - - 0 1', [6, 27, 273, 1329, 18135]),
+    PerftPosition('self-stalemate', 'K1k5/8/P7/8/8/8/8/8 w - - 0 1', [2, 6, 13, 63, 382]),
+    PerftPosition('stalemate-checkmate', '8/k1P5/8/1K6/8/8/8/8 w - - 0 1', [10, 25, 268, 926, 10857, 43261]),
+    PerftPosition('double-check', '8/8/2k5/5q2/5n2/8/5K2/8 b - - 0 1', [37, 183, 6559, 23527]),
+]
+
+
+def perft(board, depth: int, buffers: Optional[List] = None) -> int:
+    """Count the leaf nodes of the legal move tree below the board's position.
+
+    Moves are generated as packed ints into one preallocated buffer per ply, so the walk builds no move lists.
+    """
+    if depth == 0:
+        return 1
+    if buffers is None:
+        buffers = move_buffers(depth)
+    buffer = buffers[depth - 1]
+    count = board.generate_moves(buffer)
+    if depth == 1:
+        return count
+    nodes = 0
+    for index in range(count):
+        board.push(buffer[index])
+        nodes += perft(board, depth - 1, buffers)
+        board.pop()
+    return nodes
+
+
+def divide(board, depth: int) -> Dict[str, int]:
+    """Count the leaf nodes below each root move, keyed by the move in coordinate notation."""
+    counts = {}
+    for move in board.get_legal_moves():
+        board.make_move(*move)
+        counts[move_to_coordinates(move)] = perft(board, depth - 1)
+        board.unmake_move()
+    return counts
+
+
+def move_to_coordinates(move: Tuple) -> str:
+    """Write a (start_row, start_col, end_row, end_col, promotion) move as e.g. e2e4 or e7e8q."""
+    start_row, start_col, end_row, end_col, promotion = move
+    text = f"{chr(start_col + ord('a'))}{8 - start_row}{chr(end_col + ord('a'))}{8 - end_row}"
+    return text + (promotion or '')
+
+
+def coordinates_to_move(text: str) -> Tuple:
+    """Read a move written as e.g. e2e4 or e7e8q back into a (start_row, start_col, end_row, end_col, promotion) move."""
+    if len(text) not in (4, 5) or text[0] not in 'abcdefgh' or text[2] not in 'abcdefgh' \
+            or text[1] not in '12345678' or text[3] not in '12345678' or text[4:] not in ('', 'n', 'b', 'r', 'q'):
+        raise ValueError(f"Invalid move: {text}")
+    return 8 - int(text[1]), ord(text[0]) - ord('a'), 8 - int(text[3]), ord(text[2]) - ord('a'), text[4:] or None
+
+
+def timed_perft(board, depth: int) -> Tuple[int, float]:
+    start = time.perf_counter()
+    nodes = perft(board, depth)
+    return nodes, time.perf_counter() - start
+
+
+def _format_speed(nodes: int, seconds: float) -> str:
+    nps = nodes / seconds if seconds > 0 else float('inf')
+    return f"nodes {nodes} time {seconds:.3f}s nps {nps:.0f}"
+
+
+def run_suite(backend: str, max_depth: int, max_nodes: int) -> bool:
+    """Check every reference position up to max_depth, skipping counts above max_nodes."""
+    all_passed = True
+    total_nodes = 0
+    total_time = 0.0
+    for position in REFERENCE_POSITIONS:
+        for depth, expected in enumerate(position.counts[:max_depth], start=1):
+            if expected > max_nodes:
+                break
+            board = BACKENDS[backend]()
+            board.process_fen_string(position.fen)
+            nodes, seconds = timed_perft(board, depth)
+            total_nodes += nodes
+            total_time += seconds
+            status = 'ok' if nodes == expected else f'FAIL (expected {expected})'
+            all_passed = all_passed and nodes == expected
+            print(f"{position.name:<22} depth {depth} {_format_speed(nodes, seconds)} {status}")
+    print(f"total {_format_speed(total_nodes, total_time)}")
+    return all_passed
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Count move generator leaf nodes and report nodes per second.')
+    parser.add_argument('--fen', default=START_FEN, help='position to search (default: start position)')
+    parser.add_argument('--depth', type=int, default=3, help='search depth in plies')
+    parser.add_argument('--divide', action='store_true', help='print the node count below each root move')
+    parser.add_argument('--suite', action='store_true', help='verify the bundled reference positions up to --depth')
+    parser.add_argument('--max-nodes', type=int, default=1_000_000, help='skip suite entries larger than this')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='board', help='board implementation to test')
+    args = parser.parse_args(argv)
+
+    if args.suite:
+        return 0 if run_suite(args.backend, args.depth, args.max_nodes) else 1
+
+    board = BACKENDS[args.backend]()
+    board.process_fen_string(args.fen)
+    start = time.perf_counter()
+    if args.divide:
+        counts = divide(board, args.depth)
+        for move in sorted(counts):
+            print(f"{move}: {counts[move]}")
+        nodes = sum(counts.values())
+    else:
+        nodes = perft(board, args.depth)
+    print(_format_speed(nodes, time.perf_counter() - start))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+import argparse
+import datetime
+import re
+import sys
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, TextIO, Tuple
+
+from chess_board import CHECKMATE, ONGOING
+from perft import BACKENDS, START_FEN
+
+Move = Tuple[int, int, int, int, Optional[str]]
+
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+SEVEN_TAG_ROSTER = ('Event', 'Site', 'Date', 'Round', 'White', 'Black', 'Result')
+
+SAN_PATTERN = re.compile(r'^([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQnbrq]))?$')
+TAG_PATTERN = re.compile(r'^\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]\s*$')
+# Comments, move numbers, variation brackets, NAGs and everything else (moves and results)
+TOKEN_PATTERN = re.compile(r'\{[^}]*\}|;[^\n]*|\d+\.+|\$\d+|[()]|[^\s(){};]+')
+
+
+class PgnGame(NamedTuple):
+    """One game from a PGN file; the movetext is only tokenized when the moves are asked for."""
+    headers: Dict[str, str]
+    movetext: str
+
+    def san_moves(self) -> List[str]:
+        """The mainline moves in SAN, without comments, variations, move numbers or the result."""
+        moves = []
+        depth = 0
+        for token in TOKEN_PATTERN.findall(self.movetext):
+            if token == '(':
+                depth += 1
+            elif token == ')':
+                depth -= 1
+            elif depth == 0 and token[0] not in '{;$' and token not in RESULTS and not token.endswith('.'):
+                moves.append(token)
+        return moves
+
+    @property
+    def fen(self) -> str:
+        return self.headers.get('FEN', START_FEN)
+
+
+def _square_name(square: int) -> str:
+    row, col = divmod(square, 8)
+    return f"{chr(col + ord('a'))}{8 - row}"
+
+
+def _square_number(name: str) -> int:
+    return (8 - int(name[1])) * 8 + ord(name[0]) - ord('a')
+
+
+def _piece_map(board) -> Dict[int, str]:
+    return {square: symbol for symbol, square in board.get_piece_squares()}
+
+
+def _normalize(move: Tuple, pieces: Dict[int, str]) -> Move:
+    # Four-tuples from the game loop promote to a queen, like play() does
+    start_row, start_col, end_row, end_col = move[:4]
+    promotion = move[4] if len(move) > 4 else None
+    if promotion is None and pieces.get(start_row * 8 + start_col, ' ').lower() == 'p' and end_row in (0, 7):
+        promotion = 'q'
+    return start_row, start_col, end_row, end_col, promotion
+
+
+def _san_without_suffix(move: Move, pieces: Dict[int, str], legal_moves: List[Move]) -> str:
+    start_row, start_col, end_row, end_col, promotion = move
+    start = start_row * 8 + start_col
+    end = end_row * 8 + end_col
+    piece_type = pieces[start].upper()
+    if piece_type == 'K' and abs(end_col - start_col) == 2:
+        return 'O-O' if end_col > start_col else 'O-O-O'
+    capture = end in pieces or (piece_type == 'P' and start_col != end_col)
+    target = _square_name(end)
+    if piece_type == 'P':
+        san = f"{_square_name(start)[0]}x{target}" if capture else target
+        return san + (f"={promotion.upper()}" if promotion else '')
+
+    # Disambiguate against other pieces of the same type that can also reach the target
+    rivals = [other[:2] for other in legal_moves
+              if other[2:4] == (end_row, end_col) and other[:2] != (start_row, start_col)
+              and pieces[other[0] * 8 + other[1]].upper() == piece_type]
+    prefix = ''
+    if rivals:
+        if all(col != start_col for _row, col in rivals):
+            prefix = _square_name(start)[0]
+        elif all(row != start_row for row, _col in rivals):
+            prefix = _square_name(start)[1]
+        else:
+            prefix = _square_name(start)
+    return f"{piece_type}{prefix}{'x' if capture else ''}{target}"
+
+
+def _check_suffix(board) -> str:
+    # Called after the move has been played
+    if not board.is_in_check():
+        return ''
+    return '+' if board.get_legal_moves() else '#'
+
+
+def move_to_san(board, move: Tuple) -> str:
+    """Write a legal move of the board's position in SAN, e.g. Nbd7, exd6, O-O or e8=Q+."""
+    pieces = _piece_map(board)
+    move = _normalize(move, pieces)
+    san = _san_without_suffix(move, pieces, board.get_legal_moves())
+    board.make_move(*move)
+    try:
+        san += _check_suffix(board)
+    finally:
+        board.unmake_move()
+    board.get_legal_moves()  # ChessBoard keeps the legal moves on its pieces, rebuild them
+    return san
+
+
+def moves_to_san(fen: str, moves: Iterable[Tuple], backend: str = 'bitboard') -> List[str]:
+    """Write a sequence of legal moves played from fen in SAN."""
+    board = BACKENDS[backend]()
+    board.process_fen_string(fen)
+    sans = []
+    for move in moves:
+        pieces = _piece_map(board)
+        move = _normalize(move, pieces)
+        san = _san_without_suffix(move, pieces, board.get_legal_moves())
+        board.play(move)
+        sans.append(san + _check_suffix(board))
+    return sans
+
+
+def _parse(san: str):
+    text = san.rstrip('+#!?')
+    if text.replace('0', 'O') in ('O-O', 'O-O-O'):
+        return 'castle', text.replace('0', 'O')
+    match = SAN_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"Invalid SAN move: {san}")
+    piece_type, file, rank, target, promotion = match.groups()
+    return piece_type or 'P', file, rank, _square_number(target), promotion.lower() if promotion else None
+
+
+def _castling_move(board, castle: str) -> Move:
+    row = 7 if board.active_color == 'w' else 0
+    return row, 4, row, 6 if castle == 'O-O' else 2, None
+
+
+def parse_san(board, san: str) -> Move:
+    """Find the legal move of the board's position that a SAN string describes."""
+    parsed = _parse(san)
+    legal_moves = board.get_legal_moves()
+    if parsed[0] == 'castle':
+        move = _castling_move(board, parsed[1])
+        if move not in legal_moves or _piece_map(board).get(move[0] * 8 + 4, ' ').upper() != 'K':
+            raise ValueError(f"Illegal move: {san}")
+        return move
+    piece_type, file, rank, target, promotion = parsed
+    pieces = _piece_map(board)
+    candidates = [move for move in legal_moves
+                  if move[2] * 8 + move[3] == target and move[4] == promotion
+                  and pieces[move[0] * 8 + move[1]].upper() == piece_type
+                  and (file is None or move[1] == ord(file) - ord('a'))
+                  and (rank is None or move[0] == 8 - int(rank))]
+    if not candidates:
+        raise ValueError(f"Illegal move: {san}")
+    if len(candidates) > 1:
+        raise ValueError(f"Ambiguous move: {san}")
+    return candidates[0]
+
+
+def _reaches(piece_type: str, start: int, end: int, pieces: Dict[int, str]) -> bool:
+    start_row, start_col = divmod(start, 8)
+    end_row, end_col = divmod(end, 8)
+    row_delta, col_delta = end_row - start_row, end_col - start_col
+    if piece_type == 'N':
+        return {abs(row_delta), abs(col_delta)} == {1, 2}
+    if piece_type == 'K':
+        return max(abs(row_delta), abs(col_delta)) == 1
+    straight = row_delta == 0 or col_delta == 0
+    diagonal = abs(row_delta) == abs(col_delta)
+    if not ((piece_type in 'RQ' and straight) or (piece_type in 'BQ' and diagonal)):
+        return False
+    row_step = (row_delta > 0) - (row_delta < 0)
+    col_step = (col_delta > 0) - (col_delta < 0)
+    row, col = start_row + row_step, start_col + col_step
+    while (row, col) != (end_row, end_col):
+        if row * 8 + col in pieces:
+            return False
+        row, col = row + row_step, col + col_step
+    return True
+
+
+def parse_san_trusted(board, san: str) -> Move:
+    """Like parse_san, but for input known to be legal: finds the piece by geometry without generating moves.
+
+    Only when two pieces could geometrically reach the target (one of them pinned) does it fall
+    back to the legal moves.
+    """
+    parsed = _parse(san)
+    if parsed[0] == 'castle':
+        return _castling_move(board, parsed[1])
+    piece_type, file, rank, target, promotion = parsed
+    pieces = _piece_map(board)
+    white = board.active_color == 'w'
+    target_row, target_col = divmod(target, 8)
+    if piece_type == 'P':
+        behind = 1 if white else -1
+        if file is not None and ord(file) - ord('a') != target_col:  # Capture, the file is always given
+            return target_row + behind, ord(file) - ord('a'), target_row, target_col, promotion
+        pawn = 'P' if white else 'p'
+        start_row = target_row + behind if pieces.get(target + 8 * behind) == pawn else target_row + 2 * behind
+        return start_row, target_col, target_row, target_col, promotion
+    symbol = piece_type if white else piece_type.lower()
+    candidates = [square for square, other in pieces.items()
+                  if other == symbol and (file is None or square % 8 == ord(file) - ord('a'))
+                  and (rank is None or square // 8 == 8 - int(rank)) and _reaches(piece_type, square, target, pieces)]
+    if len(candidates) != 1:
+        return parse_san(board, san)
+    return candidates[0] // 8, candidates[0] % 8, target_row, target_col, None
+
+
+def read_games(stream: TextIO) -> Iterator[PgnGame]:
+    """Yield the games of a PGN stream one at a time, reading only as far as the current game."""
+    headers: Dict[str, str] = {}
+    movetext: List[str] = []
+    for line in stream:
+        stripped = line.strip()
+        if stripped.startswith('%'):  # Escape mechanism, the line is ignored
+            continue
+        match = TAG_PATTERN.match(stripped) if stripped.startswith('[') else None
+        if match:
+            if movetext:
+                yield PgnGame(headers, ' '.join(movetext))
+                headers, movetext = {}, []
+            headers[match.group(1)] = match.group(2).replace('\\"', '"').replace('\\\\', '\\')
+        elif stripped:
+            movetext.append(stripped)
+    if headers or movetext:
+        yield PgnGame(headers, ' '.join(movetext))
+
+
+def iter_moves(game: PgnGame, board, trusted: bool = False) -> Iterator[Move]:
+    """Set the board to the game's start and play its moves one by one, yielding each after it is played.
+
+    Checked replay plays every move through ChessBoard.play, which rejects illegal moves with a
+    ValueError. Trusted replay skips move generation and the legality checks and plays with
+    make_move, so a ChessBoard's cached available moves are stale until get_legal_moves is called.
+    """
+    board.process_fen_string(game.fen)
+    for san in game.san_moves():
+        if trusted:
+            move = parse_san_trusted(board, san)
+            board.make_move(*move)
+        else:
+            move = parse_san(board, san)
+            board.play(move)
+        yield move
+
+
+def replay_game(game: PgnGame, board=None, trusted: bool = False, backend: str = 'bitboard'):
+    """Play a game through to its final position and return the board."""
+    board = board if board is not None else BACKENDS[backend]()
+    for _move in iter_moves(game, board, trusted):
+        pass
+    if trusted:
+        board.get_legal_moves()
+    return board
+
+
+def game_result(board) -> str:
+    """The PGN result of the board's position: decisive on checkmate, a draw by any draw rule, '*' otherwise."""
+    status = board.game_status()
+    if status == ONGOING:
+        return '*'
+    if status != CHECKMATE:
+        return '1/2-1/2'
+    return '0-1' if board.active_color == 'w' else '1-0'
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def format_game(headers: Dict[str, str], san_moves: List[str], fen: str = START_FEN, width: int = 79) -> str:
+    """Write a game as PGN text: the seven tag roster first, then the movetext wrapped at width."""
+    headers = dict(headers)
+    headers.setdefault('Result', '*')
+    if fen != START_FEN:
+        headers.setdefault('SetUp', '1')
+        headers.setdefault('FEN', fen)
+    ordered = list(SEVEN_TAG_ROSTER) + [tag for tag in headers if tag not in SEVEN_TAG_ROSTER]
+    lines = [f'[{tag} "{_escape(headers.get(tag, "?"))}"]' for tag in ordered]
+
+    fen_parts = fen.split(' ')
+    move_number = int(fen_parts[5])
+    white_to_move = fen_parts[1] == 'w'
+    tokens = []
+    for index, san in enumerate(san_moves):
+        if white_to_move:
+            tokens.append(f"{move_number}. {san}")
+        elif index == 0:
+            tokens.append(f"{move_number}... {san}")
+        else:
+            tokens.append(san)
+        if not white_to_move:
+            move_number += 1
+        white_to_move = not white_to_move
+    tokens.append(headers['Result'])
+
+    movetext = []
+    line = ''
+    for token in tokens:
+        if line and len(line) + 1 + len(token) > width:
+            movetext.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    movetext.append(line)
+    return '\n'.join(lines) + '\n\n' + '\n'.join(movetext) + '\n\n'
+
+
+def write_game(stream: TextIO, moves: Iterable[Tuple], headers: Optional[Dict[str, str]] = None,
+               fen: str = START_FEN, result: Optional[str] = None, backend: str = 'bitboard'):
+    """Append a game given as move tuples played from fen to a PGN stream."""
+    headers = dict(headers or {})
+    headers.setdefault('Date', datetime.date.today().strftime('%Y.%m.%d'))
+    if result is not None:
+        headers['Result'] = result
+    stream.write(format_game(headers, moves_to_san(fen, moves, backend), fen))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Replay every game of a PGN file and report the replay speed.')
+    parser.add_argument('input', nargs='?', default='-', help='PGN file (default: stdin)')
+    parser.add_argument('--trusted', action='store_true', help='skip legality checks, for input known to be legal')
+    parser.add_argument('--fen', action='store_true', help='print the final position of every game')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard', help='board implementation to use')
+    args = parser.parse_args(argv)
+
+    source = sys.stdin if args.input == '-' else open(args.input)
+    board = BACKENDS[args.backend]()
+    games = plies = errors = 0
+    start = time.perf_counter()
+    try:
+        for number, game in enumerate(read_games(source), start=1):
+            try:
+                plies += sum(1 for _move in iter_moves(game, board, args.trusted))
+            except ValueError as error:
+                errors += 1
+                print(f"game {number}: {error}", file=sys.stderr)
+                continue
+            games += 1
+            if args.fen:
+                print(board.get_fen_string())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    seconds = time.perf_counter() - start
+    rate = plies / seconds if seconds > 0 else float('inf')
+    print(f"games {games} errors {errors} plies {plies} time {seconds:.3f}s plies/s {rate:.0f}", file=sys.stderr)
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+import argparse
+import mmap
+import struct
+import sys
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+from chess_board import BLACK, WHITE
+from chess_bitboard import CASTLING_SYMBOLS, PIECE_SYMBOLS
+from fen_analysis import read_fens
+
+# Record layout, little-endian, 32 bytes: occupancy bitmap (bit = row * 8 + col), the occupied squares'
+# piece codes as 4-bit PIECE_SYMBOLS indexes in square order (low nibble first), flags (bit 0 black to
+# move, bits 1-4 castling rights as in chess_bitboard), en passant square, halfmove clock, fullmove number
+RECORD = struct.Struct('<Q16sBBHH2x')
+RECORD_SIZE = RECORD.size
+MAX_PIECES = 32  # Two nibbles per byte of the piece field
+NO_SQUARE = 0xFF
+EMPTY_RECORD = bytes(RECORD_SIZE)
+PIECE_CODES = {symbol: code for code, symbol in enumerate(PIECE_SYMBOLS)}
+
+Buffer = Union[bytes, bytearray, memoryview, mmap.mmap]
+
+
+class PackedPosition(NamedTuple):
+    """A decoded record, with the pieces as (symbol, square) pairs like get_piece_squares()."""
+    pieces: List[Tuple[str, int]]
+    active_color: str
+    castling: str
+    en_passant: Optional[int]
+    halfmove_clock: int
+    fullmove_number: int
+
+    def fen(self) -> str:
+        squares = [None] * 64
+        for symbol, square in self.pieces:
+            squares[square] = symbol
+        rows = []
+        for row in range(8):
+            fen_row = ''
+            empty_count = 0
+            for symbol in squares[row * 8:row * 8 + 8]:
+                if symbol is None:
+                    empty_count += 1
+                    continue
+                if empty_count > 0:
+                    fen_row += str(empty_count)
+                    empty_count = 0
+                fen_row += symbol
+            if empty_count > 0:
+                fen_row += str(empty_count)
+            rows.append(fen_row)
+        if self.en_passant is None:
+            en_passant = '-'
+        else:
+            row, col = divmod(self.en_passant, 8)
+            en_passant = f"{chr(col + ord('a'))}{8 - row}"
+        return f"{'/'.join(rows)} {self.active_color} {self.castling} {en_passant} {self.halfmove_clock} {self.fullmove_number}"
+
+
+def _pack_into(buffer: Buffer, offset: int, pieces: List[Tuple[str, int]], black: bool, castling: str,
+               en_passant: Optional[int], halfmove_clock: int, fullmove_number: int):
+    # pieces are (symbol, square) pairs in square order, as get_piece_squares() lists them
+    if len(pieces) > MAX_PIECES:
+        raise ValueError(f"Cannot encode a position with {len(pieces)} pieces, at most {MAX_PIECES} fit")
+    occupancy = 0
+    packed = 0
+    shift = 0
+    for symbol, square in pieces:
+        occupancy |= 1 << square
+        packed |= PIECE_CODES[symbol] << shift
+        shift += 4
+    flags = 1 if black else 0
+    for bit, symbol in CASTLING_SYMBOLS:
+        if symbol in castling:
+            flags |= bit << 1
+    try:
+        RECORD.pack_into(buffer, offset, occupancy, packed.to_bytes(16, 'little'), flags,
+                         NO_SQUARE if en_passant is None else en_passant, halfmove_clock, fullmove_number)
+    except struct.error as error:
+        raise ValueError(f"Cannot encode position: {error}") from error
+
+
+def encode_board_into(board, buffer: Buffer, offset: int = 0):
+    """Write the board's position as one record at offset in a writable buffer, without building a FEN."""
+    en_passant = board.en_passant
+    _pack_into(buffer, offset, board.get_piece_squares(), board.active_color == BLACK, board.castling or '-',
+               None if en_passant is None else en_passant[0] * 8 + en_passant[1],
+               board.halfmove_clock, board.fullmove_number)
+
+
+def encode_board(board) -> bytes:
+    record = bytearray(RECORD_SIZE)
+    encode_board_into(board, record)
+    return bytes(record)
+
+
+def encode_fen_into(fen: str, buffer: Buffer, offset: int = 0):
+    """Write a FEN string as one record at offset, parsing only as much as the record needs (no board)."""
+    fen_parts = fen.split(' ')
+    if len(fen_parts) < 4:
+        raise ValueError(f"Invalid FEN string: {fen}")
+    pieces = []
+    for row, fen_row in enumerate(fen_parts[0].split('/')):
+        col = 0
+        for char in fen_row:
+            if char.isdigit():
+                col += int(char)
+            else:
+                if char not in PIECE_CODES or row > 7 or col > 7:
+                    raise ValueError(f"Invalid FEN string: {fen}")
+                pieces.append((char, row * 8 + col))
+                col += 1
+    en_passant = None
+    if fen_parts[3] != '-':
+        en_passant = (8 - int(fen_parts[3][1])) * 8 + ord(fen_parts[3][0]) - ord('a')
+    halfmove_clock = int(fen_parts[4]) if len(fen_parts) > 4 else 0
+    fullmove_number = int(fen_parts[5]) if len(fen_parts) > 5 else 1
+    _pack_into(buffer, offset, pieces, fen_parts[1] == 'b', fen_parts[2], en_passant, halfmove_clock, fullmove_number)
+
+
+def encode_fen(fen: str) -> bytes:
+    record = bytearray(RECORD_SIZE)
+    encode_fen_into(fen, record)
+    return bytes(record)
+
+
+def encode_many(positions: Iterable, buffer: Optional[bytearray] = None) -> bytearray:
+    """Append the records of boards or FEN strings to one buffer; a board may be the same object moved between items."""
+    buffer = bytearray() if buffer is None else buffer
+    for position in positions:
+        _append(buffer, position)
+    return buffer
+
+
+def _append(buffer: bytearray, position):
+    offset = len(buffer)
+    buffer.extend(EMPTY_RECORD)
+    try:
+        if isinstance(position, str):
+            encode_fen_into(position, buffer, offset)
+        else:
+            encode_board_into(position, buffer, offset)
+    except (ValueError, IndexError):
+        del buffer[offset:]
+        raise
+
+
+def _unpack(fields: Tuple) -> PackedPosition:
+    occupancy, packed, flags, en_passant, halfmove_clock, fullmove_number = fields
+    pieces = []
+    index = 0
+    while occupancy:
+        low_bit = occupancy & -occupancy
+        pieces.append((PIECE_SYMBOLS[(packed[index >> 1] >> (4 * (index & 1))) & 15], low_bit.bit_length() - 1))
+        occupancy ^= low_bit
+        index += 1
+    castling = ''.join(symbol for bit, symbol in CASTLING_SYMBOLS if flags >> 1 & bit)
+    return PackedPosition(pieces, BLACK if flags & 1 else WHITE, castling or '-',
+                          None if en_passant == NO_SQUARE else en_passant, halfmove_clock, fullmove_number)
+
+
+def decode(buffer: Buffer, index: int = 0) -> PackedPosition:
+    """Decode the index-th record of a buffer in place."""
+    return _unpack(RECORD.unpack_from(buffer, index * RECORD_SIZE))
+
+
+def iter_decode(buffer: Buffer) -> Iterator[PackedPosition]:
+    """Decode every record of a buffer in order, reading it in place."""
+    if len(buffer) % RECORD_SIZE:
+        raise ValueError(f"Buffer is not a whole number of {RECORD_SIZE}-byte records")
+    for fields in RECORD.iter_unpack(buffer):
+        yield _unpack(fields)
+
+
+def decode_batch(buffer: Buffer):
+    """Decode every record of a buffer at once into a batch_movegen.PositionBatch (needs NumPy).
+
+    The records are viewed in place as a structured array, so a memory-mapped file is never copied as a whole.
+    """
+    import numpy as np
+    from batch_movegen import PositionBatch
+
+    records = np.frombuffer(buffer, dtype=np.dtype([
+        ('occupancy', '<u8'), ('pieces', 'u1', 16), ('flags', 'u1'), ('en_passant', 'u1'),
+        ('halfmove_clock', '<u2'), ('fullmove_number', '<u2'), ('padding', 'V2')]))
+    occupied = ((records['occupancy'][:, None] >> np.arange(64, dtype=np.uint64)) & 1).astype(bool)
+    nibbles = np.empty((len(records), MAX_PIECES), dtype=np.uint8)
+    nibbles[:, 0::2] = records['pieces'] & 15
+    nibbles[:, 1::2] = records['pieces'] >> 4
+    # The n-th occupied square holds the n-th nibble
+    order = np.maximum(np.cumsum(occupied, axis=1) - 1, 0)
+    pieces = np.where(occupied, np.take_along_axis(nibbles, order, axis=1) + 1, 0).astype(np.uint8)
+    en_passant = np.where(records['en_passant'] == NO_SQUARE, -1, records['en_passant']).astype(np.int8)
+    return PositionBatch(pieces, records['flags'] & 1, (records['flags'] >> 1) & 15, en_passant)
+
+
+class PositionFile:
+    """Read-only file of position records, memory-mapped so any record can be read by index without loading the rest."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        size = self._file.seek(0, 2)
+        if size % RECORD_SIZE:
+            self._file.close()
+            raise ValueError(f"Invalid position file: {path} is not a whole number of {RECORD_SIZE}-byte records")
+        # mmap cannot map an empty file; an empty file simply has no positions
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self._count = size // RECORD_SIZE
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index: int) -> PackedPosition:
+        return decode(self._map, self._index(index))
+
+    def __iter__(self) -> Iterator[PackedPosition]:
+        return iter_decode(self._map)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError('position index out of range')
+        return index
+
+    def record(self, index: int) -> memoryview:
+        """The raw bytes of one record, as a view into the mapping."""
+        index = self._index(index)
+        return memoryview(self._map)[index * RECORD_SIZE:(index + 1) * RECORD_SIZE]
+
+    @property
+    def buffer(self) -> Buffer:
+        """The whole mapping, for decode_batch and other bulk readers."""
+        return self._map
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+        self._file.close()
+
+
+def write_positions(path: str, positions: Iterable, chunk_size: int = 4096) -> int:
+    """Write boards or FEN strings as a position file, a chunk of records at a time; returns the number written."""
+    written = 0
+    with open(path, 'wb') as position_file:
+        chunk = bytearray()
+        for position in positions:
+            _append(chunk, position)
+            written += 1
+            if len(chunk) >= chunk_size * RECORD_SIZE:
+                position_file.write(chunk)
+                chunk.clear()
+        position_file.write(chunk)
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Convert between FEN lists and packed binary position files.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    pack = commands.add_parser('pack', help='pack a file of FEN strings, one per line')
+    pack.add_argument('fens', help="FEN file to read ('-' for stdin)")
+    pack.add_argument('-o', '--output', default='positions.bin', help='position file to write (default: positions.bin)')
+    unpack = commands.add_parser('unpack', help='print the positions of a position file as FEN strings')
+    unpack.add_argument('positions', help='position file')
+    unpack.add_argument('--index', type=int, default=None, help='print only the position at this index')
+    args = parser.parse_args(argv)
+
+    if args.command == 'pack':
+        if args.fens == '-':
+            written = write_positions(args.output, read_fens(sys.stdin))
+        else:
+            with open(args.fens) as fen_file:
+                written = write_positions(args.output, read_fens(fen_file))
+        print(f"wrote {written} positions to {args.output}")
+        return 0
+
+    with PositionFile(args.positions) as positions:
+        if args.index is not None:
+            print(positions[args.index].fen())
+        else:
+            for position in positions:
+                print(position.fen())
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,346 @@
+import argparse
+import mmap
+import os
+import sys
+import time
+from array import array
+from collections import defaultdict
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from chess_bitboard import KING_ATTACKS, KNIGHT_ATTACKS, PAWN_ATTACKS, bishop_attacks, rook_attacks
+from perft import BACKENDS, START_FEN, move_to_coordinates
+
+# One signed byte per position, from the side to move's point of view: 0 is a draw, n > 0 mates in
+# n plies, -n - 1 is mated in n plies (-1 is checkmate on the board). INVALID marks impossible positions
+DRAW = 0
+INVALID = -128
+MAX_PIECES = 3
+TABLEBASE_DIR = 'tablebases'
+PIECE_TYPES = 'QRBNP'  # The piece that goes with the two kings
+DEPENDENCIES = {'P': 'QR'}  # A pawn promotes into these tables
+
+# Pawnless tables put the strong king in the a1-d1-d4 triangle (10 squares) by mirroring and rotating
+# the board; pawn tables can only be mirrored left to right and keep the pawn on files a-d instead
+TRIANGLE = [(7 - rank) * 8 + file for file in range(4) for rank in range(file + 1)]
+TRIANGLE_INDEX = {square: index for index, square in enumerate(TRIANGLE)}
+PAWN_SQUARES = [row * 8 + col for row in range(1, 7) for col in range(4)]
+PAWN_INDEX = {square: index for index, square in enumerate(PAWN_SQUARES)}
+TABLE_SIZES = {piece_type: (len(PAWN_SQUARES) if piece_type == 'P' else len(TRIANGLE)) * 64 * 64 * 2
+               for piece_type in PIECE_TYPES}
+
+
+class TablebaseResult(NamedTuple):
+    wdl: int  # 1 the side to move wins, 0 draw, -1 the side to move loses
+    dtm: int  # Plies to mate with best play, 0 for draws
+
+
+def table_name(piece_type: str) -> str:
+    return f"K{piece_type}K"
+
+
+def _transpose(square: int) -> int:
+    # Mirror in the a1-h8 diagonal
+    row, col = divmod(square, 8)
+    return (7 - col) * 8 + 7 - row
+
+
+def _index(piece_type: str, strong_king: int, weak_king: int, piece: int, side: int) -> int:
+    """Table index of a position with the strong side's pieces seen as white (moving towards row 0)."""
+    if piece_type == 'P':
+        if piece & 7 > 3:
+            strong_king, weak_king, piece = strong_king ^ 7, weak_king ^ 7, piece ^ 7
+        return ((PAWN_INDEX[piece] * 64 + strong_king) * 64 + weak_king) * 2 + side
+    if strong_king & 7 > 3:
+        strong_king, weak_king, piece = strong_king ^ 7, weak_king ^ 7, piece ^ 7
+    if strong_king < 32:
+        strong_king, weak_king, piece = strong_king ^ 56, weak_king ^ 56, piece ^ 56
+    if 7 - (strong_king >> 3) > strong_king & 7:
+        strong_king, weak_king, piece = _transpose(strong_king), _transpose(weak_king), _transpose(piece)
+    return ((TRIANGLE_INDEX[strong_king] * 64 + weak_king) * 64 + piece) * 2 + side
+
+
+def _attacks(piece_type: str, square: int, occupied: int) -> int:
+    if piece_type == 'N':
+        return KNIGHT_ATTACKS[square]
+    if piece_type == 'P':
+        return PAWN_ATTACKS[0][square]
+    attacks = 0
+    if piece_type in 'QR':
+        attacks |= rook_attacks(square, occupied)
+    if piece_type in 'QB':
+        attacks |= bishop_attacks(square, occupied)
+    return attacks
+
+
+def _bits(bitboard: int) -> Iterator[int]:
+    while bitboard:
+        low = bitboard & -bitboard
+        yield low.bit_length() - 1
+        bitboard ^= low
+
+
+def _positions(piece_type: str) -> Iterator[Tuple[int, int, int]]:
+    # One (strong king, weak king, piece) per index, in index order without the side to move
+    if piece_type == 'P':
+        for piece in PAWN_SQUARES:
+            for strong_king in range(64):
+                for weak_king in range(64):
+                    yield strong_king, weak_king, piece
+    else:
+        for strong_king in TRIANGLE:
+            for weak_king in range(64):
+                for piece in range(64):
+                    yield strong_king, weak_king, piece
+
+
+def _signed(value: int) -> int:
+    return value - 256 if value > 127 else value
+
+
+def build_table(piece_type: str, tables: Dict[str, bytes]) -> bytes:
+    """Solve a king + piece against king table by retrograde analysis.
+
+    Every position's moves are generated once; positions are then resolved backwards from the
+    checkmates in order of distance, following the reversed move graph. tables must already hold
+    the tables a pawn promotes into.
+    """
+    size = TABLE_SIZES[piece_type]
+    values: List[Optional[int]] = [INVALID] * size
+    remaining = array('i', bytes(4 * size))  # Moves not yet known to lose for the side to move
+    escape = bytearray(size)  # Has a move into a drawn position outside this table
+    sources, targets = array('I'), array('I')
+    buckets: Dict[int, List[int]] = defaultdict(list)
+
+    for position, (strong_king, weak_king, piece) in enumerate(_positions(piece_type)):
+        if len({strong_king, weak_king, piece}) < 3 or KING_ATTACKS[strong_king] >> weak_king & 1:
+            continue
+        occupied = 1 << strong_king | 1 << weak_king | 1 << piece
+        in_check = _attacks(piece_type, piece, occupied) >> weak_king & 1
+        for side in (0, 1):
+            index = position * 2 + side
+            if side == 0 and in_check:  # The weak side would be in check with the strong side to move
+                continue
+            successors = []
+            win = None
+            if side == 0:
+                for square in _bits(KING_ATTACKS[strong_king] & ~KING_ATTACKS[weak_king] & ~(1 << piece)):
+                    successors.append(_index(piece_type, square, weak_king, piece, 1))
+                if piece_type == 'P':
+                    square = piece - 8
+                    if not occupied >> square & 1:
+                        if square < 8:
+                            for promotion in 'QRBN':
+                                value = DRAW
+                                if promotion in tables:
+                                    value = _signed(tables[promotion][_index(promotion, strong_king, weak_king, square, 1)])
+                                if value < 0 and (win is None or -value < win):
+                                    win = -value
+                                escape[index] = escape[index] or value == DRAW
+                        else:
+                            successors.append(_index(piece_type, strong_king, weak_king, square, 1))
+                            if piece >= 48 and not occupied >> (square - 8) & 1:
+                                successors.append(_index(piece_type, strong_king, weak_king, square - 8, 1))
+                else:
+                    for square in _bits(_attacks(piece_type, piece, occupied) & ~(1 << strong_king | 1 << weak_king)):
+                        successors.append(_index(piece_type, strong_king, weak_king, square, 1))
+            else:
+                without_king = occupied ^ 1 << weak_king
+                for square in _bits(KING_ATTACKS[weak_king] & ~KING_ATTACKS[strong_king]):
+                    if square == piece:
+                        escape[index] = 1  # Capturing the undefended piece leaves two bare kings
+                    elif not _attacks(piece_type, piece, without_king | 1 << square) >> square & 1:
+                        successors.append(_index(piece_type, strong_king, square, piece, 0))
+            values[index] = None
+            if not successors and not escape[index] and win is None:
+                if side == 1 and in_check:
+                    values[index] = -1
+                    buckets[0].append(index)
+                else:
+                    values[index] = DRAW
+                continue
+            if win is not None:
+                values[index] = win
+                buckets[win].append(index)
+            remaining[index] = len(successors)
+            for successor in successors:
+                sources.append(index)
+                targets.append(successor)
+
+    # Reverse the move graph: predecessors[offsets[p]:offsets[p + 1]] are the positions that can move to p
+    offsets = array('I', bytes(4 * (size + 1)))
+    for target in targets:
+        offsets[target + 1] += 1
+    for index in range(size):
+        offsets[index + 1] += offsets[index]
+    fill = array('I', offsets)
+    predecessors = array('I', bytes(4 * len(targets)))
+    for source, target in zip(sources, targets):
+        predecessors[fill[target]] = source
+        fill[target] += 1
+    del sources, targets, fill
+
+    distance = 0
+    final = bytearray(size)
+    while buckets:
+        for index in buckets.pop(distance, []):
+            value = values[index]
+            if final[index] or value != (distance if value > 0 else -distance - 1):
+                continue  # Superseded by a shorter win
+            final[index] = 1
+            for predecessor in predecessors[offsets[index]:offsets[index + 1]]:
+                if final[predecessor]:
+                    continue
+                current = values[predecessor]
+                if value < 0:  # Moving here mates or wins, so the predecessor wins one ply later
+                    if current is None or current > distance + 1:
+                        values[predecessor] = distance + 1
+                        buckets[distance + 1].append(predecessor)
+                else:
+                    remaining[predecessor] -= 1
+                    if remaining[predecessor] == 0 and current is None and not escape[predecessor]:
+                        values[predecessor] = -distance - 2  # Every move loses, the last one to resolve lasts longest
+                        buckets[distance + 1].append(predecessor)
+        distance += 1
+    return array('b', (DRAW if value is None else value for value in values)).tobytes()
+
+
+class Tablebase:
+    """Memory-mapped tables for the king + piece against king endings found in a directory."""
+
+    def __init__(self, directory: str = TABLEBASE_DIR):
+        self.directory = directory
+        self._files = []
+        self._tables: Dict[str, mmap.mmap] = {}
+        for piece_type in PIECE_TYPES:
+            path = os.path.join(directory, table_name(piece_type) + '.tb')
+            if not os.path.exists(path):
+                continue
+            table_file = open(path, 'rb')
+            if table_file.seek(0, 2) != TABLE_SIZES[piece_type]:
+                table_file.close()
+                raise ValueError(f"Invalid tablebase file: {path}")
+            self._files.append(table_file)
+            self._tables[piece_type] = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @property
+    def tables(self) -> List[str]:
+        return [table_name(piece_type) for piece_type in self._tables]
+
+    def close(self):
+        for table in self._tables.values():
+            table.close()
+        for table_file in self._files:
+            table_file.close()
+
+    def probe(self, board) -> Optional[TablebaseResult]:
+        """Look up the board's position, or None when it has more pieces or no table covers it."""
+        pieces = board.get_piece_squares()
+        if len(pieces) > MAX_PIECES:
+            return None
+        if len(pieces) == 2:
+            return TablebaseResult(0, 0)
+        if board.castling not in (None, '', '-'):
+            return None
+        squares = {symbol: square for symbol, square in pieces}
+        piece_symbol = next(symbol for symbol in squares if symbol not in 'Kk')
+        table = self._tables.get(piece_symbol.upper())
+        if table is None:
+            return None
+        if piece_symbol.isupper():
+            strong_king, weak_king, piece = squares['K'], squares['k'], squares[piece_symbol]
+            side = 0 if board.active_color == 'w' else 1
+        else:  # Flip the board so the strong side plays up the board as white
+            strong_king, weak_king, piece = squares['k'] ^ 56, squares['K'] ^ 56, squares[piece_symbol] ^ 56
+            side = 0 if board.active_color == 'b' else 1
+        value = _signed(table[_index(piece_symbol.upper(), strong_king, weak_king, piece, side)])
+        if value == INVALID:
+            return None
+        if value > 0:
+            return TablebaseResult(1, value)
+        if value < 0:
+            return TablebaseResult(-1, -value - 1)
+        return TablebaseResult(0, 0)
+
+    def best_move(self, board) -> Optional[Tuple[Tuple, TablebaseResult]]:
+        """The move that mates fastest, holds the draw or resists longest, with the result it keeps."""
+        best = None
+        for move in board.get_legal_moves():
+            board.make_move(*move)
+            try:
+                reply = self.probe(board)
+            finally:
+                board.unmake_move()
+            if reply is None:
+                continue
+            result = TablebaseResult(-reply.wdl, reply.dtm + 1 if reply.wdl else 0)
+            # Wins rank above draws above losses; quicker wins and slower losses first
+            rank = (result.wdl, -result.dtm if result.wdl > 0 else result.dtm)
+            if best is None or rank > best[0]:
+                best = rank, move, result
+        board.get_legal_moves()  # Rebuild ChessBoard's cached moves for the position
+        return (best[1], best[2]) if best is not None else None
+
+
+def build_tables(piece_types: str, directory: str = TABLEBASE_DIR, verbose: bool = True) -> List[str]:
+    """Build the requested tables and the ones they depend on into directory; returns the files written."""
+    os.makedirs(directory, exist_ok=True)
+    order = []
+    for piece_type in piece_types:
+        for needed in DEPENDENCIES.get(piece_type, '') + piece_type:
+            if needed not in order:
+                order.append(needed)
+    tables: Dict[str, bytes] = {}
+    written = []
+    for piece_type in order:
+        start = time.perf_counter()
+        tables[piece_type] = build_table(piece_type, tables)
+        path = os.path.join(directory, table_name(piece_type) + '.tb')
+        with open(path, 'wb') as table_file:
+            table_file.write(tables[piece_type])
+        written.append(path)
+        if verbose:
+            values = array('b', tables[piece_type])
+            wins = sum(1 for value in values if 0 < value < 127)
+            longest = max(values)
+            print(f"{table_name(piece_type)}: {len(values)} positions, {wins} wins for the side to move, "
+                  f"longest mate {longest} plies, {time.perf_counter() - start:.1f}s")
+    return written
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Build or probe the king + piece against king endgame tables.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='generate tables by retrograde analysis')
+    build.add_argument('tables', nargs='*', default=['KQK', 'KRK', 'KPK'], help='tables to build (default: KQK KRK KPK)')
+    build.add_argument('--dir', default=TABLEBASE_DIR, help=f'output directory (default: {TABLEBASE_DIR})')
+    probe = commands.add_parser('probe', help='look up a position and its best move')
+    probe.add_argument('--fen', default=START_FEN, help='position to look up')
+    probe.add_argument('--dir', default=TABLEBASE_DIR, help=f'tablebase directory (default: {TABLEBASE_DIR})')
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        piece_types = ''
+        for name in args.tables:
+            if len(name) != 3 or name[0] != 'K' or name[2] != 'K' or name[1] not in PIECE_TYPES:
+                parser.error(f"unknown table {name}, expected one of " + ', '.join(map(table_name, PIECE_TYPES)))
+            piece_types += name[1]
+        build_tables(piece_types, args.dir)
+        return 0
+
+    tablebase = Tablebase(args.dir)
+    board = BACKENDS['bitboard']()
+    board.process_fen_string(args.fen)
+    result = tablebase.probe(board)
+    if result is None:
+        print("not in the tablebase")
+        return 1
+    print(f"wdl {result.wdl} dtm {result.dtm}")
+    best = tablebase.best_move(board)
+    if best is not None:
+        print(f"bestmove {move_to_coordinates(best[0])}")
+    tablebase.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
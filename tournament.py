@@ -0,0 +1,225 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from chess_board import CHECKMATE, ONGOING, WHITE
+from engine import MAX_PLY, Engine
+from perft import BACKENDS, START_FEN
+from pgn import write_game
+
+Move = Tuple[int, int, int, int, Optional[str]]
+
+
+class PlayerSpec(NamedTuple):
+    """A player: 'random', or a search limited by any of depth, time (seconds per move) and nodes."""
+    name: str
+    depth: Optional[int] = None
+    time: Optional[float] = None
+    nodes: Optional[int] = None
+
+    @property
+    def is_random(self) -> bool:
+        return self.name == 'random'
+
+
+class GameResult(NamedTuple):
+    number: int
+    white: str
+    black: str
+    result: str  # '1-0', '0-1' or '1/2-1/2'
+    reason: str
+    start_fen: str
+    moves: List[Move]
+    nodes: int  # Nodes searched by both sides
+    search_time: float
+    time: float
+
+
+def parse_player(text: str) -> PlayerSpec:
+    """Parse 'random' or comma-separated limits such as 'depth=3' or 'time=0.1,depth=8'."""
+    if text == 'random':
+        return PlayerSpec('random')
+    limits = {}
+    for part in text.split(','):
+        key, _, value = part.partition('=')
+        if key not in ('depth', 'time', 'nodes') or not value:
+            raise ValueError(f"Invalid player: {text}, expected 'random' or depth=N, time=SECONDS, nodes=N")
+        limits[key] = float(value) if key == 'time' else int(value)
+    return PlayerSpec(text, **limits)
+
+
+def adjudicate(board) -> Optional[Tuple[str, str]]:
+    """Return (result, reason) when the game is over, None while it goes on."""
+    status = board.game_status()
+    if status == ONGOING:
+        return None
+    if status == CHECKMATE:
+        return ('0-1' if board.active_color == WHITE else '1-0'), status
+    return '1/2-1/2', status
+
+
+def play_game(number: int, white: PlayerSpec, black: PlayerSpec, seed: int, random_plies: int = 0,
+              max_plies: int = 400, backend: str = 'bitboard') -> GameResult:
+    """Play one game between two players; the first random_plies moves are random for opening variety."""
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    board = BACKENDS[backend]()
+    board.process_fen_string(START_FEN)
+    for _ in range(random_plies):
+        moves = board.get_legal_moves()
+        if not moves:
+            break
+        board.play(rng.choice(moves))
+    start_fen = board.get_fen_string()
+    board.process_fen_string(start_fen)  # Start the game record here, with an empty undo stack
+
+    engines = {WHITE: Engine(), 'b': Engine()}
+    players = {WHITE: white, 'b': black}
+    moves: List[Move] = []
+    nodes = 0
+    search_time = 0.0
+    while True:
+        over = adjudicate(board)
+        if over is not None:
+            result, reason = over
+            break
+        if len(moves) >= max_plies:
+            result, reason = '1/2-1/2', 'move limit'
+            break
+        player = players[board.active_color]
+        if player.is_random:
+            move = rng.choice(board.get_legal_moves())
+        else:
+            search = engines[board.active_color].search(board, player.depth or MAX_PLY, player.time, player.nodes)
+            move = search.best_move
+            nodes += search.nodes
+            search_time += search.time
+        board.play(move)
+        moves.append(move)
+    return GameResult(number, white.name, black.name, result, reason, start_fen, moves, nodes, search_time,
+                      time.perf_counter() - start)
+
+
+def schedule(first: PlayerSpec, second: PlayerSpec, games: int, seed: int) -> Iterator[Tuple]:
+    # Games come in pairs sharing a random opening, with the colors swapped
+    for number in range(games):
+        pair_seed = seed + number // 2
+        if number % 2 == 0:
+            yield number + 1, first, second, pair_seed
+        else:
+            yield number + 1, second, first, pair_seed
+
+
+def elo_difference(wins: int, draws: int, losses: int) -> Tuple[float, float]:
+    """Elo difference implied by a score and the half-width of its 95% confidence interval.
+
+    A clean sweep either way has an infinite difference and no finite interval, so its margin is inf.
+    """
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0, math.inf
+    score = (wins + draws / 2) / games
+    if score in (0, 1):
+        return (math.inf if score else -math.inf), math.inf
+    variance = (wins * (1 - score) ** 2 + draws * (0.5 - score) ** 2 + losses * score ** 2) / games
+    margin = 1.96 * math.sqrt(variance / games)
+
+    def elo(value: float) -> float:
+        if value <= 0:
+            return -math.inf
+        if value >= 1:
+            return math.inf
+        return 400 * math.log10(value / (1 - value))
+
+    return elo(score), (elo(score + margin) - elo(score - margin)) / 2
+
+
+def run_match(first: PlayerSpec, second: PlayerSpec, games: int, workers: int = 1, seed: int = 1,
+              random_plies: int = 4, max_plies: int = 400, backend: str = 'bitboard',
+              pgn_path: Optional[str] = None, results_path: Optional[str] = None, verbose: bool = True) -> Dict:
+    """Play a match across a process pool, appending every finished game to the PGN and results files."""
+    tally = {'wins': 0, 'draws': 0, 'losses': 0}  # From the first player's point of view
+    nodes = 0
+    search_time = 0.0
+    start = time.perf_counter()
+    pgn_file = open(pgn_path, 'a') if pgn_path else None
+    results_file = open(results_path, 'a') if results_path else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(play_game, number, white, black, game_seed, random_plies, max_plies, backend)
+                       for number, white, black, game_seed in schedule(first, second, games, seed)]
+            for finished, future in enumerate(as_completed(futures), start=1):
+                game = future.result()
+                first_is_white = game.number % 2 == 1
+                if game.result == '1/2-1/2':
+                    tally['draws'] += 1
+                elif (game.result == '1-0') == first_is_white:
+                    tally['wins'] += 1
+                else:
+                    tally['losses'] += 1
+                nodes += game.nodes
+                search_time += game.search_time
+                if pgn_file is not None:
+                    headers = {'Event': 'Self-play match', 'Site': 'tournament.py', 'Round': str(game.number),
+                               'White': game.white, 'Black': game.black, 'Termination': game.reason}
+                    write_game(pgn_file, game.moves, headers, game.start_fen, game.result, backend)
+                    pgn_file.flush()
+                if results_file is not None:
+                    results_file.write(json.dumps({'game': game.number, 'white': game.white, 'black': game.black,
+                                                   'result': game.result, 'reason': game.reason,
+                                                   'plies': len(game.moves), 'nodes': game.nodes,
+                                                   'time': round(game.time, 3)}) + '\n')
+                    results_file.flush()
+                if verbose:
+                    score = tally['wins'] + tally['draws'] / 2
+                    print(f"game {game.number} ({finished}/{games}): {game.white} - {game.black} {game.result} "
+                          f"({game.reason}, {len(game.moves)} plies)  {first.name} {score}/{finished}")
+    finally:
+        if pgn_file is not None:
+            pgn_file.close()
+        if results_file is not None:
+            results_file.close()
+
+    elapsed = time.perf_counter() - start
+    elo, margin = elo_difference(tally['wins'], tally['draws'], tally['losses'])
+    return dict(tally, games=games, elo=elo, elo_margin=margin, time=elapsed,
+                games_per_hour=games / elapsed * 3600 if elapsed > 0 else 0.0,
+                nps=int(nodes / search_time) if search_time > 0 else 0)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Play an engine-vs-engine match without a window.')
+    parser.add_argument('first', help="first player: 'random' or limits like depth=3, time=0.1 or nodes=20000")
+    parser.add_argument('second', help='second player, same format')
+    parser.add_argument('--games', type=int, default=100, help='games to play, colors alternate')
+    parser.add_argument('--workers', type=int, default=0, help='worker processes, 0 for one per CPU core')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the random openings and random players')
+    parser.add_argument('--random-plies', type=int, default=4, help='random opening plies, shared by each pair of games')
+    parser.add_argument('--max-plies', type=int, default=400, help='adjudicate a draw after this many plies')
+    parser.add_argument('--pgn', default=None, help='append the games to this PGN file')
+    parser.add_argument('--results', default=None, help='append one JSON line per game to this file')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard', help='board implementation to use')
+    args = parser.parse_args(argv)
+    try:
+        first, second = parse_player(args.first), parse_player(args.second)
+    except ValueError as error:
+        parser.error(str(error))
+
+    summary = run_match(first, second, args.games, args.workers or os.cpu_count() or 1, args.seed,
+                        args.random_plies, args.max_plies, args.backend, args.pgn, args.results)
+    margin = f" +/- {summary['elo_margin']:.0f} (95%)" if math.isfinite(summary['elo']) else ''
+    print(f"{first.name} vs {second.name}: +{summary['wins']} ={summary['draws']} -{summary['losses']}  "
+          f"Elo {summary['elo']:+.0f}{margin}")
+    print(f"{summary['games']} games in {summary['time']:.1f}s, {summary['games_per_hour']:.0f} games/hour, "
+          f"average {summary['nps']} nodes/s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
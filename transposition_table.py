@@ -0,0 +1,56 @@
+from typing import List, NamedTuple, Optional
+
+# How the stored score relates to the true score of the position
+EXACT = 0
+LOWER_BOUND = 1  # The search failed high, the true score is at least this
+UPPER_BOUND = 2  # The search failed low, the true score is at most this
+
+
+class TTEntry(NamedTuple):
+    key: int
+    depth: int
+    score: int
+    flag: int
+    best_move: Optional[object]
+
+
+class TranspositionTable:
+    """Fixed-size hash table of search results indexed by Zobrist key, replacing shallower entries first."""
+
+    def __init__(self, size: int = 1 << 18):
+        self.resize(size)
+
+    def resize(self, size: int):
+        """Round the number of slots down to a power of two so the index is a single mask."""
+        slots = 1
+        while slots * 2 <= size:
+            slots *= 2
+        self.mask = slots - 1
+        self.entries: List[Optional[TTEntry]] = [None] * slots
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def clear(self):
+        self.entries = [None] * len(self.entries)
+        self.hits = 0
+        self.misses = 0
+
+    def probe(self, key: int) -> Optional[TTEntry]:
+        entry = self.entries[key & self.mask]
+        if entry is not None and entry.key == key:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        return None
+
+    def store(self, key: int, depth: int, score: int, flag: int, best_move: Optional[object] = None):
+        index = key & self.mask
+        entry = self.entries[index]
+        # Keep a deeper result for another position; always refresh the same position
+        if entry is None or entry.key == key or depth >= entry.depth:
+            if best_move is None and entry is not None and entry.key == key:
+                best_move = entry.best_move
+            self.entries[index] = TTEntry(key, depth, score, flag, best_move)
@@ -0,0 +1,169 @@
+import argparse
+import sys
+import threading
+from typing import List, Optional, TextIO
+
+from chess_board import WHITE
+from engine import MAX_PLY, Engine, SearchInfo, format_score
+from perft import BACKENDS, START_FEN, coordinates_to_move, move_to_coordinates
+
+ENGINE_NAME = 'chess'
+ENGINE_AUTHOR = 'chess contributors'
+HASH_ENTRY_BYTES = 128  # Rough size of one transposition table entry, to turn the Hash option into slots
+DEFAULT_HASH_MB = 32
+MAX_HASH_MB = 4096
+MOVE_OVERHEAD = 0.05  # Seconds kept back from every clock-based move for the GUI round trip
+
+
+def time_for_move(time_left: float, increment: float = 0.0, moves_to_go: Optional[int] = None) -> float:
+    """Seconds to spend on the next move given the clock: an even share of what is left plus most of the increment."""
+    share = time_left / (moves_to_go or 30) + increment * 0.75
+    return max(0.01, min(share, time_left - MOVE_OVERHEAD))
+
+
+class UciEngine:
+    """UCI front end: reads commands line by line and searches on a worker thread, so stop and isready answer at once."""
+
+    def __init__(self, output: TextIO = sys.stdout, backend: str = 'bitboard'):
+        self.output = output
+        self.engine = Engine(tt_size=DEFAULT_HASH_MB * (1 << 20) // HASH_ENTRY_BYTES)
+        self.board = BACKENDS[backend]()
+        self.board.process_fen_string(START_FEN)
+        self._output_lock = threading.Lock()
+        self._worker: Optional[threading.Thread] = None
+        # Set by stop; the engine clears its own flag when a search starts, so the worker checks this one too
+        self._stop_requested = threading.Event()
+
+    def send(self, line: str):
+        with self._output_lock:
+            self.output.write(line + '\n')
+            self.output.flush()
+
+    def run(self, stream: TextIO) -> int:
+        for line in stream:
+            if not self.handle(line):
+                break
+        self.wait()
+        return 0
+
+    def handle(self, line: str) -> bool:
+        """Run one command; returns False on quit. Unknown commands are ignored, as the protocol asks."""
+        tokens = line.split()
+        if not tokens:
+            return True
+        command, args = tokens[0], tokens[1:]
+        if command == 'uci':
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            self.send(f"option name Hash type spin default {DEFAULT_HASH_MB} min 1 max {MAX_HASH_MB}")
+            self.send('uciok')
+        elif command == 'isready':
+            self.send('readyok')
+        elif command == 'setoption':
+            self.wait()
+            self._set_option(args)
+        elif command == 'ucinewgame':
+            self.wait()
+            self.engine.tt.clear()
+            self.engine.pawn_table.clear()
+        elif command == 'position':
+            self.wait()
+            self._set_position(args)
+        elif command == 'go':
+            self.wait()
+            self._go(args)
+        elif command == 'stop':
+            self.stop()
+        elif command == 'quit':
+            self.stop()
+            return False
+        return True
+
+    def stop(self):
+        self._stop_requested.set()
+        self.engine.stop()
+
+    def wait(self):
+        """Stop a running search and wait for its bestmove, so the next command sees an idle engine."""
+        if self._worker is not None:
+            self.stop()
+            self._worker.join()
+            self._worker = None
+
+    def _set_option(self, args: List[str]):
+        if 'name' not in args or 'value' not in args:
+            return
+        name = ' '.join(args[args.index('name') + 1:args.index('value')])
+        value = ' '.join(args[args.index('value') + 1:])
+        if name.lower() == 'hash':
+            try:
+                megabytes = min(max(int(value), 1), MAX_HASH_MB)
+            except ValueError:
+                self.send(f"info string invalid Hash value {value}")
+                return
+            self.engine.tt.resize(megabytes * (1 << 20) // HASH_ENTRY_BYTES)
+        else:
+            self.send(f"info string unknown option {name}")
+
+    def _set_position(self, args: List[str]):
+        moves_at = args.index('moves') if 'moves' in args else len(args)
+        if args[:1] == ['startpos']:
+            fen = START_FEN
+        elif args[:1] == ['fen']:
+            fen = ' '.join(args[1:moves_at])
+        else:
+            return
+        try:
+            self.board.process_fen_string(fen)
+            for text in args[moves_at + 1:]:
+                self.board.play(coordinates_to_move(text))
+        except (ValueError, IndexError, KeyError) as error:
+            self.send(f"info string invalid position: {error}")
+            self.board.process_fen_string(START_FEN)
+
+    def _go(self, args: List[str]):
+        limits = {}
+        for index, token in enumerate(args[:-1]):
+            if token in ('wtime', 'btime', 'winc', 'binc', 'movestogo', 'movetime', 'depth', 'nodes'):
+                try:
+                    limits[token] = int(args[index + 1])
+                except ValueError:
+                    pass
+        white = self.board.active_color == WHITE
+        time_limit = None
+        if 'movetime' in limits:
+            time_limit = max(0.01, limits['movetime'] / 1000 - MOVE_OVERHEAD)
+        elif ('wtime' if white else 'btime') in limits:
+            time_limit = time_for_move(limits['wtime' if white else 'btime'] / 1000,
+                                       limits.get('winc' if white else 'binc', 0) / 1000, limits.get('movestogo'))
+        self._stop_requested.clear()
+        self._worker = threading.Thread(
+            target=self._search, args=(limits.get('depth', MAX_PLY), time_limit, limits.get('nodes'), 'infinite' in args),
+            daemon=True)
+        self._worker.start()
+
+    def _search(self, depth: int, time_limit: Optional[float], node_limit: Optional[int], infinite: bool):
+        def report(info: SearchInfo):
+            if self._stop_requested.is_set():
+                self.engine.stop()  # stop came in before the search started; end after this iteration
+            pv = ' '.join(move_to_coordinates(move) for move in info.pv)
+            self.send(f"info depth {info.depth} score {format_score(info.score)} nodes {info.nodes} "
+                      f"nps {info.nps} time {int(info.time * 1000)} pv {pv}")
+
+        result = self.engine.search(self.board, depth, time_limit, node_limit, report)
+        if infinite:
+            # An infinite search only answers when told to stop, even if it ran out of depth first
+            self._stop_requested.wait()
+        best_move = move_to_coordinates(result.best_move) if result.best_move else '0000'
+        self.send(f"bestmove {best_move}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description='Run the engine as a UCI engine over stdin and stdout.')
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='bitboard', help='board implementation to search')
+    args = parser.parse_args(argv)
+    return UciEngine(backend=args.backend).run(sys.stdin)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
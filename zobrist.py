@@ -0,0 +1,38 @@
+import random
+from typing import Iterable, Optional, Tuple
+
+# Fixed seed so keys, and anything stored under them, are the same from run to run
+_random = random.Random(20240229)
+
+PIECE_SYMBOLS = 'PNBRQKpnbrqk'
+# ZOBRIST_PIECES[symbol][square] with square = row * 8 + col
+ZOBRIST_PIECES = {symbol: [_random.getrandbits(64) for _ in range(64)] for symbol in PIECE_SYMBOLS}
+ZOBRIST_BLACK_TO_MOVE = _random.getrandbits(64)
+ZOBRIST_CASTLING = {right: _random.getrandbits(64) for right in 'KQkq'}
+ZOBRIST_EN_PASSANT_FILE = [_random.getrandbits(64) for _ in range(8)]
+
+
+def castling_key(castling: Optional[str]) -> int:
+    """XOR of the keys of every castling right in a FEN castling string."""
+    key = 0
+    if castling:
+        for right in castling:
+            key ^= ZOBRIST_CASTLING.get(right, 0)
+    return key
+
+
+def en_passant_key(en_passant: Optional[Tuple[int, int]]) -> int:
+    if en_passant is None:
+        return 0
+    return ZOBRIST_EN_PASSANT_FILE[en_passant[1]]
+
+
+def hash_position(pieces: Iterable[Tuple[str, int]], active_color: str, castling: Optional[str],
+                  en_passant: Optional[Tuple[int, int]]) -> int:
+    """Compute a Zobrist key from scratch out of (symbol, square) pairs and the FEN state fields."""
+    key = 0
+    for symbol, square in pieces:
+        key ^= ZOBRIST_PIECES[symbol][square]
+    if active_color == 'b':
+        key ^= ZOBRIST_BLACK_TO_MOVE
+    return key ^ castling_key(castling) ^ en_passant_key(en_passant)